@@ -1,24 +1,474 @@
 import socket
+import select
 import struct
 import threading
 import time
 import json
+import itertools
+import collections
+from concurrent.futures import Future
 import numpy as np
 
+# ADC frame header: sequence number, acquisition timestamp (s), decimation, samples per channel,
+# sample format (index into ADC_DTYPES), trigger source (index into ADC_TRIGGER_SOURCES), trigger level (V),
+# acquisition mode (index into ADC_MODES), then for continuous chunks the absolute index of the first
+# sample and the running count of samples lost to ring buffer overruns on the Red Pitaya
+ADC_HEADER = struct.Struct("<QdIIIIfIQQ")
+ADC_MODES = ("frames", "continuous")
+ADC_DTYPES = (np.dtype("<f4"), np.dtype("<i2"))  # float volts, raw 14-bit counts
+ADC_TRIGGER_SOURCES = ("now", "ch1_pe", "ch1_ne", "ch2_pe", "ch2_ne", "ext_pe", "ext_ne")
+
+# Droplet snippet header: droplet_id, capture timestamp (s), decimation, samples before the
+# detection span, samples in the detection span, samples per channel, sample format (index into ADC_DTYPES)
+SNIPPET_HEADER = struct.Struct("<IdIIIII")
+
+# Control port opcodes
+OP_CONFIGURE_ADC = 1
+OP_CONFIGURE_SNIPPETS = 2
+OP_GET_TELEMETRY = 3
+OP_CONFIGURE_HISTOGRAMS = 4
+OP_CONFIGURE_ADC_UDP = 5
+OP_SHUTDOWN = 99
+
+# Client latency histograms use power-of-two buckets in microseconds, as the Red Pitaya telemetry does
+N_LATENCY_BUCKETS = 32
+METRICS_WINDOW_S = 10.0
+
+# droplet_id is a 32-bit FPGA counter; the loss-rate series gets one point per interval
+DROPLET_ID_BITS = 32
+DROPLET_LOSS_INTERVAL_S = 1.0
+DROPLET_LOSS_HISTORY = 3600
+
+def recv_into(sock, view):
+    """Fill a writable buffer (e.g. a memoryview slice) from the socket; False if the connection closed."""
+    view = memoryview(view).cast("B")
+    received = 0
+    while received < len(view):
+        n = sock.recv_into(view[received:])
+        if not n:
+            return False
+        received += n
+    return True
+
+
 def recv_data(sock, size):
     """Helper function to receive correct 'size' bytes."""
-    data = b''
-    while len(data) < size:
-        packet = sock.recv(size - len(data))
-        if not packet:
-            return None
-        data += packet
+    data = bytearray(size)
+    if not recv_into(sock, data):
+        return None
     return data
 
 
+def frame_message(msg, count=0):
+    """Prefix a message with the 16-byte (length, count) header used on every port."""
+    return struct.pack("II", len(msg), count).ljust(16, b'\x00') + msg
+
+
+def recv_message(sock):
+    """Receive one framed message; returns (msg, count), or (None, 0) if the connection closed."""
+    header = recv_data(sock, 16)
+    if header is None:
+        return None, 0
+    msg_len, count = struct.unpack("II", header[:8])
+    return recv_data(sock, msg_len), count
+
+
+class RollingLatency:
+    """Log2-bucketed latency histogram for one metrics window."""
+    def __init__(self):
+        self.buckets = [0] * N_LATENCY_BUCKETS
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def observe(self, seconds):
+        """Record one duration in seconds."""
+        self.buckets[min(int(seconds * 1e6).bit_length(), N_LATENCY_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_s += seconds
+        if seconds > self.max_s:
+            self.max_s = seconds
+
+    def merge(self, other):
+        """Add another window's histogram into this one."""
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.total_s += other.total_s
+        self.max_s = max(self.max_s, other.max_s)
+
+    def percentile_us(self, q):
+        """Upper bound (us) of the bucket holding the q-th percentile."""
+        target = q / 100 * self.count
+        seen = 0
+        for k, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return 2 ** k
+        return 0
+
+    def snapshot(self):
+        """Summary with the non-empty buckets keyed by their upper bound in microseconds."""
+        return {
+            "count": self.count,
+            "mean_us": self.total_s / self.count * 1e6 if self.count else 0.0,
+            "p50_us": self.percentile_us(50),
+            "p99_us": self.percentile_us(99),
+            "max_us": self.max_s * 1e6,
+            "buckets_us": {f"<{2**k}": n for k, n in enumerate(self.buckets) if n},
+            }
+
+
+class ClientMetrics:
+    """Counters and rolling latency histograms updated by a client's receive loop.
+
+    Totals cover the client's lifetime; rates and latencies cover the current window plus the
+    previous one, i.e. the last window_s to 2 * window_s seconds.
+    """
+    def __init__(self, window_s=METRICS_WINDOW_S):
+        self.window_s = window_s
+        self.lock = threading.Lock()
+        self.t_start = time.monotonic()
+        self.totals = {}
+        self.windows = [self._new_window(self.t_start), self._new_window(self.t_start)]  # previous, current
+
+    def _new_window(self, now):
+        return {"t_start": now, "counters": {}, "latency": {}}
+
+    def _rotate(self, now):
+        """Start a new window once the current one is window_s old (both, after a long pause)."""
+        current = self.windows[1]
+        if now - current["t_start"] >= 2 * self.window_s:
+            self.windows = [self._new_window(now - self.window_s), self._new_window(now)]
+        elif now - current["t_start"] >= self.window_s:
+            self.windows = [current, self._new_window(now)]
+
+    def update(self, counts=None, durations=None):
+        """Add to several counters and latency histograms under a single lock acquisition."""
+        with self.lock:
+            self._rotate(time.monotonic())
+            window = self.windows[1]
+            for name, n in (counts or {}).items():
+                self.totals[name] = self.totals.get(name, 0) + n
+                window["counters"][name] = window["counters"].get(name, 0) + n
+            for name, seconds in (durations or {}).items():
+                histogram = window["latency"].get(name)
+                if histogram is None:
+                    histogram = window["latency"][name] = RollingLatency()
+                histogram.observe(seconds)
+
+    def snapshot(self):
+        """JSON-serializable totals, per-second rates and latency summaries."""
+        with self.lock:
+            now = time.monotonic()
+            self._rotate(now)
+            previous, current = self.windows
+            span = now - previous["t_start"]
+
+            rates = {}
+            latency = {}
+            for window in (previous, current):
+                for name, n in window["counters"].items():
+                    rates[name] = rates.get(name, 0) + n
+                for name, histogram in window["latency"].items():
+                    latency.setdefault(name, RollingLatency()).merge(histogram)
+
+        return {
+            "uptime_s": now - self.t_start,
+            "window_s": span,
+            "totals": dict(self.totals),
+            "per_s": {name: n / span for name, n in rates.items()} if span > 0 else {},
+            "latency": {name: histogram.snapshot() for name, histogram in latency.items()},
+            }
+
+
+class DropletCounter:
+    """droplet_id continuity accounting: received, duplicated and missed droplets.
+
+    IDs advance by one per droplet and wrap at 2**id_bits. A forward jump of n counts n - 1
+    missed droplets, a repeat (e.g. poll mode) counts a duplicate, and a backward jump (the
+    counter was reset, e.g. the FPGA was reloaded) restarts the accounting from the new ID.
+    Droplets skipped on purpose by a max_rate_hz subscription are also counted as missed.
+    """
+    def __init__(self, id_bits=DROPLET_ID_BITS, interval_s=DROPLET_LOSS_INTERVAL_S, history=DROPLET_LOSS_HISTORY):
+        self.modulus = 1 << id_bits
+        self.interval_s = interval_s
+        self.lock = threading.Lock()
+
+        # Loss-rate time series: (timestamp, received, missed, loss_rate) per interval
+        self.loss_series = collections.deque(maxlen=history)
+        self.reset()
+
+    def reset(self):
+        """Zero the running counts and the loss-rate series."""
+        with self.lock:
+            self.last_id = None
+            self.received = 0
+            self.duplicates = 0
+            self.missed = 0
+            self.wraps = 0
+            self.resets = 0
+            self._interval = [time.time(), 0, 0]  # start, received, missed
+            self.loss_series.clear()
+
+    def add(self, ids):
+        """Account a batch of droplet_ids in arrival order."""
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        if not len(ids):
+            return
+
+        with self.lock:
+            # The first droplet ever seen only sets the starting point
+            received = 0
+            if self.last_id is None:
+                self.last_id = int(ids[0])
+                ids = ids[1:]
+                received = 1
+
+            # Steps between consecutive IDs, modulo the counter width; more than half way round is a reset
+            diffs = np.diff(ids, prepend=self.last_id)
+            steps = diffs % self.modulus
+            forward = (steps > 0) & (steps < self.modulus // 2)
+            resets = int((steps >= self.modulus // 2).sum())
+            received += int(forward.sum()) + resets
+            missed = int((steps[forward] - 1).sum())
+            self.received += received
+            self.missed += missed
+            self.duplicates += int((steps == 0).sum())
+            self.resets += resets
+            self.wraps += int((forward & (diffs < 0)).sum())
+            if len(ids):
+                self.last_id = int(ids[-1])
+
+            # Close the loss-rate interval once it is interval_s old
+            now = time.time()
+            self._interval[1] += received
+            self._interval[2] += missed
+            t_start, interval_received, interval_missed = self._interval
+            if now - t_start >= self.interval_s:
+                total = interval_received + interval_missed
+                self.loss_series.append((now, interval_received, interval_missed,
+                                         interval_missed / total if total else 0.0))
+                self._interval = [now, 0, 0]
+
+    def loss_rate(self):
+        """Fraction of droplets missed since the accounting started."""
+        total = self.received + self.missed
+        return self.missed / total if total else 0.0
+
+    def snapshot(self):
+        """Running counts, overall loss rate and the latest loss-rate interval."""
+        with self.lock:
+            return {
+                "received": self.received,
+                "duplicates": self.duplicates,
+                "missed": self.missed,
+                "wraps": self.wraps,
+                "resets": self.resets,
+                "last_id": self.last_id,
+                "loss_rate": self.loss_rate(),
+                "recent_loss_rate": self.loss_series[-1][3] if self.loss_series else None,
+                }
+
+
+# What a full delivery queue does with a new item: wait for the consumer (pushing back on the
+# socket and so the Red Pitaya), drop the oldest queued item, or merge it into the newest one
+DELIVERY_POLICIES = ("block", "drop_oldest", "coalesce")
+
+
+class DeliveryQueue:
+    """Bounded queue between a client's receive loop and its consumer."""
+    def __init__(self, maxlen, policy="drop_oldest", coalesce=None):
+        if policy not in DELIVERY_POLICIES:
+            raise ValueError(f"Unsupported delivery policy: {policy}")
+        self.maxlen = maxlen
+        self.policy = policy
+        self.coalesce = coalesce or (lambda older, newer: newer)
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, item):
+        """Queue an item, applying the policy when the queue is full."""
+        with self.cond:
+            if self.policy == "block":
+                while len(self.queue) >= self.maxlen and not self.closed:
+                    self.cond.wait()
+            if self.closed:
+                return
+            if len(self.queue) >= self.maxlen:
+                if self.policy == "coalesce":
+                    self.queue[-1] = self.coalesce(self.queue[-1], item)
+                    self.coalesced += 1
+                    return
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append(item)
+            self.cond.notify_all()
+
+    def get_batch(self, max_items=None, timeout=None):
+        """Pop up to max_items (all queued by default), waiting up to timeout for the first; [] if none."""
+        with self.cond:
+            if not self.queue and not self.closed:
+                self.cond.wait(timeout)
+            n = len(self.queue) if max_items is None else min(max_items, len(self.queue))
+            batch = [self.queue.popleft() for _ in range(n)]
+            if batch:
+                self.cond.notify_all()  # room for a blocked producer
+            return batch
+
+    def open(self):
+        """Accept items again after close()."""
+        with self.cond:
+            self.closed = False
+
+    def close(self):
+        """Stop accepting items and wake any waiting producer or consumer."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def stats(self):
+        """Current depth and the overflow counts."""
+        with self.cond:
+            return {"queued": len(self.queue), "maxlen": self.maxlen, "policy": self.policy,
+                    "dropped": self.dropped, "coalesced": self.coalesced}
+
+
+class BatchPieces(list):
+    """Record batches merged in a delivery queue, joined into one batch only when the consumer takes them."""
+    def __init__(self, pieces=()):
+        super().__init__(pieces)
+        self.n_records = sum(len(piece) for piece in self)
+
+
+# ADC frames over UDP: each datagram carries the frame sequence number, frame size in bytes, byte offset
+# of its fragment, fragment index and fragment count; the reassembled frame is the ADC_HEADER and
+# samples, as on the TCP stream
+ADC_DATAGRAM_HEADER = struct.Struct("<QIIHH")
+MAX_DATAGRAM_SIZE = 65507
+ADC_UDP_RECV_BUFFER = 4 * 2**20  # bytes of kernel buffering for bursts of datagrams
+ADC_UDP_POLL_S = 0.25  # datagram sockets have no connection to shut down, so stop() is polled
+ADC_UDP_RESYNC_FRAMES = 16  # a datagram this many frames behind is a sequence reset, not reordering
+ADC_UDP_RESYNC_IDLE_S = 0.5  # as is any older frame after this long without a newer datagram
+
+
+class FrameReassembler:
+    """Reassemble frames from datagrams that may be lost, duplicated or reordered.
+
+    Frames are only completed in sequence order: once a frame completes, older incomplete ones are
+    dropped, as is the oldest one when more than max_pending frames are in flight. Sequence numbers
+    going back by resync_frames or more, or going back at all after resync_idle_s without a newer
+    datagram, mean the sender restarted its sequence, so the reassembler starts over from them.
+    """
+    def __init__(self, max_pending=4, resync_frames=ADC_UDP_RESYNC_FRAMES, resync_idle_s=ADC_UDP_RESYNC_IDLE_S):
+        if resync_frames <= max_pending:
+            raise ValueError(f"resync_frames must exceed max_pending ({max_pending}), got {resync_frames}")
+        self.max_pending = max_pending
+        self.resync_frames = resync_frames
+        self.resync_idle_s = resync_idle_s
+        self.reset()
+
+    def reset(self):
+        """Forget the frames in flight and zero the counts."""
+        self.pending = {}  # seq -> [frame buffer, received flag per fragment, fragments left, first arrival]
+        self.last_seq = None  # newest frame completed or given up on; datagrams up to it are late
+        self.t_newest = None  # arrival of the latest datagram that was not late
+        self.datagrams = 0
+        self.completed = 0
+        self.incomplete = 0  # frames dropped with fragments missing
+        self.late = 0  # datagrams of frames already completed or dropped
+        self.duplicates = 0
+        self.invalid = 0
+        self.resyncs = 0
+
+    def _drop(self, seq):
+        del self.pending[seq]
+        self.incomplete += 1
+        if self.last_seq is None or seq > self.last_seq:
+            self.last_seq = seq
+
+    def add(self, datagram):
+        """Add one datagram; returns (seq, frame buffer, n_fragments, first arrival) once its frame is complete."""
+        self.datagrams += 1
+        if len(datagram) < ADC_DATAGRAM_HEADER.size:
+            self.invalid += 1
+            return None
+        seq, frame_size, offset, index, n_fragments = ADC_DATAGRAM_HEADER.unpack_from(datagram)
+        payload = datagram[ADC_DATAGRAM_HEADER.size:]
+
+        now = time.perf_counter()
+        if self.last_seq is not None and seq <= self.last_seq:
+            if self.last_seq - seq < self.resync_frames and now - self.t_newest < self.resync_idle_s:
+                self.late += 1
+                return None
+            self.pending.clear()
+            self.last_seq = None
+            self.resyncs += 1
+        self.t_newest = now
+
+        entry = self.pending.get(seq)
+        if entry is None:
+            if not n_fragments or frame_size > n_fragments * MAX_DATAGRAM_SIZE:
+                self.invalid += 1
+                return None
+            entry = self.pending[seq] = [bytearray(frame_size), bytearray(n_fragments), n_fragments, now]
+            while len(self.pending) > self.max_pending:
+                self._drop(min(self.pending))
+            if seq not in self.pending:
+                return None
+
+        buffer, received = entry[0], entry[1]
+        if len(buffer) != frame_size or index >= len(received) or offset + len(payload) > frame_size:
+            self.invalid += 1
+            return None
+        if received[index]:
+            self.duplicates += 1
+            return None
+        received[index] = 1
+        buffer[offset:offset + len(payload)] = payload
+        entry[2] -= 1
+        if entry[2]:
+            return None
+
+        # Older frames can no longer be shown in order, and a late frame is worse than a lost one
+        del self.pending[seq]
+        for older in [s for s in self.pending if s < seq]:
+            self._drop(older)
+        self.last_seq = seq
+        self.completed += 1
+        return seq, buffer, n_fragments, entry[3]
+
+    def stats(self):
+        """Datagram and frame counts."""
+        return {"datagrams": self.datagrams, "frames": self.completed, "incomplete_frames": self.incomplete,
+                "in_flight": len(self.pending), "late_datagrams": self.late,
+                "duplicate_datagrams": self.duplicates, "invalid_datagrams": self.invalid, "resyncs": self.resyncs}
+
+
+# Connection states reported to state_callback
+CLIENT_STATES = ("connecting", "connected", "disconnected", "stopped")
+
+# Streaming sockets idle between droplets; TCP keepalive detects a dead link instead of a read timeout
+KEEPALIVE_IDLE_S = 10
+KEEPALIVE_INTERVAL_S = 5
+KEEPALIVE_COUNT = 3
+
+
 class BaseClient:
-    """Base class for all Red Pitaya clients."""
-    def __init__(self, port, is_streaming_client=True):
+    """Base class for all Red Pitaya clients.
+
+    With reconnect (the default for streaming clients), a lost connection is re-established with
+    exponential backoff from initial_backoff_s up to max_backoff_s, and the client resubscribes.
+    state_callback(state) is called with each connection state in CLIENT_STATES.
+
+    With queue_size, received items go through a DeliveryQueue (see DELIVERY_POLICIES) and
+    data_callback runs on a separate dispatcher thread, so a slow consumer never stalls the
+    socket; without a data_callback, consumers pull items with get_batch().
+    """
+    def __init__(self, port, is_streaming_client=True, reconnect=None, state_callback=None,
+                 initial_backoff_s=0.5, max_backoff_s=30.0, queue_size=None, queue_policy="drop_oldest"):
         self.port = port
         self.ip = None
         self.sock = None
@@ -27,26 +477,208 @@ class BaseClient:
         self.stop_flag = threading.Event()
         self.is_streaming_client = is_streaming_client
 
+        # Connection supervision
+        self.reconnect = is_streaming_client if reconnect is None else reconnect
+        self.state_callback = state_callback
+        self.initial_backoff_s = initial_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.state = "disconnected"
+        self.reconnects = 0
+        self._t_connected = None
+
+        # Receive-loop metrics: recv_wait (blocked until a message starts), recv (rest of the message),
+        # decode, queue_put and callback latencies, and message, byte and item counts
+        self.metrics = ClientMetrics()
+
+        # Optional hand-off between reception and processing
+        self.delivery = DeliveryQueue(queue_size, queue_policy, self._coalesce) if queue_size else None
+        self.dispatcher = None
+
+    def get_metrics(self):
+        """Snapshot of the client metrics with its connection state."""
+        snapshot = self.metrics.snapshot()
+        snapshot.update(state=self.state, reconnects=self.reconnects)
+        if self.delivery is not None:
+            snapshot["delivery"] = self.delivery.stats()
+        return snapshot
+
+    def get_batch(self, max_items=None, timeout=None):
+        """Pull queued items (tuples of data_callback arguments) when the client has no data_callback."""
+        if self.delivery is None:
+            raise ValueError(f"[{self.__class__.__name__}] get_batch() needs a client created with queue_size")
+        return [self._expand(args) for args in self.delivery.get_batch(max_items, timeout)]
+
+    def _coalesce(self, older, newer):
+        """Merge two queued items under the coalesce policy; by default only the newest is kept."""
+        return newer
+
+    def _expand(self, args):
+        """data_callback arguments of a queued item; items merged by _coalesce are finished here, off the socket thread."""
+        return args
+
+    def _start_dispatcher(self):
+        """Run data_callback on its own thread when items are queued."""
+        if self.delivery is None:
+            return
+        self.delivery.open()
+        if getattr(self, "data_callback", None) and self.dispatcher is None:
+            self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+            self.dispatcher.start()
+
+    def _stop_dispatcher(self):
+        """Close the queue and wait for the dispatcher to finish the items already queued."""
+        if self.delivery is None:
+            return
+        self.delivery.close()
+        if self.dispatcher:
+            self.dispatcher.join()
+            self.dispatcher = None
+
+    def _dispatch(self):
+        """Feed queued items to data_callback until the queue is closed and drained."""
+        while True:
+            items = self.delivery.get_batch()
+            if not items:
+                if self.delivery.closed:
+                    break
+                continue
+            for args in items:
+                t_callback = time.perf_counter()
+                try:
+                    self.data_callback(*self._expand(args))
+                except Exception as e:
+                    print(f"[{self.__class__.__name__}] Error in data callback: {e}")
+                self.metrics.update(durations={"callback": time.perf_counter() - t_callback})
+
+    def _record_receive(self, t_wait, t_header, n_bytes):
+        """Account one received message: t_wait before waiting for it, t_header once its header arrived."""
+        self.metrics.update({"messages": 1, "bytes": n_bytes},
+                            {"recv_wait": t_header - t_wait, "recv": time.perf_counter() - t_header})
+
+    def _deliver(self, t_decode, n_items, *args):
+        """Queue or run the data callback, accounting decode time since t_decode and the hand-off time."""
+        t_callback = time.perf_counter()
+        if self.delivery is not None:
+            self.delivery.put(args)
+            self.metrics.update({"items": n_items},
+                                {"decode": t_callback - t_decode, "queue_put": time.perf_counter() - t_callback})
+            return
+        if self.data_callback:
+            self.data_callback(*args)
+        self.metrics.update({"items": n_items},
+                            {"decode": t_callback - t_decode, "callback": time.perf_counter() - t_callback})
+
+    def _recv_message(self):
+        """Receive one framed message from the client socket, accounting it in the metrics."""
+        t_wait = time.perf_counter()
+        header = recv_data(self.sock, 16)
+        if header is None:
+            return None, 0
+        t_header = time.perf_counter()
+        msg_len, count = struct.unpack("II", header[:8])
+        msg = recv_data(self.sock, msg_len)
+        if msg is not None:
+            self._record_receive(t_wait, t_header, 16 + msg_len)
+        return msg, count
+
+    def _set_state(self, state):
+        """Record a connection state change and notify state_callback."""
+        if state == self.state:
+            return
+        self.state = state
+        if state == "connected":
+            self._t_connected = time.monotonic()
+        if self.state_callback:
+            try:
+                self.state_callback(state)
+            except Exception as e:
+                print(f"[{self.__class__.__name__}] Error in state callback: {e}")
+
+    def _next_backoff(self, backoff):
+        """Backoff before the next attempt; a connection that held for longer restarts the sequence."""
+        if self._t_connected is not None and time.monotonic() - self._t_connected > backoff:
+            self._t_connected = None
+            return self.initial_backoff_s
+        return min(backoff * 2, self.max_backoff_s)
+
+    def _enable_keepalive(self, sock):
+        """Have TCP probe an idle streaming connection, so a dead link is detected without a read timeout."""
+        if not self.is_streaming_client:
+            return
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE_S), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL_S),
+                              ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
     def connect(self, ip):
         """Connect to the target IP and port."""
         self.ip = ip
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.settimeout(5)
-        self.sock.connect((self.ip, self.port))
+        self._set_state("connecting")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        try:
+            sock.connect((self.ip, self.port))
+        except OSError:
+            sock.close()
+            self._set_state("disconnected")
+            raise
+
+        # Streams may be idle for long stretches (e.g. no droplets), so they never time out reads
+        if self.is_streaming_client:
+            sock.settimeout(None)
+        self._enable_keepalive(sock)
+        self.sock = sock
         self.connected = True
+        self._set_state("connected")
         print(f"[{self.__class__.__name__}] Connected to {self.ip}:{self.port}")
 
     def start(self, ip):
         """Start client behavior in a background thread."""
+        self.stop_flag.clear()
         self.connect(ip)
-        self.thread = threading.Thread(target=self._run, daemon=True)
+        self._start_dispatcher()
+        self.thread = threading.Thread(target=self._supervise, daemon=True)
         self.thread.start()
 
+    def _supervise(self):
+        """Run the client, reconnecting with bounded exponential backoff until stopped."""
+        backoff = self.initial_backoff_s
+        while not self.stop_flag.is_set():
+            if self.connected:
+                self._run()
+            if self.stop_flag.is_set() or not self.reconnect:
+                break
+
+            self._set_state("disconnected")
+            backoff = self._next_backoff(backoff)
+            print(f"[{self.__class__.__name__}] Connection lost; reconnecting in {backoff:.1f} s")
+            if self.stop_flag.wait(backoff):
+                break
+            try:
+                self.connect(self.ip)
+                self.reconnects += 1
+            except OSError as e:
+                print(f"[{self.__class__.__name__}] Reconnect to {self.ip}:{self.port} failed: {e}")
+
+        self._set_state("stopped")
+
     def stop(self):
         """Signal thread to stop."""
         self.stop_flag.set()
+
+        # Unblock a receive waiting on an idle stream
+        sock = self.sock
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.delivery is not None:
+            self.delivery.close()  # release a receive loop blocked on a full queue
         if self.thread:
             self.thread.join()
+        self._stop_dispatcher()
         self.close()
 
     def close(self):
@@ -63,33 +695,107 @@ class BaseClient:
 
 class ADCStreamClient(BaseClient):
     """Stream ADC waveform data."""
-    def __init__(self, port=5001, data_callback=None):
-        super().__init__(port, is_streaming_client=True)
+    def __init__(self, port=5001, data_callback=None, **client_options):
+        super().__init__(port, is_streaming_client=True, **client_options)
         self.adc1_data = None
         self.adc2_data = None
         self.data_callback = data_callback
         self.lock = threading.Lock()
 
-    def _run(self):
+        # Frame metadata from the most recent header
+        self.seq = 0
+        self.frame_timestamp = None
+        self.decimation = None
+        self.n_samples = None
+        self.trigger_source = None
+        self.trigger_level = None
+        self.raw = False  # True when frames carry raw int16 counts instead of volts
+        self.skipped_frames = 0
+
+        # Continuous mode sample accounting
+        self.mode = None
+        self.sample_index = None  # absolute index of the first sample of the latest chunk
+        self._next_sample_index = 0
+        self.overrun_samples = 0  # reported by the Red Pitaya
+        self.lost_samples = 0  # any gap in sample_index continuity (overruns and dropped chunks)
+
+        # Without a delivery queue, frames are received in place into two alternating buffers, so
+        # adc1_data/adc2_data (views into the other one) stay intact while the next frame arrives
+        self.frame_buffers = [bytearray(), bytearray()]
+        self._buffer_index = 0
+
+    def _frame_size(self, fields):
+        """Payload bytes of the frame described by the header fields."""
+        buffer_size, sample_format = fields[3], fields[4]
+        return 2 * buffer_size * ADC_DTYPES[sample_format].itemsize
+
+    def _frame_buffer(self, fields):
+        """Memoryview of the next (alternate) frame buffer sized for the frame described by the header fields."""
+        packet_size = self._frame_size(fields)
+
+        # A queued frame belongs to the consumer until its callback returns, which a receiver that never
+        # blocks can't wait for, so every queued frame gets a buffer of its own
+        if self.delivery is not None:
+            return memoryview(bytearray(packet_size))
+
+        # Buffers only grow, so steady-state frames allocate nothing
+        self._buffer_index = (self._buffer_index + 1) % len(self.frame_buffers)
+        if len(self.frame_buffers[self._buffer_index]) < packet_size:
+            self.frame_buffers[self._buffer_index] = bytearray(packet_size)
+        return memoryview(self.frame_buffers[self._buffer_index])[:packet_size]
+
+    def _handle_frame(self, fields, raw_data):
+        """Decode one frame, update the frame metadata and run the callback."""
         n_channels = 2
-        buffer_size = 4096 
-        mem_size = 4
-        packet_size = n_channels * buffer_size * mem_size # 2 channels, 16384 floats, each 4 bytes
+        (seq, timestamp, decimation, buffer_size, sample_format,
+         trigger_source, trigger_level, mode, sample_index, overrun_samples) = fields
+        dtype = ADC_DTYPES[sample_format]
+        t_decode = time.perf_counter()
+
+        with self.lock:
+            adc1_data, adc2_data = np.frombuffer(raw_data, dtype=dtype).reshape(n_channels, buffer_size)
+            self.adc1_data = adc1_data
+            self.adc2_data = adc2_data
+
+            # Count frames the server published but we never received
+            if self.seq and seq > self.seq + 1:
+                self.skipped_frames += seq - self.seq - 1
+            self.seq = seq
+            self.frame_timestamp = timestamp
+            self.decimation = decimation
+            self.n_samples = buffer_size
+            self.trigger_source = ADC_TRIGGER_SOURCES[trigger_source]
+            self.trigger_level = trigger_level
+            self.raw = sample_format == 1
+
+            # Continuous chunks must follow on from the previous one (index restarts on reconfiguration)
+            if ADC_MODES[mode] == "continuous":
+                if self.mode == "continuous" and sample_index > self._next_sample_index:
+                    self.lost_samples += sample_index - self._next_sample_index
+                self._next_sample_index = sample_index + buffer_size
+                self.sample_index = sample_index
+                self.overrun_samples = overrun_samples
+            self.mode = ADC_MODES[mode]
+        self._deliver(t_decode, 1, adc1_data, adc2_data)
+
+        return adc1_data, adc2_data
+
+    def _run(self):
+        adc1_data, adc2_data = None, None
+        header = bytearray(ADC_HEADER.size)
 
         try:
             while not self.stop_flag.is_set():
-                raw_data = recv_data(self.sock, packet_size)
-                if not raw_data:
+                t_wait = time.perf_counter()
+                if not recv_into(self.sock, header):
+                    break
+                t_header = time.perf_counter()
+                fields = ADC_HEADER.unpack(header)
+                raw_data = self._frame_buffer(fields)
+                if not recv_into(self.sock, raw_data):
                     break
-            
-                float_data = struct.unpack(f'{n_channels*buffer_size}f', raw_data)
-                with self.lock:
-                    adc1_data = np.array(float_data[:buffer_size]) 
-                    adc2_data = np.array(float_data[buffer_size:])
-                    self.adc1_data = adc1_data
-                    self.adc2_data = adc2_data
-                if self.data_callback:
-                    self.data_callback(adc1_data, adc2_data)
+                self._record_receive(t_wait, t_header, ADC_HEADER.size + len(raw_data))
+                adc1_data, adc2_data = self._handle_frame(fields, raw_data)
 
         except Exception as e:
             print(f"[ADCStreamClient] Error during _run: {e}")
@@ -98,31 +804,352 @@ class ADCStreamClient(BaseClient):
 
         return adc1_data, adc2_data
 
-class MemoryStreamClient(BaseClient):
-    """Stream droplet/memory data."""
-    def __init__(self, port=5002, data_callback=None):
-        super().__init__(port, is_streaming_client=True)
-        self.fpgaoutput = None
+class ADCDatagramClient(ADCStreamClient):
+    """Receive ADC frames sent over UDP by the Red Pitaya (see ControlCommandClient.configure_adc_udp).
+
+    Frames are reassembled from their datagrams and delivered in sequence order; a frame missing a
+    datagram is dropped (see reassembler.stats() and skipped_frames) instead of waited for. With a
+    multicast group, any number of hosts can receive the one stream the Red Pitaya sends.
+    """
+    def __init__(self, port=5001, data_callback=None, group=None, interface=None, max_pending_frames=4,
+                 recv_buffer_bytes=ADC_UDP_RECV_BUFFER, **client_options):
+        super().__init__(port, data_callback, **client_options)
+        self.group = group
+        self.interface = interface
+        self.recv_buffer_bytes = recv_buffer_bytes
+        self.reassembler = FrameReassembler(max_pending_frames)
+        self.datagram = bytearray(MAX_DATAGRAM_SIZE)
+
+    def get_metrics(self):
+        """Snapshot of the client metrics with its connection state and reassembly counts."""
+        snapshot = super().get_metrics()
+        snapshot["reassembly"] = self.reassembler.stats()
+        return snapshot
+
+    def connect(self, ip):
+        """Bind the UDP port and join the multicast group, if any; ip is the Red Pitaya sending the frames."""
+        self.ip = ip
+        self._set_state("connecting")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # Several receivers on one host can share a multicast port
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer_bytes)
+            sock.bind(("", self.port))
+            if self.group:
+                membership = socket.inet_aton(self.group) + socket.inet_aton(self.interface or "0.0.0.0")
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError:
+            sock.close()
+            self._set_state("disconnected")
+            raise
+
+        sock.settimeout(ADC_UDP_POLL_S)
+        self.sock = sock
+        self.reassembler.reset()
+        self.connected = True
+        self._set_state("connected")
+        print(f"[{self.__class__.__name__}] Listening on UDP port {self.port}"
+              + (f" for group {self.group}" if self.group else ""))
+
+    def _run(self):
+        adc1_data, adc2_data = None, None
+        datagram = memoryview(self.datagram)
+
+        try:
+            while not self.stop_flag.is_set():
+                try:
+                    n = self.sock.recv_into(datagram)
+                except socket.timeout:
+                    continue
+                frame = self.reassembler.add(datagram[:n])
+                if frame is None:
+                    continue
+
+                _, buffer, _, t_first = frame
+                fields = ADC_HEADER.unpack_from(buffer)
+                raw_data = memoryview(buffer)[ADC_HEADER.size:]
+                if len(raw_data) != self._frame_size(fields):
+                    self.reassembler.invalid += 1
+                    continue
+
+                # recv is the time from the first datagram of the frame to the last
+                self.metrics.update({"messages": 1, "bytes": len(buffer)}, {"recv": time.perf_counter() - t_first})
+                adc1_data, adc2_data = self._handle_frame(fields, raw_data)
+
+        except Exception as e:
+            print(f"[ADCDatagramClient] Error during _run: {e}")
+        finally:
+            self.close()
+
+        return adc1_data, adc2_data
+
+class SnippetStreamClient(BaseClient):
+    """Stream droplet-tagged waveform snippets (both channels around each captured droplet)."""
+    def __init__(self, port=5004, data_callback=None, **client_options):
+        super().__init__(port, is_streaming_client=True, **client_options)
         self.data_callback = data_callback
         self.lock = threading.Lock()
 
+        # Most recent snippet and its metadata
+        self.snippet = None
+        self.droplet_id = None
+        self.snippet_timestamp = None
+        self.decimation = None
+        self.pre_samples = None
+        self.detect_samples = None  # the droplet was detected in snippet[:, pre_samples:pre_samples + detect_samples]
+        self.raw = False
+
+    def _snippet_size(self, fields):
+        """Payload bytes of the snippet described by the header fields."""
+        n_samples, sample_format = fields[5], fields[6]
+        return 2 * n_samples * ADC_DTYPES[sample_format].itemsize
+
+    def _handle_snippet(self, fields, raw_data):
+        """Decode one snippet, update the snippet metadata and run the callback."""
+        n_channels = 2
+        droplet_id, timestamp, decimation, pre_samples, detect_samples, n_samples, sample_format = fields
+        dtype = ADC_DTYPES[sample_format]
+        t_decode = time.perf_counter()
+
+        with self.lock:
+            snippet = np.frombuffer(raw_data, dtype=dtype).reshape(n_channels, n_samples)
+            self.snippet = snippet
+            self.droplet_id = droplet_id
+            self.snippet_timestamp = timestamp
+            self.decimation = decimation
+            self.pre_samples = pre_samples
+            self.detect_samples = detect_samples
+            self.raw = sample_format == 1
+        self._deliver(t_decode, 1, droplet_id, snippet)
+
+        return snippet
+
     def _run(self):
-        packet_size = 16
+        snippet = None
 
         try:
             while not self.stop_flag.is_set():
-                header = recv_data(self.sock, packet_size)
+                t_wait = time.perf_counter()
+                header = recv_data(self.sock, SNIPPET_HEADER.size)
                 if not header:
                     break
-                json_len = struct.unpack("I", header[:4])[0]
-                json_msg = recv_data(self.sock, json_len)
-                if not json_msg:
+                t_header = time.perf_counter()
+                fields = SNIPPET_HEADER.unpack(header)
+                raw_data = recv_data(self.sock, self._snippet_size(fields))
+                if raw_data is None:
+                    break
+                self._record_receive(t_wait, t_header, SNIPPET_HEADER.size + len(raw_data))
+                snippet = self._handle_snippet(fields, raw_data)
+
+        except Exception as e:
+            print(f"[SnippetStreamClient] Error during _run: {e}")
+        finally:
+            self.close()
+
+        return snippet
+
+
+class HistogramStreamClient(BaseClient):
+    """Stream droplet histograms binned on the Red Pitaya.
+
+    Each message is the delta since the previous one; self.histograms keeps the running
+    totals, keyed by register name (1D) or "x|y" (2D), and restarts when the binning changes.
+    """
+    def __init__(self, port=5005, data_callback=None, **client_options):
+        super().__init__(port, is_streaming_client=True, **client_options)
+        self.data_callback = data_callback
+        self.lock = threading.Lock()
+
+        self.layout = None
+        self.histograms = {}
+        self.total_droplets = 0
+        self.header = None
+
+    def reset(self):
+        """Zero the running totals."""
+        with self.lock:
+            self.histograms = {name: np.zeros_like(counts) for name, counts in self.histograms.items()}
+            self.total_droplets = 0
+
+    def _handle_histograms(self, header, payload):
+        """Split one delta message by layout, add it to the running totals and run the callback."""
+        t_decode = time.perf_counter()
+        header = json.loads(header.decode())
+
+        # The payload is the concatenated uint32 counts of every histogram
+        counts = np.frombuffer(payload, dtype="<u4")
+        deltas, offset = {}, 0
+        for entry in header["layout"]:
+            n = int(np.prod(entry["shape"]))
+            deltas[entry["name"]] = counts[offset:offset + n].reshape(entry["shape"])
+            offset += n
+
+        with self.lock:
+            if header["layout"] != self.layout:
+                self.layout = header["layout"]
+                self.histograms = {name: np.zeros(delta.shape, dtype=np.uint64)
+                                   for name, delta in deltas.items()}
+                self.total_droplets = 0
+            for name, delta in deltas.items():
+                self.histograms[name] += delta
+            self.total_droplets += header["droplets"]
+            self.header = header
+        self._deliver(t_decode, 1, deltas, header)
+
+        return deltas
+
+    def _run(self):
+        deltas = None
+
+        try:
+            while not self.stop_flag.is_set():
+                header, _ = self._recv_message()
+                if header is None:
+                    break
+                payload, _ = self._recv_message()
+                if payload is None:
+                    break
+                deltas = self._handle_histograms(header, payload)
+
+        except Exception as e:
+            print(f"[HistogramStreamClient] Error during _run: {e}")
+        finally:
+            self.close()
+
+        return deltas
+
+
+class MemoryStreamClient(BaseClient):
+    """Stream droplet/memory data.
+
+    variables limits the records to those registers (droplet_id is always included) and
+    max_rate_hz caps the update rate; the Red Pitaya then sends the newest record per slot.
+    With batch=True, records that pile up on the Red Pitaya arrive together (waiting at most
+    max_latency_ms) and the callback receives a structured array (binary) or list of dicts (json).
+    """
+    def __init__(self, port=5002, data_callback=None, encoding="json", variables=None, max_rate_hz=None,
+                 batch=False, max_latency_ms=2.0, max_coalesced_records=1_000_000, **client_options):
+        super().__init__(port, is_streaming_client=True, **client_options)
+        self.fpgaoutput = None
+        self.data_callback = data_callback
+        self.encoding = encoding
+        self.variables = list(variables) if variables else None
+        self.max_rate_hz = max_rate_hz
+        self.batch = batch
+        self.max_latency_ms = max_latency_ms
+        self.max_coalesced_records = max_coalesced_records
+        self.dtype = None
+        self.lock = threading.Lock()
+
+        # droplet_id continuity of everything received (records always carry droplet_id)
+        self.droplets = DropletCounter()
+
+    def get_metrics(self):
+        """Client metrics plus droplet accounting."""
+        snapshot = super().get_metrics()
+        snapshot["droplets"] = self.droplets.snapshot()
+        return snapshot
+
+    def _coalesce(self, older, newer):
+        """Batches merge into one batch; single records keep only the newest.
+
+        Merging only appends to a BatchPieces list, so the socket thread does constant work per message
+        however long the consumer stalls; beyond max_coalesced_records the oldest batches are dropped.
+        """
+        if not self.batch:
+            return newer
+        pieces = older[0] if isinstance(older[0], BatchPieces) else BatchPieces([older[0]])
+        pieces.append(newer[0])
+        pieces.n_records += len(newer[0])
+
+        dropped = 0
+        while pieces.n_records > self.max_coalesced_records and len(pieces) > 1:
+            n = len(pieces.pop(0))
+            pieces.n_records -= n
+            dropped += n
+        if dropped:
+            self.metrics.update({"dropped_records": dropped})
+        return (pieces,)
+
+    def _expand(self, args):
+        """Join merged batches into one structured array (binary) or list of dicts (json)."""
+        if not isinstance(args[0], BatchPieces):
+            return args
+        if self.encoding == "binary":
+            return (np.concatenate(args[0]),)
+        return ([record for piece in args[0] for record in piece],)
+
+    def _droplet_ids(self, fpgaoutput):
+        """droplet_ids of a decoded record or batch."""
+        if isinstance(fpgaoutput, dict):
+            return fpgaoutput["droplet_id"]
+        if isinstance(fpgaoutput, list):
+            return [record["droplet_id"] for record in fpgaoutput]
+        return fpgaoutput["droplet_id"]
+
+    def _subscription_message(self):
+        """Framed subscribe message with the record encoding, variables and rate options."""
+        subscription = {"encoding": self.encoding}
+        if self.variables:
+            subscription["variables"] = self.variables
+        if self.max_rate_hz:
+            subscription["max_rate_hz"] = self.max_rate_hz
+        if self.batch:
+            subscription.update(batch=True, max_latency_ms=self.max_latency_ms)
+        return frame_message(json.dumps(subscription).encode())
+
+    def _set_schema(self, msg):
+        """Build the record dtype from the binary schema message."""
+        schema = json.loads(msg.decode())
+        self.dtype = np.dtype([tuple(field) for field in schema["fields"]])
+
+    def _subscribe(self):
+        """Negotiate the record encoding and variables and, for binary, receive the record schema."""
+        self.sock.sendall(self._subscription_message())
+        if self.encoding == "binary":
+            msg, _ = recv_message(self.sock)
+            if msg is None:
+                raise ConnectionError("Connection closed before the record schema arrived")
+            self._set_schema(msg)
+
+    def _decode(self, msg):
+        """Decode one record into a dict (json) or a NumPy structured record (binary)."""
+        if self.encoding == "binary":
+            return np.frombuffer(msg, dtype=self.dtype)[0]
+        return json.loads(msg.decode())
+
+    def _decode_batch(self, msg, count):
+        """Decode a batch into a NumPy structured array (binary) or a list of dicts (json)."""
+        if self.encoding == "binary":
+            return np.frombuffer(msg, dtype=self.dtype, count=count)
+        return json.loads(msg.decode())
+
+    def _handle_message(self, msg, count):
+        """Decode one record or batch, keep the newest record and run the callback."""
+        t_decode = time.perf_counter()
+        with self.lock:
+            if self.batch:
+                fpgaoutput = self._decode_batch(msg, count)
+                self.fpgaoutput = fpgaoutput[-1]
+            else:
+                fpgaoutput = self._decode(msg)
+                self.fpgaoutput = fpgaoutput
+        self.droplets.add(self._droplet_ids(fpgaoutput))
+        self._deliver(t_decode, len(fpgaoutput) if self.batch else 1, fpgaoutput)
+
+        return fpgaoutput
+
+    def _run(self):
+        fpgaoutput = None
+
+        try:
+            self._subscribe()
+            while not self.stop_flag.is_set():
+                msg, count = self._recv_message()
+                if not msg:
                     break
-                with self.lock:
-                    fpgaoutput = json.loads(json_msg.decode())
-                    self.fpgaoutput = fpgaoutput
-                if self.data_callback:
-                    self.data_callback(fpgaoutput)
+                fpgaoutput = self._handle_message(msg, count)
         except Exception as e:
             print(f"[MemoryStreamClient] Error during _run: {e}")
         finally:
@@ -132,50 +1159,229 @@ class MemoryStreamClient(BaseClient):
 
 
 class MemoryCommandClient(BaseClient):
-    """Send memory (variable/value) updates."""
-    def __init__(self, port=5003):
-        super().__init__(port, is_streaming_client=False)
-        self.command_queue = []
+    """Send memory (variable/value) updates.
+
+    Pending single-variable writes are coalesced per variable, so a burst of updates (e.g. a
+    dragged UI slider) sends only the newest value of each. Batches are kept in order and
+    never merged. The sender sleeps on a condition variable until a write is queued.
+    """
+    def __init__(self, port=5003, reconnect=True, verbose=False, **client_options):
+        super().__init__(port, is_streaming_client=False, reconnect=reconnect, **client_options)
+        self.verbose = verbose
+        self.command_queue = collections.deque()  # [values, future or None, t_queued]
+        self.batch_ids = itertools.count(1)
         self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+
+    def _enqueue(self, values, future=None):
+        """Queue writes; unacknowledged ones merge into a pending group of unacknowledged writes."""
+        coalesced = 0
+        with self.lock:
+            tail = self.command_queue[-1] if self.command_queue else None
+            if future is None and tail is not None and tail[1] is None:
+                for variable, value in values.items():
+                    # Latest value wins; re-inserting keeps the group in order of the newest writes
+                    if variable in tail[0]:
+                        del tail[0][variable]
+                        coalesced += 1
+                    tail[0][variable] = value
+            else:
+                self.command_queue.append([dict(values), future, time.perf_counter()])
+            self._wake_sender()
+        if coalesced:
+            self.metrics.update({"coalesced_writes": coalesced})
+
+    def _requeue(self, command):
+        """Put back a command caught by a dropped connection, without reviving values overwritten since."""
+        with self.lock:
+            head = self.command_queue[0] if self.command_queue else None
+            if command[1] is None and head is not None and head[1] is None:
+                head[0] = {**command[0], **head[0]}
+                head[2] = command[2]
+            else:
+                self.command_queue.appendleft(command)
+
+    def _wake_sender(self):
+        """Wake the sender thread; called with the lock held."""
+        self.cond.notify()
 
     def send_set_command(self, variable, value):
         """Queue a memory set command (variable and value separately)."""
-        with self.lock:
-            self.command_queue.append((variable, value))
+        self._enqueue({variable: value})
+
+    def send_batch_command(self, values):
+        """Queue a batch of {variable: value} writes applied atomically on the Red Pitaya.
+
+        Returns a Future resolved with the server ack ({"ok", "values", "latency_s"}).
+        """
+        future = Future()
+        self._enqueue(values, future)
+        return future
+
+    def _set_message(self, variable, value):
+        """Framed single-variable write (not acknowledged by the server)."""
+        return frame_message(json.dumps({"name": variable, "value": value}).encode())
+
+    def _writes_message(self, values):
+        """Framed single-variable writes of a coalesced group, sent with one system call."""
+        return b"".join(self._set_message(variable, value) for variable, value in values.items())
+
+    def _batch_message(self, batch_id, values):
+        """Framed batch write, acknowledged with the read-back values."""
+        return frame_message(json.dumps({"id": batch_id, "values": values}).encode())
+
+    def _record_writes(self, values, t_queued):
+        """Account a sent group of writes and the time its oldest write waited in the queue."""
+        self.metrics.update({"writes_sent": len(values)}, {"write_latency": time.perf_counter() - t_queued})
+        if self.verbose:
+            print(f"[{self.__class__.__name__}] Sent: {values}")
+
+    def _resolve_batch(self, batch_id, values, reply, future):
+        """Complete a batch future from the server's ack."""
+        name = self.__class__.__name__
+        if reply["ok"]:
+            future.set_result(reply)
+            if self.verbose:
+                print(f"[{name}] Batch {batch_id} acked in {reply['latency_s']*1e3:.1f} ms: {values}")
+        else:
+            future.set_exception(ValueError(f"[{name}] Batch rejected: {reply['error']}"))
+            print(f"[{name}] Batch {batch_id} rejected: {reply['error']}")
+
+    def _send_batch(self, values, future):
+        """Send one batch and wait for its ack with the read-back values."""
+        batch_id = next(self.batch_ids)
+
+        t0 = time.perf_counter()
+        self.sock.sendall(self._batch_message(batch_id, values))
+
+        # Once sent, a closed connection may be the server's answer to this batch, so it fails the
+        # future instead of being resent (and failing again) after every reconnect
+        try:
+            reply, _ = recv_message(self.sock)
+        except OSError:
+            reply = None
+        if not reply:
+            error = ConnectionError("Connection closed while waiting for batch ack")
+            future.set_exception(error)
+            raise error
+        reply = json.loads(reply.decode())
+        reply["latency_s"] = time.perf_counter() - t0
+
+        self._resolve_batch(batch_id, values, reply, future)
+
+    def _check_connection(self):
+        """Raise ConnectionError if the server closed the idle connection, before anything is sent on it."""
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if readable and not self.sock.recv(1, socket.MSG_PEEK):
+            raise ConnectionError("Connection closed by the server")
 
     def _run(self):
+        command = None
         try:
-            while not self.stop_flag.is_set():
-                with self.lock:
-                    if self.command_queue:
-                        variable, value = self.command_queue.pop(0)
-                        message = json.dumps({"name": variable, "value": value}).encode()
-                        header = struct.pack("I", len(message)).ljust(16, b'\x00')
-                        self.sock.sendall(header + message)
-
-                        print(f"[MemoryCommandClient] Sent: {variable} = {value}")
-                time.sleep(0.1)
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.command_queue or self.stop_flag.is_set())
+                    if self.stop_flag.is_set():
+                        break
+                    command = self.command_queue.popleft()
+
+                # Send outside the lock so callers queueing writes never wait on the network; a connection
+                # found closed before sending is a plain transport failure, so the command is resent
+                self._check_connection()
+                values, future, t_queued = command
+                if future is not None:
+                    self._send_batch(values, future)
+                else:
+                    self.sock.sendall(self._writes_message(values))
+                    self._record_writes(values, t_queued)
+                command = None
         except Exception as e:
             print(f"[MemoryCommandClient] Error during _run: {e}")
+            # Register writes are idempotent, so one that never left because the connection dropped is
+            # resent after reconnecting; a batch that was sent has already had its future failed
+            pending = command is not None and (command[1] is None or not command[1].done())
+            if pending and isinstance(e, OSError) and self.reconnect and not self.stop_flag.is_set():
+                self._requeue(command)
+            elif pending and command[1] is not None:
+                command[1].set_exception(e)
         finally:
             self.close()
 
+    def stop(self):
+        """Signal thread to stop, waking the sender if it is idle."""
+        self.stop_flag.set()
+        with self.cond:
+            self.cond.notify_all()
+        super().stop()
+
 
 class ControlCommandClient(BaseClient):
-    """Send a one-time shutdown command for piccolo methods on the Red Pitaya."""
-    def __init__(self, port=5000):
-        super().__init__(port, is_streaming_client=False)
+    """Send control commands (shutdown, acquisition settings) for piccolo methods on the Red Pitaya."""
+    def __init__(self, port=5000, **client_options):
+        super().__init__(port, is_streaming_client=False, **client_options)
+        self.lock = threading.Lock()
 
-    def _run(self):
-        kill_cmd = 99
-        message = struct.pack("I", kill_cmd).ljust(16, b'\x00')
+    def _command_message(self, opcode, payload=None):
+        """Framed command: (opcode, length) header then the JSON payload."""
+        message = json.dumps(payload).encode() if payload is not None else b''
+        return struct.pack("II", opcode, len(message)).ljust(16, b'\x00') + message
+
+    def _settings_reply(self, reply, what):
+        """Settings from a configure reply, raising if the server rejected them."""
+        if not reply["ok"]:
+            raise ValueError(f"[{self.__class__.__name__}] {what} configuration rejected: {reply['error']}")
+        return reply["settings"]
+
+    def send_command(self, opcode, payload=None):
+        """Send one command and return the server's JSON reply (None for shutdown).
+
+        A failed send or receive closes the connection (connected turns False) and raises ConnectionError,
+        so the caller can reconnect and retry.
+        """
+        with self.lock:
+            if not self.connected:
+                raise ConnectionError(f"[{self.__class__.__name__}] Not connected")
+            try:
+                self.sock.sendall(self._command_message(opcode, payload))
+                if opcode == OP_SHUTDOWN:
+                    return None
+                reply, _ = recv_message(self.sock)
+            except OSError as e:
+                self.close()
+                raise ConnectionError(f"[{self.__class__.__name__}] Connection lost during command: {e}") from e
+            if reply is None:
+                self.close()
+                raise ConnectionError(f"[{self.__class__.__name__}] Connection closed while waiting for the reply")
+
+        return json.loads(reply.decode())
 
+    def configure_adc(self, **settings):
+        """Change decimation, n_samples, trigger_source, trigger_level and/or format at runtime."""
+        return self._settings_reply(self.send_command(OP_CONFIGURE_ADC, settings), "ADC")
+
+    def configure_snippets(self, **settings):
+        """Change the snippet pre_samples, post_samples, every_nth and/or format at runtime."""
+        return self._settings_reply(self.send_command(OP_CONFIGURE_SNIPPETS, settings), "Snippet")
+
+    def configure_histograms(self, **settings):
+        """Change the histogram bins ({name: [low, high, n_bins]}), 2D pairs and/or rate_hz at runtime."""
+        return self._settings_reply(self.send_command(OP_CONFIGURE_HISTOGRAMS, settings), "Histogram")
+
+    def configure_adc_udp(self, **settings):
+        """Send the ADC frames over UDP: enabled, address (host or multicast group), port, payload_size, ttl, interface."""
+        return self._settings_reply(self.send_command(OP_CONFIGURE_ADC_UDP, settings), "ADC UDP")
+
+    def get_telemetry(self):
+        """Fetch the Red Pitaya's counters, latency histograms, client backlog and process stats."""
+        return self.send_command(OP_GET_TELEMETRY)["telemetry"]
+
+    def _run(self):
         try:
             print("[ControlCommandClient] Sending piccolo_rp shutdown command...")
-            self.sock.sendall(message)
+            self.send_command(OP_SHUTDOWN)
             print("[ControlCommandClient] Shutdown command sent successfully.")
         except Exception as e:
             print(f"[ControlCommandClient] Error sending shutdown command: {e}")
         finally:
             self.stop_flag.set()
-            self.close()
\ No newline at end of file
+            self.close()
@@ -0,0 +1,404 @@
+import asyncio
+import json
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+# The asyncio clients speak the same protocols as the threaded ones and reuse their decoding
+from piccolo_clients import (
+    ADC_HEADER,
+    SNIPPET_HEADER,
+    OP_CONFIGURE_ADC,
+    OP_CONFIGURE_SNIPPETS,
+    OP_CONFIGURE_HISTOGRAMS,
+    OP_CONFIGURE_ADC_UDP,
+    OP_GET_TELEMETRY,
+    OP_SHUTDOWN,
+    ADCStreamClient,
+    SnippetStreamClient,
+    HistogramStreamClient,
+    MemoryStreamClient,
+    MemoryCommandClient,
+    ControlCommandClient,
+)
+
+
+class ClientLoop:
+    """One asyncio event loop in a background thread, shared by any number of clients and instruments."""
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True, name="piccolo_clients")
+        self.thread.start()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop from any thread; returns a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the loop and wait for its result."""
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        """Stop the loop and its thread."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class AsyncClientMixin:
+    """asyncio transport for a piccolo client; the threaded class it is mixed into supplies the protocol.
+
+    connect()/close() are coroutines. start(ip)/stop() run the client on a ClientLoop for callers
+    outside the event loop, such as Instrument. Iterating a stream reconnects (and resubscribes)
+    with the same backoff and state callbacks as the threaded clients until stop() is called.
+    """
+    def __init__(self, *args, client_loop=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.delivery is not None and self.delivery.policy == "block":
+            raise ValueError("The block delivery policy would stall the shared event loop")
+        self.client_loop = client_loop
+        self.reader = None
+        self.writer = None
+        self.task = None
+
+    async def connect(self, ip, timeout=5):
+        """Connect to the target IP and port."""
+        self.ip = ip
+        self._set_state("connecting")
+        try:
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(ip, self.port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            self._set_state("disconnected")
+            raise
+        self._enable_keepalive(self.writer.get_extra_info("socket"))
+        self.connected = True
+        self._set_state("connected")
+        print(f"[{self.__class__.__name__}] Connected to {self.ip}:{self.port}")
+
+    async def _reconnect(self):
+        """Reconnect with bounded exponential backoff; False once stopped."""
+        backoff = self.initial_backoff_s
+        while not self.stop_flag.is_set():
+            self._set_state("disconnected")
+            backoff = self._next_backoff(backoff)
+            print(f"[{self.__class__.__name__}] Connection lost; reconnecting in {backoff:.1f} s")
+
+            # Sleep in slices so stop() is not held up by a long backoff
+            deadline = time.monotonic() + backoff
+            while not self.stop_flag.is_set() and time.monotonic() < deadline:
+                await asyncio.sleep(min(0.1, deadline - time.monotonic()))
+            if self.stop_flag.is_set():
+                break
+
+            try:
+                await self.connect(self.ip)
+                self.reconnects += 1
+                return True
+            except (OSError, asyncio.TimeoutError) as e:
+                print(f"[{self.__class__.__name__}] Reconnect to {self.ip}:{self.port} failed: {e}")
+
+        return False
+
+    async def close(self):
+        """Close the connection."""
+        if self.writer:
+            writer, self.writer = self.writer, None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+            self.connected = False
+            print(f"[{self.__class__.__name__}] Socket closed.")
+
+    async def _recv(self, size):
+        """Receive exactly size bytes; None if the connection closed."""
+        try:
+            return await self.reader.readexactly(size)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    async def _recv_message(self):
+        """Receive one framed message, accounting it in the metrics; (None, 0) if the connection closed."""
+        t_wait = time.perf_counter()
+        header = await self._recv(16)
+        if header is None:
+            return None, 0
+        t_header = time.perf_counter()
+        msg_len, count = struct.unpack("II", header[:8])
+        msg = await self._recv(msg_len)
+        if msg is not None:
+            self._record_receive(t_wait, t_header, 16 + msg_len)
+        return msg, count
+
+    async def run(self):
+        """Consume the stream until it ends, driving the data callback."""
+        try:
+            async for _ in self:
+                pass
+        except Exception as e:
+            print(f"[{self.__class__.__name__}] Error during run: {e}")
+        finally:
+            await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            item = await self._receive() if self.writer else None
+            if item is not None:
+                return item
+
+            await self.close()
+            if self.stop_flag.is_set() or not self.reconnect or not await self._reconnect():
+                self._set_state("stopped")
+                raise StopAsyncIteration
+
+    async def _receive(self):
+        raise NotImplementedError("Streaming subclasses must implement _receive()")
+
+    def start(self, ip):
+        """Connect and run the client as a task on the ClientLoop."""
+        self.stop_flag.clear()
+        self.client_loop.run(self.connect(ip))
+        self._start_dispatcher()
+        self.task = self.client_loop.submit(self.run())
+
+    def stop(self):
+        """Close the connection and wait for the client task to finish."""
+        self.stop_flag.set()
+        self.client_loop.run(self.close())
+        if self.task:
+            self.task.result()
+            self.task = None
+        self._stop_dispatcher()
+
+
+class AsyncADCStreamClient(AsyncClientMixin, ADCStreamClient):
+    """Stream ADC waveform data; iterating yields (adc1_data, adc2_data) per frame."""
+    async def _receive(self):
+        t_wait = time.perf_counter()
+        header = await self._recv(ADC_HEADER.size)
+        if header is None:
+            return None
+        t_header = time.perf_counter()
+        fields = ADC_HEADER.unpack(header)
+        raw_data = await self._recv(self._frame_size(fields))
+        if raw_data is None:
+            return None
+        self._record_receive(t_wait, t_header, ADC_HEADER.size + len(raw_data))
+        return self._handle_frame(fields, raw_data)
+
+
+class AsyncSnippetStreamClient(AsyncClientMixin, SnippetStreamClient):
+    """Stream droplet snippets; iterating yields (droplet_id, snippet)."""
+    async def _receive(self):
+        t_wait = time.perf_counter()
+        header = await self._recv(SNIPPET_HEADER.size)
+        if header is None:
+            return None
+        t_header = time.perf_counter()
+        fields = SNIPPET_HEADER.unpack(header)
+        raw_data = await self._recv(self._snippet_size(fields))
+        if raw_data is None:
+            return None
+        self._record_receive(t_wait, t_header, SNIPPET_HEADER.size + len(raw_data))
+        return fields[0], self._handle_snippet(fields, raw_data)
+
+
+class AsyncHistogramStreamClient(AsyncClientMixin, HistogramStreamClient):
+    """Stream droplet histograms; iterating yields (deltas, header) per message."""
+    async def _receive(self):
+        header, _ = await self._recv_message()
+        if header is None:
+            return None
+        payload, _ = await self._recv_message()
+        if payload is None:
+            return None
+        deltas = self._handle_histograms(header, payload)
+        return deltas, self.header
+
+
+class AsyncMemoryStreamClient(AsyncClientMixin, MemoryStreamClient):
+    """Stream droplet/memory data; iterating yields records (or batches, with batch=True)."""
+    async def connect(self, ip, timeout=5):
+        """Connect and subscribe (receiving the record schema for binary encoding)."""
+        await super().connect(ip, timeout)
+        self.writer.write(self._subscription_message())
+        await self.writer.drain()
+        if self.encoding == "binary":
+            msg, _ = await self._recv_message()
+            if msg is None:
+                raise ConnectionError("Connection closed before the record schema arrived")
+            self._set_schema(msg)
+
+    async def _receive(self):
+        msg, count = await self._recv_message()
+        if not msg:
+            return None
+        return self._handle_message(msg, count)
+
+
+class AsyncMemoryCommandClient(AsyncClientMixin, MemoryCommandClient):
+    """Write FPGA memory variables; set_variable() and set_variables() are awaitable.
+
+    send_set_command()/send_batch_command() share the coalescing queue of MemoryCommandClient,
+    drained on the ClientLoop instead of a sender thread.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.send_lock = None  # created on the event loop
+        self.draining = False
+
+    async def connect(self, ip, timeout=5):
+        await super().connect(ip, timeout)
+        if self.send_lock is None:
+            self.send_lock = asyncio.Lock()
+
+    async def _ensure_connected(self):
+        """Reconnect a dropped command connection before the next write."""
+        if self.writer is None or self.writer.is_closing() or self.reader.at_eof():
+            await self.close()
+            if not (self.reconnect and self.ip and await self._reconnect()):
+                raise ConnectionError(f"[{self.__class__.__name__}] Not connected")
+
+    async def _write(self, data):
+        """Hand unacknowledged writes to the socket, resending them after a reconnect."""
+        while True:
+            await self._ensure_connected()
+            try:
+                self.writer.write(data)
+                await self.writer.drain()
+                return
+            except ConnectionError:
+                await self.close()
+                if self.stop_flag.is_set():
+                    raise
+
+    async def set_variable(self, variable, value):
+        """Write one variable; returns once the write is handed to the socket."""
+        async with self.send_lock:
+            await self._write(self._set_message(variable, value))
+
+    async def set_variables(self, values):
+        """Atomically write several variables; returns the server ack ({"ok", "values", "latency_s"})."""
+        future = Future()
+        values = dict(values)
+        async with self.send_lock:
+            batch_id = next(self.batch_ids)
+            t0 = time.perf_counter()
+
+            # A batch that never left is resent after reconnecting; once sent, a closed connection may be
+            # the server's answer to it, so the batch fails instead of being resent
+            await self._write(self._batch_message(batch_id, values))
+            reply, _ = await self._recv_message()
+            if reply is None:
+                await self.close()
+                raise ConnectionError("Connection closed while waiting for batch ack")
+        reply = json.loads(reply.decode())
+        reply["latency_s"] = time.perf_counter() - t0
+
+        self._resolve_batch(batch_id, values, reply, future)
+        return future.result()
+
+    def _wake_sender(self):
+        """Schedule a drain of the queue on the ClientLoop unless one is already pending."""
+        if not self.draining:
+            self.draining = True
+            self.client_loop.submit(self._drain())
+
+    async def _drain(self):
+        """Send the queued commands in order until the queue is empty."""
+        while True:
+            with self.lock:
+                if not self.command_queue:
+                    self.draining = False
+                    return
+                values, future, t_queued = self.command_queue.popleft()
+
+            try:
+                if future is None:
+                    async with self.send_lock:
+                        await self._write(self._writes_message(values))
+                    self._record_writes(values, t_queued)
+                else:
+                    reply = await self.set_variables(values)
+                    if not future.done():
+                        future.set_result(reply)
+            except Exception as e:
+                print(f"[{self.__class__.__name__}] Error sending {values}: {e}")
+                if future is not None and not future.done():
+                    future.set_exception(e)
+
+    async def run(self):
+        # Writes are driven by the callers; only the connection needs to stay open
+        return None
+
+    def stop(self):
+        self.stop_flag.set()
+        self.client_loop.run(self.close())
+
+
+class AsyncControlCommandClient(AsyncClientMixin, ControlCommandClient):
+    """Send control commands; every command is awaitable."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.send_lock = None  # created on the event loop
+
+    async def connect(self, ip, timeout=5):
+        await super().connect(ip, timeout)
+        self.send_lock = asyncio.Lock()
+
+    async def send_command(self, opcode, payload=None):
+        """Send one command and return the server's JSON reply (None for shutdown)."""
+        async with self.send_lock:
+            if not self.connected:
+                raise ConnectionError(f"[{self.__class__.__name__}] Not connected")
+            try:
+                self.writer.write(self._command_message(opcode, payload))
+                await self.writer.drain()
+                if opcode == OP_SHUTDOWN:
+                    return None
+                reply, _ = await self._recv_message()
+            except OSError as e:
+                await self.close()
+                raise ConnectionError(f"[{self.__class__.__name__}] Connection lost during command: {e}") from e
+            if reply is None:
+                await self.close()
+                raise ConnectionError(f"[{self.__class__.__name__}] Connection closed while waiting for the reply")
+        return json.loads(reply.decode())
+
+    async def configure_adc(self, **settings):
+        """Change decimation, n_samples, trigger_source, trigger_level, format and/or mode at runtime."""
+        return self._settings_reply(await self.send_command(OP_CONFIGURE_ADC, settings), "ADC")
+
+    async def configure_snippets(self, **settings):
+        """Change the snippet pre_samples, post_samples, every_nth and/or format at runtime."""
+        return self._settings_reply(await self.send_command(OP_CONFIGURE_SNIPPETS, settings), "Snippet")
+
+    async def configure_histograms(self, **settings):
+        """Change the histogram bins, 2D pairs and/or rate_hz at runtime."""
+        return self._settings_reply(await self.send_command(OP_CONFIGURE_HISTOGRAMS, settings), "Histogram")
+
+    async def configure_adc_udp(self, **settings):
+        """Send the ADC frames over UDP (received by the threaded ADCDatagramClient)."""
+        return self._settings_reply(await self.send_command(OP_CONFIGURE_ADC_UDP, settings), "ADC UDP")
+
+    async def get_telemetry(self):
+        """Fetch the Red Pitaya's counters, latency histograms, client backlog and process stats."""
+        return (await self.send_command(OP_GET_TELEMETRY))["telemetry"]
+
+    async def shutdown(self):
+        """Send the piccolo_rp shutdown command."""
+        print(f"[{self.__class__.__name__}] Sending piccolo_rp shutdown command...")
+        await self.send_command(OP_SHUTDOWN)
+
+    async def run(self):
+        # As with the threaded client, starting it sends the shutdown command
+        try:
+            await self.shutdown()
+        except Exception as e:
+            print(f"[{self.__class__.__name__}] Error sending shutdown command: {e}")
+        finally:
+            await self.close()
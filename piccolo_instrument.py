@@ -8,15 +8,29 @@ import numpy as np
 import re
 import time
 import posixpath
+import collections
+import asyncio
 import pandas as pd
 
 # Import piccolo clients
 from piccolo_clients import (
     ADCStreamClient,
+    ADCDatagramClient,
     MemoryStreamClient,
+    SnippetStreamClient,
+    HistogramStreamClient,
     MemoryCommandClient,
     ControlCommandClient
 )
+from piccolo_clients_async import (
+    ClientLoop,
+    AsyncADCStreamClient,
+    AsyncMemoryStreamClient,
+    AsyncSnippetStreamClient,
+    AsyncHistogramStreamClient,
+    AsyncMemoryCommandClient,
+    AsyncControlCommandClient
+)
 
 
 ###
@@ -35,7 +49,16 @@ class Instrument:
                  rp_dir="piccolo_testing",
                  verbose=False,
                  very_verbose=False,
-                 debug_flag=False 
+                 debug_flag=False,
+                 memory_stream_variables=None,
+                 memory_stream_max_rate_hz=None,
+                 use_asyncio=False,
+                 client_loop=None,
+                 metrics_interval_s=None,
+                 metrics_callback=None,
+                 adc_transport="tcp",
+                 adc_udp_group=None,
+                 adc_udp_port=5001
                  ):
         
         # Local and remote script information
@@ -50,6 +73,30 @@ class Instrument:
         self.very_verbose = very_verbose
         self.debug_flag = debug_flag
 
+        # Memory stream subscription (None streams every register at the full rate)
+        self.memory_stream_variables = memory_stream_variables
+        self.memory_stream_max_rate_hz = memory_stream_max_rate_hz
+
+        # asyncio clients run on one event loop thread, which several instruments may share
+        self.use_asyncio = use_asyncio or client_loop is not None
+        self.client_loop = client_loop
+        if self.use_asyncio and self.client_loop is None:
+            self.client_loop = ClientLoop()
+
+        # ADC frames over TCP, or over UDP to this host (adc_udp_group=None) or a multicast group,
+        # where a frame missing a datagram is dropped rather than delaying the ones after it
+        if adc_transport not in ("tcp", "udp"):
+            raise ValueError(f"Unsupported ADC transport: {adc_transport}")
+        self.adc_transport = adc_transport
+        self.adc_udp_group = adc_udp_group
+        self.adc_udp_port = adc_udp_port
+
+        # Client metrics are passed to metrics_callback (or printed) every metrics_interval_s while running
+        self.metrics_interval_s = metrics_interval_s
+        self.metrics_callback = metrics_callback
+        self.metrics_thread = None
+        self.metrics_stop = threading.Event()
+
         # Get rp login information
         self.get_rp_login()
 
@@ -218,34 +265,263 @@ class Instrument:
 
     def setup_clients(self):
         """Initialize but don't start clients yet."""
-        self.adc_stream_client = ADCStreamClient(
-            data_callback=self._get_adc_data)
-        self.memory_stream_client = MemoryStreamClient(
-            data_callback=self._get_memory_data)
-        self.memory_command_client = MemoryCommandClient()
-        self.control_command_client = ControlCommandClient()
+        if self.use_asyncio:
+            kwargs = {"client_loop": self.client_loop}
+            classes = (AsyncADCStreamClient, AsyncMemoryStreamClient, AsyncMemoryCommandClient,
+                       AsyncControlCommandClient, AsyncSnippetStreamClient, AsyncHistogramStreamClient)
+        else:
+            kwargs = {}
+            classes = (ADCStreamClient, MemoryStreamClient, MemoryCommandClient,
+                       ControlCommandClient, SnippetStreamClient, HistogramStreamClient)
+        adc_class, memory_class, command_class, control_class, snippet_class, histogram_class = classes
+
+        # Streams and memory writes reconnect on their own; client_states shows where each one is
+        self.client_states = {}
+        state = self._client_state_callback
+
+        # Callbacks run off the socket threads: a slow consumer gets the newest ADC frame, merged
+        # droplet batches and the latest snippets, while the sockets keep draining at wire speed
+        if self.adc_transport == "udp":
+            # Datagrams are received by the threaded client in either mode
+            self.adc_stream_client = ADCDatagramClient(
+                port=self.adc_udp_port, group=self.adc_udp_group, data_callback=self._get_adc_data,
+                state_callback=state("adc_stream"), queue_size=2, queue_policy="coalesce")
+        else:
+            self.adc_stream_client = adc_class(
+                data_callback=self._get_adc_data, state_callback=state("adc_stream"),
+                queue_size=2, queue_policy="coalesce", **kwargs)
+        self.memory_stream_client = memory_class(
+            data_callback=self._get_memory_data, encoding="binary", batch=True,
+            variables=self.memory_stream_variables, max_rate_hz=self.memory_stream_max_rate_hz,
+            state_callback=state("memory_stream"), queue_size=64, queue_policy="coalesce", **kwargs)
+        self.memory_command_client = command_class(
+            state_callback=state("memory_command"), verbose=self.verbose, **kwargs)
+        self.control_command_client = control_class(**kwargs)
+        self.snippet_stream_client = snippet_class(
+            data_callback=self._get_snippet_data, state_callback=state("snippet_stream"),
+            queue_size=256, queue_policy="drop_oldest", **kwargs)
+        self.snippets = collections.deque(maxlen=1000)  # (droplet_id, (2, N) volts) pairs
+        self.histogram_stream_client = histogram_class(state_callback=state("histogram_stream"), **kwargs)
+
+
+    def _client_state_callback(self, name):
+        """State callback recording a client's connection state in self.client_states."""
+        def callback(state):
+            self.client_states[name] = state
+            if self.verbose or state == "disconnected":
+                print(f"[Instrument] {name} client {state}")
+        return callback
+
+
+    def _call_client(self, result):
+        """Result of a client call, run on the client loop when the asyncio clients return a coroutine."""
+        if asyncio.iscoroutine(result):
+            return self.client_loop.run(result)
+        return result
+
+
+    def _connect_control(self):
+        """Connect the control command client on first use, or again after it lost the connection."""
+        if not self.control_command_client.connected:
+            self._call_client(self.control_command_client.connect(self.ip))
+
+
+    def _control_command(self, method, **settings):
+        """Run a control client command, reconnecting and retrying once if the connection was lost."""
+        for attempt in range(2):
+            self._connect_control()
+            try:
+                return self._call_client(getattr(self.control_command_client, method)(**settings))
+            except ConnectionError as e:
+                if attempt:
+                    raise
+                print(f"[Instrument] Control command failed, reconnecting: {e}")
+
+
+    def _local_address(self):
+        """Address of this host on the route to the Red Pitaya, for unicast ADC datagrams."""
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect((self.ip, self.adc_udp_port))  # no packet is sent
+            return sock.getsockname()[0]
+
+
+    def set_adc_udp(self, enabled=True):
+        """Have the Red Pitaya send (or stop sending) the ADC frames over UDP to adc_stream_client."""
+        address = self.adc_udp_group or self._local_address()
+        self.adc_udp_settings = self._control_command(
+            "configure_adc_udp", enabled=enabled, address=address, port=self.adc_udp_port)
+
+        if self.verbose:
+            print(f"[Instrument] ADC UDP settings: {self.adc_udp_settings}")
+
+        return self.adc_udp_settings
 
 
     def start_clients(self):
         """Start all Red Pitaya clients."""
         self.adc_stream_client.start(self.ip)
+        if self.adc_transport == "udp":
+            self.set_adc_udp(enabled=True)
         self.memory_stream_client.start(self.ip)
         self.memory_command_client.start(self.ip)
+        if self.metrics_interval_s:
+            self.metrics_stop.clear()
+            self.metrics_thread = threading.Thread(target=self._emit_client_metrics, daemon=True)
+            self.metrics_thread.start()
         print("[Instrument] All clients started.")       
 
 
     def stop_clients(self):
         """Stop all clients."""
+        if self.metrics_thread:
+            self.metrics_stop.set()
+            self.metrics_thread.join()
+            self.metrics_thread = None
+        if self.adc_transport == "udp":
+            try:
+                self.set_adc_udp(enabled=False)
+            except (OSError, ValueError) as e:
+                print(f"[Instrument] Could not stop the ADC UDP stream: {e}")
         self.adc_stream_client.stop()
         self.memory_stream_client.stop()
         self.memory_command_client.stop()
+        if self.snippet_stream_client.connected:
+            self.snippet_stream_client.stop()
+        if self.histogram_stream_client.connected:
+            self.histogram_stream_client.stop()
+        self._call_client(self.control_command_client.close())
         print("[Instrument] All clients stopped.")
 
 
     def set_memory_variable(self, variable, value):
-        """Set FPGA memory variable."""
+        """Set FPGA memory variable; pending writes to the same variable are coalesced to the newest value."""
         self.memory_command_client.send_set_command(variable, value)
-        print(f"[Instrument] Queued memory variable set: {variable} = {value}")
+        if self.verbose:
+            print(f"[Instrument] Queued memory variable set: {variable} = {value}")
+
+
+    def set_memory_variables(self, values):
+        """Atomically set several FPGA memory variables; returns a Future for the ack."""
+        future = self.memory_command_client.send_batch_command(values)
+        if self.verbose:
+            print(f"[Instrument] Queued memory variable batch: {values}")
+        return future
+
+
+    def set_adc_acquisition(self, decimation=None, n_samples=None, trigger_source=None,
+                            trigger_level=None, adc_format=None, mode=None):
+        """Change the Red Pitaya acquisition settings at runtime; the ADC stream resizes itself.
+
+        mode="continuous" streams gap-free n_samples chunks (see adc_stream_client.lost_samples).
+        """
+        settings = {
+            "decimation": decimation,
+            "n_samples": n_samples,
+            "trigger_source": trigger_source,
+            "trigger_level": trigger_level,
+            "format": adc_format,
+            "mode": mode,
+            }
+        settings = {k: v for k, v in settings.items() if v is not None}
+
+        self.adc_settings = self._control_command("configure_adc", **settings)
+
+        if self.verbose:
+            print(f"[Instrument] ADC acquisition settings: {self.adc_settings}")
+
+        return self.adc_settings
+
+
+    def start_snippet_capture(self, pre_samples=None, post_samples=None, every_nth=None, adc_format=None):
+        """Capture both channels around each (Nth) droplet; snippets collect in self.snippets."""
+        settings = {
+            "pre_samples": pre_samples,
+            "post_samples": post_samples,
+            "every_nth": every_nth,
+            "format": adc_format,
+            }
+        settings = {k: v for k, v in settings.items() if v is not None}
+
+        self.snippet_settings = self._control_command("configure_snippets", **settings)
+
+        if not self.snippet_stream_client.connected:
+            self.snippet_stream_client.start(self.ip)
+
+        if self.verbose:
+            print(f"[Instrument] Snippet capture settings: {self.snippet_settings}")
+
+        return self.snippet_settings
+
+
+    def start_histogram_stream(self, bins=None, pairs=None, rate_hz=None):
+        """Stream histograms binned on the Red Pitaya; running totals are in histogram_stream_client.histograms.
+
+        bins maps register names to [low, high, n_bins] and pairs lists [x, y] names for 2D histograms.
+        """
+        settings = {"bins": bins, "pairs": pairs, "rate_hz": rate_hz}
+        settings = {k: v for k, v in settings.items() if v is not None}
+
+        self.histogram_settings = self._control_command("configure_histograms", **settings)
+
+        if not self.histogram_stream_client.connected:
+            self.histogram_stream_client.start(self.ip)
+
+        if self.verbose:
+            print(f"[Instrument] Histogram settings: {self.histogram_settings}")
+
+        return self.histogram_settings
+
+
+    def get_rp_telemetry(self):
+        """Poll the Red Pitaya server telemetry; the latest snapshot is kept in self.rp_telemetry."""
+        self.rp_telemetry = self._control_command("get_telemetry")
+
+        if self.very_verbose:
+            print(f"[Instrument] Red Pitaya telemetry: {self.rp_telemetry}")
+
+        return self.rp_telemetry
+
+
+    def get_client_metrics(self):
+        """Throughput, latency (recv wait, recv, decode, callback) and connection state of every client."""
+        clients = {
+            "adc_stream": self.adc_stream_client,
+            "memory_stream": self.memory_stream_client,
+            "memory_command": self.memory_command_client,
+            "snippet_stream": self.snippet_stream_client,
+            "histogram_stream": self.histogram_stream_client,
+            }
+        return {name: client.get_metrics() for name, client in clients.items()}
+
+
+    def get_droplet_loss(self):
+        """Received, duplicated and missed droplets (from droplet_id continuity) and the loss-rate series."""
+        droplets = self.memory_stream_client.droplets
+        snapshot = droplets.snapshot()
+        with droplets.lock:
+            snapshot["loss_series"] = list(droplets.loss_series)
+        return snapshot
+
+
+    def reset_droplet_loss(self):
+        """Restart the droplet accounting, e.g. at the start of a tuning run."""
+        self.memory_stream_client.droplets.reset()
+
+
+    def _emit_client_metrics(self):
+        """Pass a metrics snapshot to metrics_callback (or print it) every metrics_interval_s."""
+        while not self.metrics_stop.wait(self.metrics_interval_s):
+            metrics = self.get_client_metrics()
+            if self.metrics_callback:
+                self.metrics_callback(metrics)
+            else:
+                for name, snapshot in metrics.items():
+                    latency = snapshot["latency"]
+                    print(f"[Instrument] {name}: {snapshot['state']}, "
+                          f"{snapshot['per_s'].get('messages', 0):.0f} msg/s, "
+                          f"{snapshot['per_s'].get('bytes', 0) / 1e6:.2f} MB/s, "
+                          + ", ".join(f"{stage} p99 {latency[stage]['p99_us']} us"
+                                      for stage in ("recv_wait", "decode", "callback") if stage in latency))
 
 
     def stop_servers(self):
@@ -259,39 +535,64 @@ class Instrument:
     ################ Red Pitaya ADC Data Handling Methods ################
 
     def _get_adc_data(self, adc1_data, adc2_data):
+        # Raw int16 frames are converted to volts with the Red Pitaya calibration. Float frames are kept
+        # as they are: the ADC client is queued, so every frame arrives in a buffer of its own
+        if adc1_data.dtype == np.int16:
+            adc1_data = self._raw_to_volts(adc1_data, "CH1")
+            adc2_data = self._raw_to_volts(adc2_data, "CH2")
+
         self.adc1_data = adc1_data
         self.adc2_data = adc2_data
 
         return self.adc1_data, self.adc2_data
 
+    def _get_snippet_data(self, droplet_id, snippet):
+        # Raw int16 snippets are converted to volts with the Red Pitaya calibration
+        if snippet.dtype == np.int16:
+            snippet = np.stack([self._raw_to_volts(snippet[0], "CH1"),
+                                self._raw_to_volts(snippet[1], "CH2")])
+        self.snippets.append((droplet_id, snippet))
+
+        return droplet_id, snippet
+
+    def _raw_to_volts(self, raw, ch_key):
+        """Convert raw 14-bit ADC counts to volts using the front-end gain and offset."""
+        gain, offset = self.calibration_values[ch_key]
+        full_scale = gain * 100.0 / 2**32  # calibrated full-scale voltage
+        return (raw.astype(np.float32) - offset) * (full_scale / 8192.0)
+
     def _get_memory_data(self, fpgaoutput):
-        if not fpgaoutput:
+        if fpgaoutput is None or len(fpgaoutput) == 0:
             return
 
         try:
-            row = fpgaoutput
+            # Records arrive as dicts (json), NumPy structured records or, when batched,
+            # lists of dicts / structured arrays; convert them all in one go
+            if isinstance(fpgaoutput, dict):
+                rows = pd.DataFrame([fpgaoutput])
+            elif isinstance(fpgaoutput, list):
+                rows = pd.DataFrame(fpgaoutput)
+            else:
+                rows = pd.DataFrame(np.atleast_1d(fpgaoutput))
             
             for ch in (0, 1):
                 ch_key = f"CH{ch+1}"
                 _, offset = self.calibration_values[ch_key]
 
                 # Intensity
-                raw_int = fpgaoutput[f"cur_droplet_intensity[{ch}]"]
-                row[f"cur_droplet_intensity[{ch}]"] = raw_int
-                row[f"cur_droplet_intensity_v[{ch}]"] = (raw_int - offset) / 8192.0
+                raw_int = rows[f"cur_droplet_intensity[{ch}]"]
+                rows[f"cur_droplet_intensity_v[{ch}]"] = (raw_int - offset) / 8192.0
 
                 # Area
-                raw_area = fpgaoutput[f"cur_droplet_area[{ch}]"]
-                row[f"cur_droplet_area[{ch}]"] = raw_area
-                row[f"cur_droplet_area_vms[{ch}]"] = raw_area / 8192.0 / 1000.0
+                raw_area = rows[f"cur_droplet_area[{ch}]"]
+                rows[f"cur_droplet_area_vms[{ch}]"] = raw_area / 8192.0 / 1000.0
 
                 # Width
-                raw_width = fpgaoutput[f"cur_droplet_width[{ch}]"]
-                row[f"cur_droplet_width[{ch}]"] = raw_width
-                row[f"cur_droplet_width_ms[{ch}]"] = raw_width / 1000.0
+                raw_width = rows[f"cur_droplet_width[{ch}]"]
+                rows[f"cur_droplet_width_ms[{ch}]"] = raw_width / 1000.0
 
             # Append to DataFrame
-            self.droplet_data = pd.concat([self.droplet_data, pd.DataFrame([row])], ignore_index=True)
+            self.droplet_data = pd.concat([self.droplet_data, rows], ignore_index=True)
 
             # Maintain rolling size
             if len(self.droplet_data) > self.buffer_size:
@@ -354,9 +655,9 @@ class Instrument:
 
         if self.verbose:
             print(f"[Instrument] Setting sort gates: {sort_gates}")
-        # Write sort_gates to FPGA memory
-        for var, val in sort_gates.items():
-            self.set_memory_variable(var, val)
+        # Write sort_gates to FPGA memory as one atomic batch; the ack can be awaited
+        # with self.sort_gates_ack.result()
+        self.sort_gates_ack = self.set_memory_variables(sort_gates)
 
         # Save for inspection
         self.sort_gates = sort_gates
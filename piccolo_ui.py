@@ -160,9 +160,9 @@ class UI:
                 y = self.sim.droplet_data["y"].values
                 
             else:
-                # Update SiPM data
+                # Update SiPM data (the frame length follows the RP acquisition settings)
                 self.sipm.data = {
-                    'x':    np.linspace(0, 50, 4096),
+                    'x':    np.linspace(0, 50, len(self.instrument.adc1_data)),
                     'y0':   self.instrument.adc1_data,
                     'y1':   self.instrument.adc2_data
                 }
@@ -0,0 +1,263 @@
+# Imports from the python standard library:
+import os
+import json
+import mmap
+import time
+import struct
+import threading
+import argparse
+
+# Third party imports, installable via pip:
+import numpy as np
+
+# Size of the FPGA register window PiccoloRP maps at 0x40600000
+REGISTER_WINDOW_SIZE = 0x2000
+
+# Red Pitaya ADC: 125 MS/s into a 16k-sample ring buffer per channel, 14-bit counts over +/-1 V
+ADC_SAMPLE_RATE = 125e6
+ADC_COUNTS_PER_VOLT = 8192
+
+
+def load_register_offsets(json_path=None):
+    """Map every (expanded) variable name in piccolo_mmap.json to its byte offset."""
+    if json_path is None:
+        json_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "piccolo_mmap.json")
+    with open(json_path, "r") as f:
+        mmap_json = json.load(f)
+
+    offsets = {}
+    for var in mmap_json["fpga_outputs"] + mmap_json["fpga_inputs"]:
+        if isinstance(var["addr"], list):
+            for i, addr in enumerate(var["addr"]):
+                offsets[f"{var['name']}[{i}]"] = int(addr, 16)
+        else:
+            offsets[var["name"]] = int(var["addr"], 16)
+
+    return offsets
+
+
+class EmulatedRP:
+    """Stand-in for the Red Pitaya `rp` module, generating droplet pulses on both ADC channels.
+
+    Samples are a pure function of their absolute index, so the ring buffer, write pointer and
+    trigger position stay consistent with wall-clock time without storing any buffer.
+    """
+    ADC_BUFFER_SIZE = 16384
+    RP_CH_1, RP_CH_2 = 0, 1
+    RP_T_CH_1, RP_T_CH_2, RP_T_CH_EXT = 0, 1, 2
+    (RP_TRIG_SRC_DISABLED, RP_TRIG_SRC_NOW, RP_TRIG_SRC_CHA_PE, RP_TRIG_SRC_CHA_NE,
+     RP_TRIG_SRC_CHB_PE, RP_TRIG_SRC_CHB_NE, RP_TRIG_SRC_EXT_PE, RP_TRIG_SRC_EXT_NE) = range(8)
+    RP_TRIG_STATE_WAITING, RP_TRIG_STATE_TRIGGERED = 0, 1
+
+    def __init__(self, droplet_rate_hz=1000.0, pulse_width_s=20e-6, amplitudes=(0.6, 0.3),
+                 noise_v=0.01, seed=0):
+        self.droplet_rate_hz = droplet_rate_hz
+        self.pulse_width_s = pulse_width_s
+        self.amplitudes = amplitudes
+        self.noise = np.random.default_rng(seed).normal(0, noise_v, (2, self.ADC_BUFFER_SIZE)).astype(np.float32)
+
+        self.decimation = 1
+        self.trigger_src = self.RP_TRIG_SRC_DISABLED
+        self.trigger_levels = {}
+        self.t_start = time.perf_counter()
+        self.t_armed = self.t_start
+        self.droplet_epoch = self.t_start  # pulses are centred on epoch + k / droplet_rate_hz
+        self.analog_outputs = {}
+
+        # RP_DEC_1 ... RP_DEC_65536, as exported by the real module
+        for i in range(17):
+            setattr(self, f"RP_DEC_{2**i}", 2**i)
+
+    def _sample_index(self, t=None):
+        """Absolute (decimated) sample index at time t."""
+        t = time.perf_counter() if t is None else t
+        return int((t - self.t_start) * ADC_SAMPLE_RATE / self.decimation)
+
+    def _waveform(self, ch, index):
+        """Volts at the given absolute sample indices: one Gaussian pulse per droplet period."""
+        sample_s = self.decimation / ADC_SAMPLE_RATE
+        period = 1.0 / self.droplet_rate_hz
+        t = (self.t_start - self.droplet_epoch + index * sample_s + period / 2) % period - period / 2
+        pulse = self.amplitudes[ch] * np.exp(-0.5 * (t / self.pulse_width_s) ** 2)
+        return pulse + self.noise[ch][index % self.ADC_BUFFER_SIZE]
+
+    ################ Acquisition API ################
+    def rp_Init(self):
+        return 0
+
+    def rp_Release(self):
+        return 0
+
+    def rp_AcqReset(self):
+        self.trigger_src = self.RP_TRIG_SRC_DISABLED
+        return 0
+
+    def rp_AcqSetDecimation(self, decimation):
+        self.decimation = decimation
+        self.t_start = time.perf_counter()
+        return 0
+
+    def rp_AcqSetTriggerLevel(self, channel, level):
+        self.trigger_levels[channel] = level
+        return 0
+
+    def rp_AcqSetTriggerDelay(self, delay):
+        return 0
+
+    def rp_AcqSetTriggerSrc(self, source):
+        self.trigger_src = source
+        self.t_armed = time.perf_counter()
+        return 0
+
+    def rp_AcqStart(self):
+        return 0
+
+    def rp_AcqStop(self):
+        return 0
+
+    def rp_AcqGetWritePointer(self):
+        return [0, self._sample_index() % self.ADC_BUFFER_SIZE]
+
+    def rp_AcqGetTriggerState(self):
+        # Edge triggers fire on the first droplet after arming
+        if self.trigger_src == self.RP_TRIG_SRC_NOW or \
+                time.perf_counter() - self.t_armed >= 1.0 / self.droplet_rate_hz:
+            return [0, self.RP_TRIG_STATE_TRIGGERED]
+        return [0, self.RP_TRIG_STATE_WAITING]
+
+    def rp_AcqGetBufferFillState(self):
+        return [0, True]
+
+    def rp_AcqGetWritePointerAtTrig(self):
+        # Centre of the most recent pulse
+        period = 1.0 / self.droplet_rate_hz
+        t_pulse = time.perf_counter() - (time.perf_counter() - self.droplet_epoch) % period
+        return [0, self._sample_index(t_pulse) % self.ADC_BUFFER_SIZE]
+
+    def rp_AcqGetDataVNP(self, channel, pos, buffer):
+        """Fill buffer with volts from ring buffer position pos onwards."""
+        newest = self._sample_index()
+        start = newest - (newest - pos) % self.ADC_BUFFER_SIZE
+        buffer[:] = self._waveform(channel, np.arange(start, start + len(buffer)))
+        return 0
+
+    def rp_AcqGetDataRawNP(self, channel, pos, buffer):
+        """Fill buffer with 14-bit counts from ring buffer position pos onwards."""
+        volts = np.empty(len(buffer), dtype=np.float32)
+        self.rp_AcqGetDataVNP(channel, pos, volts)
+        buffer[:] = np.clip(volts * ADC_COUNTS_PER_VOLT, -8192, 8191)
+        return 0
+
+    ################ Analog output API ################
+    def rp_ApinReset(self):
+        self.analog_outputs.clear()
+        return 0
+
+    def rp_AOpinSetValue(self, pin, voltage):
+        self.analog_outputs[pin] = voltage
+        return 0
+
+
+class PiccoloEmulator:
+    """Register window and droplet model standing in for the Piccolo FPGA.
+
+    The window is an anonymous mmap, or a file mmap when mmap_path is given so other
+    processes can inspect it. A model thread advances droplet_id, cur_time_us and the
+    droplet measurements at droplet_rate_hz, writing droplet_id last as the FPGA does.
+    """
+    def __init__(self, droplet_rate_hz=1000.0, mmap_path=None, seed=0, verbose=False):
+        self.droplet_rate_hz = droplet_rate_hz
+        self.mmap_path = mmap_path
+        self.verbose = verbose
+        self.rng = np.random.default_rng(seed)
+        self.offsets = load_register_offsets()
+        self.rp = EmulatedRP(droplet_rate_hz=droplet_rate_hz, seed=seed)
+
+        if mmap_path:
+            self.file = open(mmap_path, "w+b")
+            self.file.truncate(REGISTER_WINDOW_SIZE)
+            self.mmap = mmap.mmap(self.file.fileno(), REGISTER_WINDOW_SIZE)
+        else:
+            self.file = None
+            self.mmap = mmap.mmap(-1, REGISTER_WINDOW_SIZE)
+
+        self.droplet_id = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _write(self, name, fmt, value):
+        struct.pack_into(fmt, self.mmap, self.offsets[name], value)
+
+    def _read(self, name, fmt):
+        return struct.unpack_from(fmt, self.mmap, self.offsets[name])[0]
+
+    def _emit_droplets(self, n_droplets):
+        """Write the measurements of the newest of n_droplets new droplets, then bump droplet_id."""
+        intensity = self.rng.normal((4000, 2000), (1500, 800)).astype(int)
+        width = self.rng.normal((60, 60), (15, 15)).clip(1).astype(int)
+        area = intensity * width // 2
+
+        # Channel i passes when inside the low/high intensity gates set by the host
+        classification = 0
+        for ch in range(2):
+            self._write(f"cur_droplet_intensity[{ch}]", "<i", intensity[ch])
+            self._write(f"cur_droplet_width[{ch}]", "<I", width[ch])
+            self._write(f"cur_droplet_area[{ch}]", "<i", area[ch])
+            low = self._read(f"low_intensity_thresh[{ch}]", "<h")
+            high = self._read(f"high_intensity_thresh[{ch}]", "<h")
+            if low <= intensity[ch] <= high:
+                classification |= 1 << ch
+        self._write("droplet_classification", "<H", classification)
+
+        self.droplet_id = (self.droplet_id + n_droplets) & 0xFFFFFFFF
+        self._write("droplet_id", "<I", self.droplet_id)
+
+    def _run(self):
+        """Model loop; droplets that fall between wake-ups are counted but only the newest is visible."""
+        period = 1.0 / self.droplet_rate_hz
+        t_start = time.perf_counter()
+        self.rp.droplet_epoch = t_start  # ADC pulses line up with the emitted droplets
+        emitted = 0
+        while not self.stop_event.is_set():
+            now = time.perf_counter()
+            self._write("cur_time_us", "<I", int((now - t_start) * 1e6) & 0xFFFFFFFF)
+            due = int((now - t_start) / period)
+            if due > emitted:
+                self._emit_droplets(due - emitted)
+                emitted = due
+            # Wake for the next droplet, so droplet_id changes close to its pulse as on the FPGA
+            time.sleep(max(min(t_start + (emitted + 1) * period - time.perf_counter(), 0.001), 0))
+
+    def start(self):
+        """Start the droplet model thread."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True, name="piccolo_emulator")
+            self.thread.start()
+            if self.verbose:
+                print(f"[PiccoloEmulator] Emulating {self.droplet_rate_hz:g} droplets/s.")
+
+    def stop(self):
+        """Stop the model thread and release the register window."""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.mmap.close()
+        if self.file:
+            self.file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Piccolo register model against a file-backed window")
+    parser.add_argument("--mmap_file", required=True, help="File to back the 8 KB register window")
+    parser.add_argument("--droplet_rate", type=float, default=1000.0, help="Droplets per second")
+    args = parser.parse_args()
+
+    emulator = PiccoloEmulator(droplet_rate_hz=args.droplet_rate, mmap_path=args.mmap_file, verbose=True)
+    emulator.start()
+    try:
+        while True:
+            time.sleep(1)
+            print(f"droplet_id={emulator.droplet_id}")
+    except KeyboardInterrupt:
+        emulator.stop()
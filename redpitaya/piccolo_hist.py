@@ -0,0 +1,74 @@
+# Third party imports, installable via pip:
+import numpy as np
+
+# Droplet measurement registers binned by default, as [low, high, n_bins] in raw register units
+DEFAULT_HIST_BINS = {
+    "cur_droplet_intensity[0]": [0, 8192, 128],
+    "cur_droplet_intensity[1]": [0, 8192, 128],
+    "cur_droplet_width[0]": [0, 1024, 128],
+    "cur_droplet_width[1]": [0, 1024, 128],
+    "cur_droplet_area[0]": [0, 2**22, 128],
+    "cur_droplet_area[1]": [0, 2**22, 128],
+    }
+
+# 2D histograms: the cross-channel intensity view of the UI and intensity/width per channel
+DEFAULT_HIST_PAIRS = [
+    ["cur_droplet_intensity[0]", "cur_droplet_intensity[1]"],
+    ["cur_droplet_intensity[0]", "cur_droplet_width[0]"],
+    ["cur_droplet_intensity[1]", "cur_droplet_width[1]"],
+    ]
+
+
+class DropletHistograms:
+    """Running 1D and 2D histograms of droplet registers with uniform integer binning.
+
+    Values outside [low, high) are not binned but counted per histogram.
+    """
+    def __init__(self, bins, pairs):
+        self.bins = {name: (float(low), float(high), int(n)) for name, (low, high, n) in bins.items()}
+        self.pairs = [tuple(pair) for pair in pairs]
+        self.variables = list(self.bins)
+
+        # Layout of the packed counts: every 1D histogram, then every 2D histogram
+        self.layout = [{"name": name, "bins": list(self.bins[name]), "shape": [self.bins[name][2]]}
+                       for name in self.variables]
+        self.layout += [{"name": f"{x}|{y}", "bins": [list(self.bins[x]), list(self.bins[y])],
+                         "shape": [self.bins[x][2], self.bins[y][2]]} for x, y in self.pairs]
+        self.reset()
+
+    def reset(self):
+        """Zero all counts."""
+        self.counts = [np.zeros(entry["shape"], dtype=np.uint32) for entry in self.layout]
+        self.outside = [0] * len(self.layout)
+        self.n_droplets = 0
+
+    def _bin_index(self, name, values):
+        """Bin index of each value, -1 where the value is out of range."""
+        low, high, n = self.bins[name]
+        index = ((values - low) * (n / (high - low))).astype(np.int64)
+        index[(values < low) | (values >= high)] = -1
+        return index
+
+    def add(self, columns):
+        """Bin a batch of droplets given as {name: 1D array of values}."""
+        index = {name: self._bin_index(name, np.asarray(columns[name], dtype=np.float64))
+                 for name in self.variables}
+        for i, name in enumerate(self.variables):
+            valid = index[name] >= 0
+            self.counts[i] += np.bincount(index[name][valid], minlength=self.bins[name][2]).astype(np.uint32)
+            self.outside[i] += int(len(valid) - valid.sum())
+
+        offset = len(self.variables)
+        for i, (x, y) in enumerate(self.pairs):
+            n_y = self.bins[y][2]
+            valid = (index[x] >= 0) & (index[y] >= 0)
+            flat = index[x][valid] * n_y + index[y][valid]
+            counts = self.counts[offset + i]
+            counts += np.bincount(flat, minlength=counts.size).astype(np.uint32).reshape(counts.shape)
+            self.outside[offset + i] += int(len(valid) - valid.sum())
+
+        self.n_droplets += len(next(iter(columns.values())))
+
+    def pack(self):
+        """Little-endian uint32 counts of every histogram, concatenated in layout order."""
+        return b"".join(counts.astype("<u4").tobytes() for counts in self.counts)
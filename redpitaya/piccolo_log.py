@@ -0,0 +1,170 @@
+# Imports from the python standard library:
+import os
+import io
+import glob
+import json
+import mmap
+import time
+import struct
+import argparse
+
+# Third party imports, installable via pip:
+import numpy as np
+
+# File layout: a fixed-size header page followed by preallocated fixed-size records.
+# Header: magic, version, header size, record size, record count, then the schema JSON.
+LOG_MAGIC = b"PICCOLOG"
+LOG_VERSION = 1
+LOG_HEADER_SIZE = 4096
+LOG_HEADER = struct.Struct("<8sIIIQ")
+LOG_COUNT_OFFSET = 20  # byte offset of the record count inside the header
+
+
+class BinaryLogWriter:
+    """Append fixed-size binary records to preallocated, memory-mapped, size-rotated files."""
+    def __init__(self, log_dir, fields, prefix="piccolo_log", max_file_bytes=64 * 2**20,
+                 max_files=16, fsync_interval=1.0, verbose=False):
+        self.log_dir = log_dir
+        self.fields = [list(field) for field in fields]
+        self.prefix = prefix
+        self.max_files = max_files
+        self.fsync_interval = fsync_interval
+        self.verbose = verbose
+
+        # Records are packed straight into the mapped file with one precompiled struct
+        self.record_struct = struct.Struct("<" + "".join(fmt[1:] for _, fmt in self.fields))
+        self.record_size = self.record_struct.size
+        self.records_per_file = (max_file_bytes - LOG_HEADER_SIZE) // self.record_size
+        if self.records_per_file < 1:
+            raise ValueError(f"max_file_bytes too small for {self.record_size}-byte records")
+
+        self.schema = json.dumps({"fields": self.fields}).encode()
+        if LOG_HEADER.size + len(self.schema) > LOG_HEADER_SIZE:
+            raise ValueError("Record schema does not fit in the log header")
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.session = time.strftime('%Y%m%d_%H%M%S')
+        self.file_index = 0
+        self.files = []
+        self.total_records = 0
+        self.mm = None
+        self._open_file()
+
+    def _open_file(self):
+        """Preallocate and map the next file of the rotation and write its header."""
+        filename = f"{self.prefix}_{self.session}_{self.file_index:04d}.bin"
+        self.filename = os.path.join(self.log_dir, filename)
+        file_size = LOG_HEADER_SIZE + self.records_per_file * self.record_size
+
+        self.file = open(self.filename, "w+b")
+        self.file.truncate(file_size)
+        self.mm = mmap.mmap(self.file.fileno(), file_size)
+        LOG_HEADER.pack_into(self.mm, 0, LOG_MAGIC, LOG_VERSION, LOG_HEADER_SIZE, self.record_size, 0)
+        self.mm[LOG_HEADER.size:LOG_HEADER.size + len(self.schema)] = self.schema
+
+        self.count = 0
+        self.pos = LOG_HEADER_SIZE
+        self.last_sync = time.time()
+        self.files.append(self.filename)
+
+        # Drop the oldest files so the rotation acts as a ring buffer on the SD card
+        while len(self.files) > self.max_files:
+            os.remove(self.files.pop(0))
+
+        if self.verbose:
+            print(f"Binary log file {self.filename} opened ({self.records_per_file} records).")
+
+    def _close_file(self):
+        """Sync the record count, unmap and trim the current file to its used size."""
+        self.sync()
+        self.mm.close()
+        self.file.truncate(LOG_HEADER_SIZE + self.count * self.record_size)
+        self.file.close()
+        self.mm = None
+
+    def sync(self):
+        """Publish the record count and flush the mapped pages to storage."""
+        struct.pack_into("<Q", self.mm, LOG_COUNT_OFFSET, self.count)
+        self.mm.flush()
+        self.last_sync = time.time()
+
+    def append(self, *values):
+        """Pack one record into the mapped file, rotating and syncing as needed."""
+        if self.count == self.records_per_file:
+            self._close_file()
+            self.file_index += 1
+            self._open_file()
+
+        self.record_struct.pack_into(self.mm, self.pos, *values)
+        self.pos += self.record_size
+        self.count += 1
+        self.total_records += 1
+
+        # fsync in batches rather than per record
+        if time.time() - self.last_sync > self.fsync_interval:
+            self.sync()
+
+    def close(self):
+        """Finish the current file."""
+        if self.mm is not None:
+            self._close_file()
+
+
+def read_log(path):
+    """Read the valid records of one binary log file into a NumPy structured array."""
+    with open(path, "rb") as f:
+        header = f.read(LOG_HEADER_SIZE)
+        magic, version, header_size, record_size, count = LOG_HEADER.unpack_from(header)
+        if magic != LOG_MAGIC:
+            raise ValueError(f"{path} is not a piccolo binary log")
+        schema = json.loads(header[LOG_HEADER.size:].rstrip(b'\x00').decode())
+        dtype = np.dtype([tuple(field) for field in schema["fields"]])
+        if dtype.itemsize != record_size:
+            raise ValueError(f"{path} schema does not match its record size")
+
+        # Files that were not closed cleanly may hold more records than the synced count
+        f.seek(header_size)
+        data = f.read()
+        count = max(count, _count_written_records(data, record_size))
+
+    return np.frombuffer(data[:count * record_size], dtype=dtype)
+
+
+def _count_written_records(data, record_size):
+    """Count records up to the first all-zero (never written) record."""
+    records = np.frombuffer(data[:len(data) // record_size * record_size], dtype=np.uint8)
+    written = records.reshape(-1, record_size).any(axis=1)
+    return int(np.argmin(written)) if not written.all() else len(written)
+
+
+def convert_log(paths, out_path, out_format="csv"):
+    """Convert one or more binary log files (in order) to a CSV or columnar .npz file."""
+    if isinstance(paths, str):
+        paths = sorted(glob.glob(paths))
+    records = np.concatenate([read_log(path) for path in paths])
+
+    if out_format == "csv":
+        with open(out_path, "w", newline="") as f:
+            f.write(",".join(records.dtype.names) + "\n")
+            buffer = io.StringIO()
+            np.savetxt(buffer, np.column_stack([records[name] for name in records.dtype.names]),
+                       delimiter=",", fmt="%.17g")
+            f.write(buffer.getvalue())
+    elif out_format == "npz":
+        np.savez(out_path, **{name: records[name] for name in records.dtype.names})
+    else:
+        raise ValueError(f"Unsupported output format: {out_format}")
+
+    return len(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert piccolo binary logs to CSV or columnar .npz")
+    parser.add_argument("paths", nargs="+", help="Binary log files, in order (globs allowed)")
+    parser.add_argument("--out", required=True, help="Output file")
+    parser.add_argument("--format", choices=["csv", "npz"], default="csv", help="Output format")
+    args = parser.parse_args()
+
+    paths = sorted(path for pattern in args.paths for path in glob.glob(pattern))
+    n_records = convert_log(paths, args.out, args.format)
+    print(f"Converted {n_records} records from {len(paths)} file(s) to {args.out}")
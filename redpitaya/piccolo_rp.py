@@ -8,28 +8,284 @@ import os
 import mmap
 import argparse
 import socket
+import asyncio
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party imports, installable via pip:
+import numpy as np
 
 # Red Pitaya API imports
 import sys
 sys.path.append("/opt/redpitaya/lib/python")
-import rp  # Your Red Pitaya API module
+try:
+    import rp  # Your Red Pitaya API module
+except ImportError:
+    rp = None  # Off the device; run with an emulator (see piccolo_emu.py)
+
+# Our code, deployed alongside this script:
+from piccolo_log import BinaryLogWriter
+from piccolo_stream import StreamHub, SLOW_CONSUMER_POLICIES
+from piccolo_telemetry import Telemetry
+from piccolo_hist import DropletHistograms, DEFAULT_HIST_BINS, DEFAULT_HIST_PAIRS
+from piccolo_udp import DatagramSender, MAX_DATAGRAM_PAYLOAD
+
+# ADC frame header: sequence number, acquisition timestamp (s), decimation, samples per channel,
+# sample format (ADC_FORMATS code), trigger source (index into ADC_TRIGGER_SOURCES), trigger level (V),
+# acquisition mode (ADC_MODES code), then for continuous chunks the absolute index of the first
+# sample and the running count of samples lost to ring buffer overruns
+ADC_HEADER = struct.Struct("<QdIIIIfIQQ")
+ADC_FORMATS = {"float": 0, "raw": 1}
+ADC_MODES = {"frames": 0, "continuous": 1}
+ADC_SAMPLE_RATE = 125e6  # samples per second before decimation
+
+# Droplet snippet header: droplet_id, capture timestamp (s), decimation, samples before the
+# detection span, samples in the detection span, samples per channel, sample format (ADC_FORMATS code).
+# The droplet was detected somewhere in [pre, pre + span) of the snippet.
+SNIPPET_HEADER = struct.Struct("<IdIIIII")
+
+# Trigger sources selectable from the host, with the rp constants they map to
+ADC_TRIGGER_SOURCES = {
+    "now":    {"src": "RP_TRIG_SRC_NOW",    "channel": None},
+    "ch1_pe": {"src": "RP_TRIG_SRC_CHA_PE", "channel": "RP_T_CH_1"},
+    "ch1_ne": {"src": "RP_TRIG_SRC_CHA_NE", "channel": "RP_T_CH_1"},
+    "ch2_pe": {"src": "RP_TRIG_SRC_CHB_PE", "channel": "RP_T_CH_2"},
+    "ch2_ne": {"src": "RP_TRIG_SRC_CHB_NE", "channel": "RP_T_CH_2"},
+    "ext_pe": {"src": "RP_TRIG_SRC_EXT_PE", "channel": "RP_T_CH_EXT"},
+    "ext_ne": {"src": "RP_TRIG_SRC_EXT_NE", "channel": "RP_T_CH_EXT"},
+    }
+
+# Control port opcodes
+OP_CONFIGURE_ADC = 1
+OP_CONFIGURE_SNIPPETS = 2
+OP_GET_TELEMETRY = 3
+OP_CONFIGURE_HISTOGRAMS = 4
+OP_CONFIGURE_ADC_UDP = 5
+OP_SHUTDOWN = 99
+
+
+def recv_data(sock, size):
+    """Helper function to receive correct 'size' bytes."""
+    data = bytearray()
+    while len(data) < size:
+        packet = sock.recv(size - len(data))
+        if not packet:
+            return None
+        data += packet
+    return bytes(data)
+
+
+def recv_message(sock):
+    """Receive one length-prefixed message (16-byte header, then payload)."""
+    header = recv_data(sock, 16)
+    if not header:
+        return None
+    msg_len = struct.unpack("I", header[:4])[0]
+    return recv_data(sock, msg_len)
+
+
+def frame_message(msg, count=0):
+    """Prefix a payload with the 16-byte header (length, then the record count of a batch)."""
+    return struct.pack("II", len(msg), count).ljust(16, b'\x00') + msg
+
+
+def send_message(sock, msg, count=0):
+    """Send one length-prefixed message (16-byte header, then payload)."""
+    sock.sendall(frame_message(msg, count))
+
+
+async def recv_message_async(reader):
+    """Receive one length-prefixed message from an asyncio stream (None on EOF)."""
+    try:
+        header = await reader.readexactly(16)
+        msg_len = struct.unpack("I", header[:4])[0]
+        return await reader.readexactly(msg_len)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class RegisterDecoder:
+    """Decode a fixed set of mmap variables from a single gather of their registers."""
+    def __init__(self, var_confs):
+        self.var_confs = list(var_confs)
+        self.names = [var["name"] for var in self.var_confs]
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        offsets = np.array([var["offset"] for var in self.var_confs], dtype=np.int64)
+        bits = np.array([var["bits"] for var in self.var_confs], dtype=np.int64)
+        signed = np.array([var["signed"] for var in self.var_confs], dtype=bool)
+
+        # Precompute the word index, mask and sign tables for every variable
+        self.index = offsets // 4
+        self.mask = (np.int64(1) << bits) - 1
+        self.sign = np.where(signed, np.int64(1) << (bits - 1), 0)
+        self.bool_idx = [i for i, var in enumerate(self.var_confs) if var["bool"]]
+        self.sign_extend = bool(self.sign.any())
+        self.bin_strings = {}  # bool values seen so far, formatted as get_var() does
+
+        # %-template of the JSON object json.dumps(to_dict(vals)) produces, filled straight from the values
+        self.json_template = "{" + ", ".join(
+            f'{json.dumps(var["name"])}: ' + ('"%s"' if var["bool"] else "%d") for var in self.var_confs) + "}"
+
+        # Fixed-width little-endian record layout for the binary stream encoding
+        self.fields = [[var["name"], var["fmt"]] for var in self.var_confs]
+        self.record_struct = struct.Struct("<" + "".join(var["fmt"][1:] for var in self.var_confs))
+
+    def read_words(self, mm):
+        """Copy the raw register words in one gather (no shared file position).
+
+        The word view of the mmap lives only for the gather: a view kept between reads would
+        stop the mmap from ever being closed.
+        """
+        return np.frombuffer(mm, dtype="<u4")[self.index]
+
+    def decode(self, words):
+        """Mask and sign-extend the raw register words into integer values."""
+        vals = np.bitwise_and(words, self.mask, dtype=np.int64)
+        if self.sign_extend:
+            vals ^= self.sign
+            vals -= self.sign
+        return vals
+
+    def read(self, mm):
+        """Snapshot and decode all variables."""
+        return self.decode(self.read_words(mm))
+
+    def _values(self, vals):
+        """Decoded values as a list of Python values, bool variables as get_var()'s binary strings."""
+        vals = vals.tolist()
+        bin_strings = self.bin_strings
+        for i in self.bool_idx:
+            val = vals[i]
+            string = bin_strings.get(val)
+            if string is None:
+                string = bin_strings[val] = bin(val)[2:]
+            vals[i] = string
+        return vals
+
+    def to_dict(self, vals):
+        """Convert decoded values to a {name: value} dict matching get_var()."""
+        return dict(zip(self.names, self._values(vals)))
+
+    def to_json(self, vals):
+        """Encode decoded values as the JSON bytes of to_dict(), without building the dict."""
+        return (self.json_template % tuple(self._values(vals))).encode()
+
+    def pack(self, vals):
+        """Pack decoded values into one fixed-width binary record."""
+        return self.record_struct.pack(*vals.tolist())
+
+    def schema(self):
+        """Describe the binary record layout (NumPy structured dtype fields)."""
+        return {"fields": self.fields, "itemsize": self.record_struct.size}
 
 
 class PiccoloRP:
-    def __init__(self, verbose=False, very_verbose=False):
+    def __init__(self, verbose=False, very_verbose=False, mem_stream_mode="poll",
+                 poll_interval=0.0001, max_read_retries=10, adc_format="float",
+                 slow_consumer_policy="drop_oldest", adc_queue_size=2, mem_queue_size=1024,
+                 adc_continuous_queue_size=64, emulator=None):
         self.verbose = verbose
         self.very_verbose = very_verbose
         self.stop_event = False
         self.csv_flag = True
 
+        # Memory stream behaviour: "poll" sends on a fixed period, "event" once per droplet
+        if mem_stream_mode not in ("poll", "event"):
+            raise ValueError(f"Unsupported memory stream mode: {mem_stream_mode}")
+        self.mem_stream_mode = mem_stream_mode
+        self.poll_interval = poll_interval
+        self.max_read_retries = max_read_retries
+        self.torn_reads = 0
+
         self.fpga_inputs = {}
         self.pending_inputs = {}
         self.client_socket = None
         self.acq_thread_started = False
+        self.acq_lock = threading.Lock()  # hands the ADC hardware from the snippet producer to the acquisition thread
+        self.adc_decimation = None  # decimation last written to the hardware (staged settings may differ)
+
+        # Serializes register writes so batches are applied in one uninterrupted pass
+        self.mmap_lock = threading.Lock()
+
+        # One producer per stream fans out to bounded per-subscriber queues
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unsupported slow consumer policy: {slow_consumer_policy}")
+        self.slow_consumer_policy = slow_consumer_policy
+        self.adc_queue_size = adc_queue_size
+        self.adc_continuous_queue_size = adc_continuous_queue_size  # gap-free chunks need headroom
+        self.mem_queue_size = mem_queue_size
+        self.adc_hub = StreamHub("adc")  # fed by the acquisition thread
+        self.mem_hub = StreamHub("mem", producer=self._mem_producer)
+        self.mem_read_decoder = None  # union of the subscribed variables, set once mapped
+        self.mem_every_droplet = False  # a subscriber (the histograms) needs every droplet, even in poll mode
+        self.mem_decoder_lock = threading.Lock()
+
+        # ADC acquisition settings, staged by the host and applied between frames
+        if adc_format not in ADC_FORMATS:
+            raise ValueError(f"Unsupported ADC format: {adc_format}")
+        self.adc_settings = {
+            "decimation": 128,
+            "n_samples": 4096, # 16384
+            "trigger_source": "now",
+            "trigger_level": 0.0,
+            "format": adc_format,  # "float" volts or "raw" 14-bit counts as int16
+            "mode": "frames",  # independent frames, or gap-free "continuous" chunks
+            }
+        self.adc_config_changed = threading.Event()
+        self.adc_lock = threading.Lock()
+        self.adc_seq = 0
+        self.adc_frame = None
+
+        # Optional UDP copy of the ADC stream (unicast or multicast), for viewers that prefer a lost
+        # frame to a late one; port 5001 as on TCP unless configured otherwise
+        self.adc_udp_settings = {
+            "enabled": False,
+            "address": None,
+            "port": 5001,
+            "payload_size": 1400,
+            "ttl": 1,
+            "interface": None,
+            }
+        self.adc_udp_lock = threading.Lock()
+        self.adc_udp_subscriber = None
+        self.adc_udp_thread = None
+
+        # Droplet snippets: a short window of both channels around each (Nth) droplet
+        self.snippet_settings = {
+            "pre_samples": 256,
+            "post_samples": 256,
+            "every_nth": 1,
+            "format": "raw",
+            }
+        self.snippet_queue_size = 256
+        self.snippet_hub = StreamHub("snippet", producer=self._snippet_producer)
+
+        # Running droplet histograms, streamed as deltas at a fixed rate whatever the droplet rate
+        self.hist_settings = {
+            "bins": DEFAULT_HIST_BINS,
+            "pairs": DEFAULT_HIST_PAIRS,
+            "rate_hz": 2.0,
+            }
+        self.hist_hub = StreamHub("hist", producer=self._hist_producer)
+
+        # Loop counters, latency histograms and per-client backlog, served on the control port
+        self.telemetry = Telemetry()
+        self.telemetry.gauge("torn_reads", lambda: self.torn_reads)
+        self.telemetry.gauge("clients", self._client_backlog)
+
+        # An emulator (piccolo_emu.PiccoloEmulator) replaces /dev/mem and the rp module
+        self.emulator = emulator
+        if emulator is not None:
+            global rp
+            rp = emulator.rp
+        elif rp is None:
+            raise ImportError("Red Pitaya rp module not found; pass an emulator to run off the device")
         
         self._map_memory()
         self._get_mmap_info()
         self._set_defaults()
+        if emulator is not None:
+            emulator.start()
         
         
     ################ Memory mapping methods ################
@@ -44,6 +300,11 @@ class PiccoloRP:
         if self.very_verbose:
             print(f"Memory mapping at address {hex(base_addr)} with size {map_size} bytes...")
 
+        # The emulator provides its own register window with the same layout
+        if self.emulator is not None:
+            self.mmap = self.emulator.mmap
+            return None
+
         # Create a memory mapping of the FADS memory region
         mem_fd = open("/dev/mem", "r+b")
         self.mmap = mmap.mmap(mem_fd.fileno(), map_size, mmap.MAP_SHARED,
@@ -76,17 +337,25 @@ class PiccoloRP:
             fpga_outputs
             + fpga_inputs
         )
-
-        # Store a list of variable names for FADS, droplet, and sort gates
-        self.fpga_input_names = [v["name"] for v in fpga_inputs]
-        self.fpga_ouput_names = [v["name"] for v in fpga_outputs]
+        n_outputs = sum(len(v["addr"]) if isinstance(v["addr"], list) else 1
+                        for v in fpga_outputs)
 
         # Transform the mmap_info to go from human-readable to python-interperable 
         self._expand_mmap_info()
         self._interpret_mmap_dtypes()
+
+        # Store a list of (expanded) variable names for FADS, droplet, and sort gates
+        self.fpga_ouput_names = [v["name"] for v in self.mmap_info[:n_outputs]]
+        self.fpga_input_names = [v["name"] for v in self.mmap_info[n_outputs:]]
         
         # Create an mmap dictionary for easy lookup by variable name
         self.mmap_lookup = {var["name"]: var for var in self.mmap_info}
+
+        # Compile snapshot decoders for all variables, the outputs and the inputs
+        self.decoder = RegisterDecoder(self.mmap_info)
+        self.mem_read_decoder = self.decoder
+        self.output_decoder = self.compile_decoder(self.fpga_ouput_names)
+        self.input_decoder = self.compile_decoder(self.fpga_input_names)
         
         # Debugging
         if self.verbose:
@@ -155,6 +424,7 @@ class PiccoloRP:
                 var.update(dtype_intepretter[dtype])
             else:
                 raise ValueError(f"Unsupported data type: {dtype}")
+            var["offset"] = int(var["addr"], 16)
             
         # Debug
         if self.verbose:
@@ -168,6 +438,17 @@ class PiccoloRP:
     
 
     ################ Memory get and set methods ################
+    def compile_decoder(self, var_names):
+        """Compile a snapshot decoder for a list of variable names."""
+        var_confs = []
+        for var_name in var_names:
+            var_conf = self.mmap_lookup.get(var_name)
+            if var_conf is None:
+                raise ValueError(f"Variable {var_name} not found in list from piccolo_mmap.json")
+            var_confs.append(var_conf)
+
+        return RegisterDecoder(var_confs)
+
     def get_var(self, var_name):
         """Get a memory value from the specified address."""
         var_conf = self.mmap_lookup.get(var_name)
@@ -175,15 +456,15 @@ class PiccoloRP:
         if var_conf is None:
             raise ValueError(f"Variable {var_name} not found in list from piccolo_mmap.json")
 
-        offset = int(var_conf["addr"], 16)
+        offset = var_conf["offset"]
         fmt = var_conf["fmt"]
         bits = var_conf["bits"]
         is_signed = var_conf["signed"]
         is_bool = var_conf["bool"]
         
-        # Get the address and offset
-        self.mmap.seek(offset)
-        data = self.mmap.read(4) # Read block is always 4 bytes on RP
+        # Slice the 4-byte block (read block is always 4 bytes on RP) without
+        # touching the shared mmap file position
+        data = self.mmap[offset:offset + 4]
         
         # Determine the minimal size required for this format
         var_size = struct.calcsize(fmt)
@@ -216,10 +497,8 @@ class PiccoloRP:
         if self.verbose:
             print("\n--------Getting FPGA outputs from memory--------")
         
-        fpga_outputs = {}
-        for var in self.fpga_ouput_names:
-            val = self.get_var(var)
-            fpga_outputs[var] = val
+        vals = self.output_decoder.read(self.mmap)
+        fpga_outputs = self.output_decoder.to_dict(vals)
 
         # Debug
         if self.verbose:
@@ -238,10 +517,8 @@ class PiccoloRP:
         if self.verbose:
             print("\n--------Getting FPGA inputs from memory--------")
 
-        fpga_inputs = {}
-        for var in self.fpga_input_names:
-            val = self.get_var(var)
-            fpga_inputs[var] = val
+        vals = self.input_decoder.read(self.mmap)
+        fpga_inputs = self.input_decoder.to_dict(vals)
 
         # Debug
         if self.verbose:
@@ -256,14 +533,11 @@ class PiccoloRP:
         return None
     
     def get_all(self):
-        """Get all FPGA variables from mmap_info."""
+        """Get all FPGA variables from mmap_info in a single decoded snapshot."""
         if self.verbose:
             print("\n--------Getting all FPGA variables from memory map--------")
         
-        fpga_vars = {}
-        for var in self.mmap_lookup:
-            val = self.get_var(var)
-            fpga_vars[var] = val            
+        fpga_vars = self.decoder.to_dict(self.decoder.read(self.mmap))
         
         # Debug
         if self.verbose:
@@ -277,14 +551,14 @@ class PiccoloRP:
         
         return fpga_vars
     
-    def set_var(self, var_name, value):
-        """Set a memory value to the specified address."""
+    def _pack_var(self, var_name, value):
+        """Offset and 4-byte memory block holding value for a variable; raises ValueError if it doesn't fit."""
         var_conf = self.mmap_lookup.get(var_name)
 
         if var_conf is None:
             raise ValueError(f"Variable {var_name} not found in list from piccolo_mmap.json")
 
-        offset = int(var_conf["addr"], 16) 
+        offset = var_conf["offset"]
         fmt = var_conf["fmt"]
         bits = var_conf["bits"]
         is_bool = var_conf["bool"]
@@ -302,22 +576,46 @@ class PiccoloRP:
             val &= mask
 
         # Pack the value into the minimal number of bytes.
-        packed_val = struct.pack(fmt, val)
+        try:
+            packed_val = struct.pack(fmt, val)
+        except struct.error as e:
+            raise ValueError(f"Invalid value for {var_name}: {value!r} ({e})")
         # Create a full 4-byte block (all zeros)
         block = bytearray(4)
         # Insert the packed value into the beginning of the block.
         block[:len(packed_val)] = packed_val
 
+        return offset, block
+
+    def set_var(self, var_name, value):
+        """Set a memory value to the specified address."""
+        offset, block = self._pack_var(var_name, value)
+
         # Write the 4-byte block to memory.
-        self.mmap.seek(offset)
-        self.mmap.write(block)
+        self.mmap[offset:offset + 4] = block
 
         # Debug
         if self.verbose:
-            print(f"Set {var_name} in memory: {val}")
+            print(f"Set {var_name} in memory: {value}")
 
         return None
     
+    def set_vars(self, values):
+        """Set several variables in one pass and return their read-back values."""
+        # Pack every value before touching memory so a bad batch (name or value) writes nothing
+        blocks = [self._pack_var(var_name, value) for var_name, value in values.items()]
+
+        with self.mmap_lock:
+            for offset, block in blocks:
+                self.mmap[offset:offset + 4] = block
+            readback = {var_name: self.get_var(var_name) for var_name in values}
+
+        # Debug
+        if self.verbose:
+            print(f"Set {values} in memory")
+
+        return readback
+
     def _set_defaults(self):
         """Set the default values to the memory."""
         # TODO: could imagine this being removed from RP-local in the future when the server/client handling is more robust.
@@ -340,6 +638,50 @@ class PiccoloRP:
         return None
 
     
+    ################ Droplet event methods ################
+
+    def _read_droplet_id(self):
+        """Read just the droplet_id register."""
+        return struct.unpack_from("<I", self.mmap, self.mmap_lookup["droplet_id"]["offset"])[0]
+
+    def _read_droplet_snapshot(self, decoder=None):
+        """Read a snapshot that is not torn across a droplet_id change (seqlock style)."""
+        decoder = decoder or self.decoder
+
+        # Retry while the FPGA publishes a new droplet during the read
+        for _ in range(self.max_read_retries):
+            t0 = time.perf_counter()
+            drop_id_preread = self._read_droplet_id()
+            vals = decoder.read(self.mmap)
+            drop_id_postread = self._read_droplet_id()
+            self.telemetry.observe("snapshot_read", time.perf_counter() - t0)
+            if drop_id_preread == drop_id_postread:
+                return drop_id_postread, vals
+            self.torn_reads += 1
+            if self.very_verbose:
+                print("Retrying snapshot due to droplet ID change.")
+
+        return None
+
+    def _wait_for_droplet(self, last_id, timeout=None):
+        """Poll droplet_id until it differs from last_id and return the new ID (None on timeout)."""
+        deadline = None if timeout is None else time.time() + timeout
+        droplet_id = self._read_droplet_id()
+        while droplet_id == last_id:
+            if deadline is not None and time.time() > deadline:
+                return None
+            time.sleep(self.poll_interval)
+            droplet_id = self._read_droplet_id()
+
+        return droplet_id
+
+    def _next_droplet_snapshot(self, last_id, timeout=None, decoder=None):
+        """Wait for a droplet newer than last_id and return its (droplet_id, vals) snapshot."""
+        if self._wait_for_droplet(last_id, timeout) is None:
+            return None
+        return self._read_droplet_snapshot(decoder)
+
+
     ################ Logging methods ################
 
     def _initialize_csv(self):
@@ -352,6 +694,7 @@ class PiccoloRP:
         self.csv_filename = os.path.join(os.getcwd(), csv_filename)
 
         # Initialize the CSV file
+        self.csv_flag = True
         self.csv_file = open(self.csv_filename, "w", newline="")
         self.csv_writer = csv.writer(self.csv_file)
         header = ["timestamp_ms"]
@@ -362,57 +705,82 @@ class PiccoloRP:
         self.csv_file.flush()
         print(f"Log file {self.csv_filename} initialized.")
 
-    def _update_logging(self):
-        timestamp_ms = time.time() * 1e3  # Convert to microseconds.
-
+    def _initialize_binary_log(self, log_dir=None, **writer_kwargs):
+        """Open a preallocated, memory-mapped, size-rotated binary log of register records."""
         if self.verbose:
-            print("\n--------Updating log values--------")
+            print("\n--------Initializing binary logging--------")
 
-        # Read droplet ID from memory.
-        drop_id_preread = self.get_var("droplet_id")
-        self.get_all()
+        # Records hold the timestamp followed by every register in the stream schema
+        fields = [["timestamp_ms", "<d"]] + self.decoder.fields
+        self.log_writer = BinaryLogWriter(log_dir or os.getcwd(), fields,
+                                          verbose=self.verbose, **writer_kwargs)
+        self.csv_flag = False
+        print(f"Log file {self.log_writer.filename} initialized.")
 
-        drop_id_postread = self.get_var("droplet_id")
+    def _update_logging(self, last_id=None):
+        """Log the next droplet newer than last_id and return its droplet ID."""
+        if self.very_verbose:
+            print("\n--------Updating log values--------")
 
-        if drop_id_preread != drop_id_postread:
-            if self.very_verbose:
-                print("Dropping log values due to droplet ID change.")
-            return  # Skip logging if droplet ID changed.
+        # Wait for a new droplet and read all variables, retrying if the droplet ID changes mid-read.
+        snapshot = self._next_droplet_snapshot(last_id, timeout=0.1)
+        if snapshot is None:
+            return last_id  # No new droplet (or the snapshot never settled).
+        droplet_id, vals = snapshot
+        timestamp_ms = time.time() * 1e3  # Convert to milliseconds.
+
+        # --- Binary Logging: pack the record straight into the mapped file ---
+        if not self.csv_flag:
+            with self.telemetry.timed("log_append"):
+                self.log_writer.append(timestamp_ms, *vals.tolist())
+            self.telemetry.count("log_records")
+            return droplet_id
 
         # --- CSV Logging: Write the timestamp and values to the CSV file ---
-        if self.csv_flag:
-            # Build the CSV row using the (converted or raw) values.
-            if self.verbose:
-                print("Writing droplet parameters to CSV file...")
-            row = [timestamp_ms]
+        self.fpga_vars = self.decoder.to_dict(vals)
+        if self.verbose:
+            print("Writing droplet parameters to CSV file...")
+        row = [timestamp_ms]
+        
+        for var_name, val in self.fpga_vars.items():
+            row.append(val)
             
-            for var_name, val in self.fpga_vars.items():
-                row.append(val)
-                
-                if self.very_verbose:
-                    print(f"Logging {var_name}: {val}")
+            if self.very_verbose:
+                print(f"Logging {var_name}: {val}")
 
-            self.csv_writer.writerow(row)
-            self.csv_file.flush()
-        
+        self.csv_writer.writerow(row)
+        self.csv_file.flush()
+
+        return droplet_id
 
-    def start_logging(self):
+    def start_logging(self, duration=None):
+        """Log one record per droplet until stop_logging() is called or duration (s) elapses."""
         if self.verbose:
             print("\n--------Starting logging--------")
-        duration = 3  # seconds
+        self.stop_event = False
         start_time = time.time()
+        last_id = None
         try:
-            while time.time() - start_time < duration:
-                self._update_logging()
-                time.sleep(0.00011)
+            while not self.stop_event:
+                if duration is not None and time.time() - start_time >= duration:
+                    break
+                last_id = self._update_logging(last_id)
         except KeyboardInterrupt:
             print("Logging interrupted by user.")
         finally:
-            self.stop_logging()
+            self._close_log()
 
     def stop_logging(self):
+        """Ask a running start_logging() loop to finish and close its file."""
         self.stop_event = True
-        self.csv_file.close()
+
+    def _close_log(self):
+        """Close the CSV file or finish the binary log."""
+        if self.csv_flag:
+            self.csv_file.close()
+        else:
+            self.log_writer.close()
+            print(f"Logged {self.log_writer.total_records} records to {self.log_writer.files}")
         
         if self.verbose:
             print("Logging stopped.")
@@ -420,43 +788,141 @@ class PiccoloRP:
 
     ################ Oscilliscope methods ################
 
+    def configure_adc(self, **settings):
+        """Validate and stage new acquisition settings; the acquisition loop applies them."""
+        unknown = set(settings) - set(self.adc_settings)
+        if unknown:
+            raise ValueError(f"Unknown ADC settings: {sorted(unknown)}")
+
+        new_settings = dict(self.adc_settings, **settings)
+        decimation = int(new_settings["decimation"])
+        n_samples = int(new_settings["n_samples"])
+        if not hasattr(rp, f"RP_DEC_{decimation}"):
+            raise ValueError(f"Unsupported decimation: {decimation}")
+        if not 0 < n_samples <= rp.ADC_BUFFER_SIZE:
+            raise ValueError(f"n_samples must be in 1..{rp.ADC_BUFFER_SIZE}, got {n_samples}")
+        if new_settings["trigger_source"] not in ADC_TRIGGER_SOURCES:
+            raise ValueError(f"Unsupported trigger source: {new_settings['trigger_source']}")
+        if new_settings["format"] not in ADC_FORMATS:
+            raise ValueError(f"Unsupported ADC format: {new_settings['format']}")
+        if new_settings["mode"] not in ADC_MODES:
+            raise ValueError(f"Unsupported ADC mode: {new_settings['mode']}")
+        if new_settings["mode"] == "continuous" and n_samples > rp.ADC_BUFFER_SIZE // 2:
+            raise ValueError(f"Continuous chunks must be at most {rp.ADC_BUFFER_SIZE // 2} samples, got {n_samples}")
+        new_settings["decimation"] = decimation
+        new_settings["n_samples"] = n_samples
+        new_settings["trigger_level"] = float(new_settings["trigger_level"])
+
+        with self.adc_lock:
+            self.adc_settings = new_settings
+            self.adc_config_changed.set()
+
+        # Debug
+        if self.verbose:
+            print(f"ADC settings staged: {new_settings}")
+
+        return new_settings
+
+    def _apply_adc_settings(self):
+        """Apply the staged acquisition settings to the Red Pitaya and return them."""
+        with self.adc_lock:
+            settings = dict(self.adc_settings)
+            self.adc_config_changed.clear()
+        self.adc_hub.set_maxlen(self._adc_queue_size(settings))
+
+        rp.rp_AcqSetDecimation(getattr(rp, f"RP_DEC_{settings['decimation']}"))
+        self.adc_decimation = settings["decimation"]
+        trigger_source = ADC_TRIGGER_SOURCES[settings["trigger_source"]]
+        if trigger_source["channel"] is not None:
+            rp.rp_AcqSetTriggerLevel(getattr(rp, trigger_source["channel"]), settings["trigger_level"])
+
+        # Debug
+        if self.verbose:
+            print(f"ADC settings applied: {settings}")
+
+        return settings
+
+    def _adc_queue_size(self, settings=None):
+        """Per-client ADC queue length: a couple of fresh frames, or deep enough for gap-free chunks."""
+        settings = settings or self.adc_settings
+        if settings["mode"] == "continuous":
+            return self.adc_continuous_queue_size
+        return self.adc_queue_size
+
+    def _wait_for_trigger(self, timeout=0.5):
+        """Wait for the armed trigger and a full post-trigger buffer; False on timeout or reconfig."""
+        deadline = time.time() + timeout
+        while time.time() < deadline and not self.adc_config_changed.is_set():
+            if rp.rp_AcqGetTriggerState()[1] == rp.RP_TRIG_STATE_TRIGGERED:
+                while not rp.rp_AcqGetBufferFillState()[1]:
+                    time.sleep(0.0001)
+                return True
+            time.sleep(0.0001)
+
+        return False
+
     def _get_adc_data(self, continuous=False):
         """Read the ADC data from the memory."""    
-        dec = rp.RP_DEC_128
-        acq_trig_sour = rp.RP_TRIG_SRC_NOW
-        N = 4096 # 16384
-
         # Initialize Red Pitaya API
         rp.rp_Init()
         rp.rp_AcqReset()
-        rp.rp_AcqSetDecimation(dec)
+        settings = self._apply_adc_settings()
 
         if self.verbose:
             print("\n--------Acquiring ADC data--------")
-        
-        
-        rp.rp_AcqSetTriggerSrc(acq_trig_sour)
-    
+
+        t_last_read = 0.0  # when the latest free-running frame was read
         try:
             while True:  # Keep acquiring & streaming
+                # Pick up settings changed by the host since the last frame
+                if self.adc_config_changed.is_set():
+                    rp.rp_AcqStop()
+                    settings = self._apply_adc_settings()
+
+                # Continuous mode runs until the host changes the settings
+                if settings["mode"] == "continuous":
+                    self._acquire_continuous(settings)
+                    continue
+
+                N = settings["n_samples"]
+                trigger_source = ADC_TRIGGER_SOURCES[settings["trigger_source"]]
+
+                # Free-running frames take the latest samples, so wait until N new ones have been written
+                # since the previous frame instead of publishing overlapping re-reads
+                if settings["trigger_source"] == "now":
+                    wait = t_last_read + N * settings["decimation"] / ADC_SAMPLE_RATE - time.time()
+                    if wait > 0 and self.adc_config_changed.wait(wait):
+                        continue
+
                 t0 = time.time()
                 rp.rp_AcqStart()
-                # Get new data from ADC
-                ch1_buffer = rp.fBuffer(N)
-                ch2_buffer = rp.fBuffer(N)
-
-                rp.rp_AcqGetLatestDataV(rp.RP_CH_1, N, ch1_buffer)
-                rp.rp_AcqGetLatestDataV(rp.RP_CH_2, N, ch2_buffer)
-
-                # Convert to list for streaming
-                ch1_data = [ch1_buffer[i] for i in range(N)]
-                ch2_data = [ch2_buffer[i] for i in range(N)]
+                rp.rp_AcqSetTriggerSrc(getattr(rp, trigger_source["src"]))
+
+                # Free-running frames take the latest samples; triggered frames are
+                # centred on the trigger position
+                pos = None
+                if settings["trigger_source"] != "now":
+                    if not self._wait_for_trigger():
+                        self.telemetry.count("adc_trigger_timeouts")
+                        continue
+                    _, trig_pos = rp.rp_AcqGetWritePointerAtTrig()
+                    pos = (trig_pos - N // 2) % rp.ADC_BUFFER_SIZE
+
+                # Get new data from ADC straight into a NumPy frame
+                t_last_read = time.time()
+                frame = self._read_adc_frame(N, settings["format"], pos)
+                ch1_data, ch2_data = frame
 
                 # Store the data as attribute to class
                 self.ch1_data = ch1_data
                 self.ch2_data = ch2_data
 
                 t1 = time.time()
+                self.telemetry.observe("adc_acquire", t1 - t0)
+                self.telemetry.count("adc_frames")
+
+                # Publish as a new numbered frame and wake the stream subscribers
+                self._publish_adc_frame(t0, frame, settings)
                     
                 if self.verbose:
                     print("ADC data acquired successfully.")
@@ -481,6 +947,436 @@ class PiccoloRP:
         return None
     
 
+    def _acquire_continuous(self, settings):
+        """Stream gap-free chunks by following the ring buffer write pointer until the settings change."""
+        N = settings["n_samples"]
+        buffer_size = rp.ADC_BUFFER_SIZE
+        samples_per_s = ADC_SAMPLE_RATE / settings["decimation"]
+
+        # With the trigger disabled the acquisition never stops and the ring buffer keeps filling
+        rp.rp_AcqStart()
+        rp.rp_AcqSetTriggerSrc(rp.RP_TRIG_SRC_DISABLED)
+        t_last = time.time()
+        _, start_pos = rp.rp_AcqGetWritePointer()
+        last_pos = start_pos
+
+        # Absolute sample counts since start: written by the FPGA, read by us, lost to overruns
+        written = read = lost = 0
+        while not self.adc_config_changed.is_set():
+            t = time.time()
+            _, pos = rp.rp_AcqGetWritePointer()
+
+            # The pointer only gives the position within the buffer; elapsed time resolves whole wraps
+            delta = (pos - last_pos) % buffer_size
+            wraps = max(round(((t - t_last) * samples_per_s - delta) / buffer_size), 0)
+            written += delta + wraps * buffer_size
+            last_pos, t_last = pos, t
+
+            # Unread samples that are (or may be while we read) overwritten are skipped and reported
+            if written - read > buffer_size - N:
+                skipped = written - read - N
+                read += skipped
+                lost += skipped
+                self.telemetry.count("adc_overrun_samples", skipped)
+                if self.verbose:
+                    print(f"[ADC] Continuous overrun: {skipped} samples lost ({lost} total).")
+
+            if written - read < N:
+                time.sleep(max((N - (written - read)) / samples_per_s, 0.0001))
+                continue
+
+            with self.telemetry.timed("adc_read_chunk"):
+                frame = self._read_adc_frame(N, settings["format"], (start_pos + read) % buffer_size)
+            self.telemetry.count("adc_chunks")
+            timestamp = t - (written - read) / samples_per_s
+            self._publish_adc_frame(timestamp, frame, settings, sample_index=read, lost_samples=lost)
+            read += N
+
+        rp.rp_AcqStop()
+
+        return None
+
+    def _read_adc_frame(self, N, adc_format="float", pos=None):
+        """Read N samples of both channels (the latest N if pos is None) into a new (2, N) NumPy frame."""
+        raw = adc_format == "raw"
+        frame = np.empty((2, N), dtype=np.int16 if raw else np.float32)
+        channels = (rp.RP_CH_1, rp.RP_CH_2)
+
+        if hasattr(rp, "rp_AcqGetDataVNP"):
+            # The NumPy API variants fill the frame rows in place through the buffer protocol
+            if pos is None:
+                _, write_pointer = rp.rp_AcqGetWritePointer()
+                pos = (write_pointer - N) % rp.ADC_BUFFER_SIZE
+            for ch_data, ch in zip(frame, channels):
+                if raw:
+                    rp.rp_AcqGetDataRawNP(ch, pos, ch_data)
+                else:
+                    rp.rp_AcqGetDataVNP(ch, pos, ch_data)
+        else:
+            # Older API builds only offer SWIG arrays, so copy each buffer once
+            for ch_data, ch in zip(frame, channels):
+                buffer = rp.i16Buffer(N) if raw else rp.fBuffer(N)
+                if pos is None and raw:
+                    rp.rp_AcqGetLatestDataRaw(ch, N, buffer)
+                elif pos is None:
+                    rp.rp_AcqGetLatestDataV(ch, N, buffer)
+                elif raw:
+                    rp.rp_AcqGetDataRaw(ch, pos, N, buffer)
+                else:
+                    rp.rp_AcqGetDataV(ch, pos, N, buffer)
+                ch_data[:] = [buffer[i] for i in range(N)]
+
+        return frame
+
+    def _publish_adc_frame(self, timestamp, frame, settings, sample_index=0, lost_samples=0):
+        """Publish an acquisition as the next sequence-numbered frame to every ADC subscriber."""
+        self.adc_seq += 1
+        header = ADC_HEADER.pack(
+            self.adc_seq, timestamp, settings["decimation"], frame.shape[1],
+            ADC_FORMATS[settings["format"]],
+            list(ADC_TRIGGER_SOURCES).index(settings["trigger_source"]),
+            settings["trigger_level"], ADC_MODES[settings["mode"]], sample_index, lost_samples)
+        self.adc_frame = (self.adc_seq, header, frame)
+        self.adc_hub.publish(self.adc_frame)
+
+        return None
+    
+
+    ################ ADC UDP Methods #############
+
+    def configure_adc_udp(self, **settings):
+        """Validate the UDP destination of the ADC frames and start, restart or stop sending to it."""
+        unknown = set(settings) - set(self.adc_udp_settings)
+        if unknown:
+            raise ValueError(f"Unknown ADC UDP settings: {sorted(unknown)}")
+
+        new_settings = dict(self.adc_udp_settings, **settings)
+        new_settings["enabled"] = bool(new_settings["enabled"])
+        new_settings["port"] = int(new_settings["port"])
+        new_settings["payload_size"] = int(new_settings["payload_size"])
+        new_settings["ttl"] = int(new_settings["ttl"])
+        for key in ("address", "interface"):
+            if new_settings[key] is not None:
+                try:
+                    ipaddress.IPv4Address(new_settings[key])
+                except ValueError:
+                    raise ValueError(f"Invalid {key}: {new_settings[key]}")
+        if new_settings["enabled"] and new_settings["address"] is None:
+            raise ValueError("An address (unicast host or multicast group) is needed to send ADC frames over UDP")
+        if not 0 < new_settings["port"] < 65536:
+            raise ValueError(f"port must be in 1..65535, got {new_settings['port']}")
+        if not 64 <= new_settings["payload_size"] <= MAX_DATAGRAM_PAYLOAD:
+            raise ValueError(f"payload_size must be in 64..{MAX_DATAGRAM_PAYLOAD}, got {new_settings['payload_size']}")
+        if not 0 <= new_settings["ttl"] <= 255:
+            raise ValueError(f"ttl must be in 0..255, got {new_settings['ttl']}")
+
+        with self.adc_udp_lock:
+            # Open the new socket first, so a failure leaves the current sender and settings in place
+            sender = None
+            if new_settings["enabled"]:
+                sender = DatagramSender(new_settings["address"], new_settings["port"], new_settings["payload_size"],
+                                        new_settings["ttl"], new_settings["interface"])
+            self._stop_adc_udp()
+            if sender is not None:
+                self._start_adc_udp(sender)
+            self.adc_udp_settings = new_settings
+
+        # Debug
+        if self.verbose:
+            print(f"ADC UDP settings: {new_settings}")
+
+        return new_settings
+
+    def _start_adc_udp(self, sender):
+        """Subscribe a UDP sender to the ADC frames, starting the acquisition if needed."""
+        self._start_acquisition()
+
+        # Datagrams are never retransmitted, so a backlog only delays the display: keep the newest frames
+        self.adc_udp_subscriber = self.adc_hub.subscribe(self._adc_queue_size(), "drop_oldest")
+        self.adc_udp_thread = threading.Thread(
+            target=self._adc_udp_sender, args=(self.adc_udp_subscriber, sender), daemon=True)
+        self.adc_udp_thread.start()
+
+    def _stop_adc_udp(self):
+        """Unsubscribe the UDP sender and wait for it to finish."""
+        if self.adc_udp_subscriber is not None:
+            self.adc_hub.unsubscribe(self.adc_udp_subscriber)
+            self.adc_udp_thread.join()
+            self.adc_udp_subscriber = None
+            self.adc_udp_thread = None
+
+    def _adc_udp_sender(self, subscriber, sender):
+        """Send each ADC frame from the subscriber's queue as fragmented datagrams."""
+        try:
+            while True:
+                item = subscriber.get()
+                if item is None:
+                    break
+                seq, header, frame = item
+                t0 = time.perf_counter()
+                sent, n_datagrams = sender.send_frame(seq, (header, frame))
+                self.telemetry.observe("adc_udp_send", time.perf_counter() - t0)
+                self.telemetry.count("adc_udp_datagrams", sent)
+                if sent < n_datagrams:
+                    self.telemetry.count("adc_udp_failed_frames")
+        except Exception as e:
+            print(f"[ADCUDP] Error: {e}")
+        finally:
+            sender.close()
+            print("ADC UDP sender closed.")
+
+        return None
+
+
+    ################ Droplet Snippet Methods #############
+
+    def configure_snippets(self, **settings):
+        """Validate and set the snippet window, sampling and format; applies from the next droplet."""
+        unknown = set(settings) - set(self.snippet_settings)
+        if unknown:
+            raise ValueError(f"Unknown snippet settings: {sorted(unknown)}")
+
+        new_settings = dict(self.snippet_settings, **settings)
+        for key in ("pre_samples", "post_samples", "every_nth"):
+            new_settings[key] = int(new_settings[key])
+        n_samples = new_settings["pre_samples"] + new_settings["post_samples"]
+        if new_settings["pre_samples"] < 0 or new_settings["post_samples"] < 0 or \
+                not 0 < n_samples <= rp.ADC_BUFFER_SIZE // 2:
+            raise ValueError(f"Snippet window must hold 1..{rp.ADC_BUFFER_SIZE // 2} samples, got {n_samples}")
+        if new_settings["every_nth"] < 1:
+            raise ValueError(f"every_nth must be at least 1, got {new_settings['every_nth']}")
+        if new_settings["format"] not in ADC_FORMATS:
+            raise ValueError(f"Unsupported ADC format: {new_settings['format']}")
+
+        self.snippet_settings = new_settings
+
+        # Debug
+        if self.verbose:
+            print(f"Snippet settings: {new_settings}")
+
+        return new_settings
+
+    def _snippet_producer(self):
+        """Capture a window of both channels around each new droplet (or every Nth) while subscribed.
+
+        droplet_id is only seen to change at the next poll, so the ADC write pointer is read around every
+        poll: the droplet was detected after the pointer read preceding the last poll that still saw the
+        previous ID, and before the one following the poll that saw the new ID. The snippet covers that
+        detection span plus pre_samples before and post_samples after it, whatever the poll latency.
+        """
+        # Share the ADC stream's acquisition, or keep the ring buffer filling without a trigger
+        with self.acq_lock:
+            owns_acquisition = not self.acq_thread_started
+            if owns_acquisition:
+                rp.rp_Init()
+                rp.rp_AcqReset()
+                self._apply_snippet_decimation()
+                rp.rp_AcqStart()
+                rp.rp_AcqSetTriggerSrc(rp.RP_TRIG_SRC_DISABLED)
+
+        n_droplets = 0
+        before = None
+        try:
+            while self.snippet_hub.should_run():
+                if before is None:
+                    _, before = rp.rp_AcqGetWritePointer()
+                    t_before = time.time()
+                    decimation = self.adc_decimation
+                    last_id = self._read_droplet_id()
+                    if decimation is None:  # the acquisition thread has not configured the ADC yet
+                        before = None
+                        time.sleep(0.01)
+                        continue
+
+                # The detection span starts at the latest pointer read made before droplet_id was unchanged
+                deadline = time.time() + 0.5
+                _, pos = rp.rp_AcqGetWritePointer()
+                t_pos = time.time()
+                droplet_id = self._read_droplet_id()
+                while droplet_id == last_id and t_pos < deadline:
+                    before, t_before = pos, t_pos
+                    time.sleep(self.poll_interval)
+                    _, pos = rp.rp_AcqGetWritePointer()
+                    t_pos = time.time()
+                    droplet_id = self._read_droplet_id()
+                if droplet_id == last_id:
+                    continue
+                _, after = rp.rp_AcqGetWritePointer()
+                t_after = time.time()
+                last_id = droplet_id
+                n_droplets += 1
+                self.telemetry.count("snippet_droplets_seen")
+
+                # The next droplet's span starts at the read that preceded seeing this one
+                span_start, t_span_start = before, t_before
+                before, t_before = pos, t_pos
+
+                # A decimation change moves the write pointer, so re-apply it between droplets and skip
+                # the droplet it straddles
+                with self.acq_lock:
+                    if not self.acq_thread_started:
+                        self._apply_snippet_decimation()
+                if self.adc_decimation != decimation:
+                    decimation = self.adc_decimation
+                    before = None
+                    continue
+
+                settings = self.snippet_settings
+                if n_droplets % settings["every_nth"]:
+                    continue
+
+                # Droplets seen too late for the span to fit the snippet limit are counted, not captured
+                pre, post = settings["pre_samples"], settings["post_samples"]
+                span = (after - span_start) % rp.ADC_BUFFER_SIZE
+                n_samples = pre + span + post
+                max_span_s = (rp.ADC_BUFFER_SIZE // 2) * decimation / ADC_SAMPLE_RATE
+                if n_samples > rp.ADC_BUFFER_SIZE // 2 or t_after - t_span_start >= max_span_s:
+                    self.telemetry.count("snippets_late")
+                    continue
+
+                # Wait for the post-detection samples
+                timestamp = time.time()
+                time.sleep(post * decimation / ADC_SAMPLE_RATE)
+                start = (span_start - pre) % rp.ADC_BUFFER_SIZE
+                with self.telemetry.timed("snippet_read"):
+                    snippet = self._read_adc_frame(n_samples, settings["format"], start)
+                self.telemetry.count("snippets")
+                header = SNIPPET_HEADER.pack(droplet_id, timestamp, decimation, pre, span, n_samples,
+                                             ADC_FORMATS[settings["format"]])
+                self.snippet_hub.publish((droplet_id, header, snippet))
+        except Exception as e:
+            print(f"[Snippets] Error capturing snippets: {e}")
+        finally:
+            # An ADC stream started since owns the hardware now, so leave its acquisition running
+            with self.acq_lock:
+                if owns_acquisition and not self.acq_thread_started:
+                    rp.rp_AcqStop()
+                    rp.rp_Release()
+
+        return None
+
+    def _apply_snippet_decimation(self):
+        """Write a staged decimation while the snippet producer owns the ADC (call with acq_lock held)."""
+        decimation = self.adc_settings["decimation"]
+        if decimation != self.adc_decimation:
+            rp.rp_AcqSetDecimation(getattr(rp, f"RP_DEC_{decimation}"))
+            self.adc_decimation = decimation
+
+
+    ################ Droplet Histogram Methods #############
+
+    def configure_histograms(self, **settings):
+        """Validate and set the histogram bins, 2D pairs and delta rate; applies from the next delta."""
+        unknown = set(settings) - set(self.hist_settings)
+        if unknown:
+            raise ValueError(f"Unknown histogram settings: {sorted(unknown)}")
+
+        new_settings = dict(self.hist_settings, **settings)
+        bins = {}
+        for name, (low, high, n_bins) in new_settings["bins"].items():
+            if name not in self.fpga_ouput_names:
+                raise ValueError(f"Variable {name} is not an FPGA output")
+            if not high > low or int(n_bins) < 1:
+                raise ValueError(f"Invalid bins for {name}: {[low, high, n_bins]}")
+            bins[name] = [low, high, int(n_bins)]
+        for pair in new_settings["pairs"]:
+            if len(pair) != 2 or any(name not in bins for name in pair):
+                raise ValueError(f"Histogram pair {pair} must name two binned variables")
+        if not float(new_settings["rate_hz"]) > 0:
+            raise ValueError(f"rate_hz must be positive, got {new_settings['rate_hz']}")
+        new_settings["bins"] = bins
+        new_settings["pairs"] = [list(pair) for pair in new_settings["pairs"]]
+        new_settings["rate_hz"] = float(new_settings["rate_hz"])
+
+        self.hist_settings = new_settings
+
+        # Debug
+        if self.verbose:
+            print(f"Histogram settings: {new_settings}")
+
+        return new_settings
+
+    def _hist_producer(self):
+        """Bin every streamed droplet and publish the histogram deltas at hist_settings["rate_hz"].
+
+        Droplets come from the memory stream producer, which reads each one for this subscriber in
+        poll mode too, so the histograms add no register poll loop of their own.
+        """
+        settings = self.hist_settings
+        histograms = DropletHistograms(settings["bins"], settings["pairs"])
+        subscriber, subscription = self._subscribe_hist_variables(histograms)
+
+        seq = 0
+        total_droplets = 0
+        last_id = None
+        t_last = time.time()
+        next_emit = t_last + 1.0 / settings["rate_hz"]
+        try:
+            while self.hist_hub.should_run():
+                # A memory producer that failed closed its subscribers; subscribing starts a new one
+                if subscriber.closed:
+                    self._unsubscribe_mem(subscriber)
+                    subscriber, subscription = self._subscribe_hist_variables(histograms)
+                records = subscriber.get_batch(65536, 0, timeout=max(next_emit - time.time(), 0))
+
+                # Poll-mode snapshots repeat the droplets read in between; bin each droplet once
+                rows = []
+                for record in records:
+                    droplet_id = record["droplet_id"]
+                    if droplet_id == last_id:
+                        continue
+                    vals = self._subscription_vals(record, subscription)
+                    if vals is None:
+                        continue
+                    if last_id is not None and (droplet_id - last_id) & 0xFFFFFFFF > 1:
+                        self.telemetry.count("hist_droplets_missed", ((droplet_id - last_id) & 0xFFFFFFFF) - 1)
+                    last_id = droplet_id
+                    rows.append(vals)
+                if rows:
+                    with self.telemetry.timed("hist_add"):
+                        histograms.add(dict(zip(subscription["decoder"].names, np.array(rows).T)))
+
+                now = time.time()
+                if now < next_emit:
+                    continue
+
+                seq += 1
+                total_droplets += histograms.n_droplets
+                header = {
+                    "seq": seq,
+                    "timestamp": now,
+                    "interval_s": now - t_last,
+                    "droplets": histograms.n_droplets,
+                    "total_droplets": total_droplets,
+                    "outside": histograms.outside,
+                    "layout": histograms.layout,
+                    }
+                self.hist_hub.publish((json.dumps(header).encode(), histograms.pack()))
+                histograms.reset()
+                t_last = now
+                next_emit = max(next_emit + 1.0 / settings["rate_hz"], now)
+
+                # New settings start a fresh set of histograms (the layout tells clients to reset)
+                if self.hist_settings is not settings:
+                    settings = self.hist_settings
+                    histograms = DropletHistograms(settings["bins"], settings["pairs"])
+                    self._unsubscribe_mem(subscriber)
+                    subscriber, subscription = self._subscribe_hist_variables(histograms)
+        except Exception as e:
+            print(f"[Histograms] Error: {e}")
+        finally:
+            self._unsubscribe_mem(subscriber)
+
+        return None
+
+    def _subscribe_hist_variables(self, histograms):
+        """Subscribe to the shared memory stream producer for every droplet's binned variables."""
+        msg = json.dumps({"variables": histograms.variables, "queue_size": 65536}).encode()
+        subscription = self._parse_mem_subscription(msg)
+        subscription["every_droplet"] = True
+        return self._subscribe_mem(subscription), subscription
+
+
     ################ SiPM Gain Methods #############
 
     def set_sipm_gain(self, gain_id, voltage):
@@ -500,86 +1396,412 @@ class PiccoloRP:
 
     ################ Server methods ################
 
+    def _client_backlog(self):
+        """Queued and dropped items of every connected stream client."""
+        backlog = {}
+        for hub in (self.adc_hub, self.mem_hub, self.snippet_hub, self.hist_hub):
+            with hub.lock:
+                subscribers = list(hub.subscribers)
+            backlog[hub.name] = [{"queued": len(sub.queue), "maxlen": sub.maxlen, "dropped": sub.dropped}
+                                 for sub in subscribers]
+        return backlog
+
+    def _handle_control_command(self, opcode, payload):
+        """Apply one control command and return its JSON reply."""
+        if opcode == OP_CONFIGURE_ADC:
+            try:
+                return {"ok": True, "settings": self.configure_adc(**payload)}
+            except (ValueError, TypeError) as e:
+                return {"ok": False, "error": str(e)}
+        if opcode == OP_GET_TELEMETRY:
+            return {"ok": True, "telemetry": self.telemetry.snapshot()}
+        if opcode == OP_CONFIGURE_SNIPPETS:
+            try:
+                return {"ok": True, "settings": self.configure_snippets(**payload)}
+            except (ValueError, TypeError) as e:
+                return {"ok": False, "error": str(e)}
+        if opcode == OP_CONFIGURE_HISTOGRAMS:
+            try:
+                return {"ok": True, "settings": self.configure_histograms(**payload)}
+            except (ValueError, TypeError) as e:
+                return {"ok": False, "error": str(e)}
+        if opcode == OP_CONFIGURE_ADC_UDP:
+            try:
+                return {"ok": True, "settings": self.configure_adc_udp(**payload)}
+            except (ValueError, TypeError, OSError) as e:
+                return {"ok": False, "error": str(e)}
+
+        print(f"[Control] Unknown opcode: {opcode}")
+        return {"ok": False, "error": f"Unknown opcode: {opcode}"}
+
     def _control_server(self, client):
-        """ TCP server that manages shutdown command from client """
+        """ TCP server that manages shutdown and acquisition commands from client """
         try:
             while True:
-                data = client.recv(16)
+                data = recv_data(client, 16)
                 if not data:
                     break
-                opcode = struct.unpack("I", data[:4])[0]
-                if opcode == 99:
+                opcode, payload_len = struct.unpack("II", data[:8])
+                payload = json.loads(recv_data(client, payload_len).decode()) if payload_len else {}
+                if opcode == OP_SHUTDOWN:
                     print("Shutdown signal received. Exiting.")
                     os._exit(0)
-                else:
-                    print(f"[Control] Unknown opcode: {opcode}")
+                reply = self._handle_control_command(opcode, payload)
+                send_message(client, json.dumps(reply).encode())
         finally:
             client.close()
             print("Control command server closed.")
 
         return None
     
+    def _start_acquisition(self):
+        """Start continuous ADC acquisition if not already started; from then on it owns the ADC hardware."""
+        with self.acq_lock:
+            if not self.acq_thread_started:
+                self.acq_thread_started = True
+                thread = threading.Thread(target=self._get_adc_data, kwargs={"continuous": True}, daemon=True)
+                thread.start()
+
     def _getadc_server(self, client):
         """ TCP server that streams CH1 and CH2 data from ADCs """
         
         # Start continuous ADC acquisition if not already started
-        if not self.acq_thread_started:
-            self.acq_thread_started = True
-            thread = threading.Thread(target=self._get_adc_data, kwargs={"continuous": True}, daemon=True)
-            thread.start()
+        self._start_acquisition()
         
-        # Continuously stream ADC data to the client
+        # Stream each new ADC frame from this client's queue
+        subscriber = self.adc_hub.subscribe(self._adc_queue_size(), self.slow_consumer_policy)
         try:
             while True:
-                # send the latest available data
-                if hasattr(self, 'ch1_data') and hasattr(self, 'ch2_data'):
-                    combined_data = self.ch1_data + self.ch2_data
-                    client.sendall(struct.pack(f'{2*len(self.ch1_data)}f', *combined_data))
+                item = subscriber.get()
+                if item is None:
+                    print("[ADCStream] Slow client disconnected.")
+                    break
+                _, header, frame = item
+                t0 = time.perf_counter()
+                client.sendall(header)
+                client.sendall(memoryview(frame).cast("B"))
+                self.telemetry.observe("adc_send", time.perf_counter() - t0)
         except Exception as e:
             print(f"[ADCStream] Error: {e}")
         finally:
+            self.adc_hub.unsubscribe(subscriber)
             client.close()
             print("ADC stream server closed.")
 
         return None
+
+    def _getsnippet_server(self, client):
+        """ TCP server that streams droplet-tagged waveform snippets """
+        subscriber = self.snippet_hub.subscribe(self.snippet_queue_size, self.slow_consumer_policy)
+        try:
+            while True:
+                item = subscriber.get()
+                if item is None:
+                    print("[SnippetStream] Slow client disconnected.")
+                    break
+                _, header, snippet = item
+                t0 = time.perf_counter()
+                client.sendall(header)
+                client.sendall(memoryview(snippet).cast("B"))
+                self.telemetry.observe("snippet_send", time.perf_counter() - t0)
+        except Exception as e:
+            print(f"[SnippetStream] Error: {e}")
+        finally:
+            self.snippet_hub.unsubscribe(subscriber)
+            client.close()
+            print("Snippet stream server closed.")
+
+        return None
     
+    def _gethist_server(self, client):
+        """ TCP server that streams droplet histogram deltas """
+        subscriber = self.hist_hub.subscribe(self.mem_queue_size, self.slow_consumer_policy)
+        try:
+            while True:
+                item = subscriber.get()
+                if item is None:
+                    print("[HistStream] Slow client disconnected.")
+                    break
+                header, counts = item
+                client.sendall(frame_message(header) + frame_message(counts))
+        except Exception as e:
+            print(f"[HistStream] Error: {e}")
+        finally:
+            self.hist_hub.unsubscribe(subscriber)
+            client.close()
+            print("Histogram stream server closed.")
+
+        return None
+
+    def _recv_mem_subscription(self, client, timeout=1.0):
+        """Receive the optional subscribe message a client sends at connect."""
+        msg = None
+        client.settimeout(timeout)
+        try:
+            msg = recv_message(client)
+        except socket.timeout:
+            pass  # Older clients do not subscribe; keep the JSON defaults
+        finally:
+            client.settimeout(None)
+
+        return self._parse_mem_subscription(msg)
+
+    def _parse_mem_subscription(self, msg):
+        """Merge a (possibly missing) subscribe message with the stream defaults."""
+        subscription = {
+            "encoding": "json",
+            "queue_size": self.mem_queue_size,
+            "slow_consumer": self.slow_consumer_policy,
+            "variables": None,  # all inputs and outputs
+            "max_rate_hz": None,  # one record per poll/droplet
+            "batch": False,  # pack pending records into one message when they pile up
+            "max_batch": 256,
+            "max_latency_ms": 2.0,
+            }
+        if msg:
+            subscription.update(json.loads(msg.decode()))
+
+        if subscription["encoding"] not in ("json", "binary"):
+            raise ValueError(f"Unsupported memory stream encoding: {subscription['encoding']}")
+        if subscription["slow_consumer"] not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unsupported slow consumer policy: {subscription['slow_consumer']}")
+        # Bad sizes would break the shared producer for every client, so they are refused here
+        for key in ("queue_size", "max_batch"):
+            if type(subscription[key]) is not int or subscription[key] < 1:
+                raise ValueError(f"Memory stream {key} must be a positive integer, got {subscription[key]!r}")
+        for key in ("max_latency_ms", "max_rate_hz"):
+            value = subscription[key]
+            if key == "max_rate_hz" and value is None:
+                continue
+            if type(value) not in (int, float) or value < 0:
+                raise ValueError(f"Memory stream {key} must be a non-negative number, got {value!r}")
+
+        # Records always carry droplet_id so clients can order and deduplicate them
+        variables = subscription["variables"] or self.decoder.names
+        if "droplet_id" not in variables:
+            variables = ["droplet_id"] + list(variables)
+        subscription["variables"] = tuple(variables)
+        if subscription["variables"] == tuple(self.decoder.names):
+            subscription["decoder"] = self.decoder
+        else:
+            subscription["decoder"] = self.compile_decoder(variables)
+
+        # Rate-limited clients only want the newest record at each send
+        if subscription["max_rate_hz"]:
+            subscription["queue_size"] = 1
+            subscription["slow_consumer"] = "drop_oldest"
+
+        return subscription
+
+    def _mem_schema_message(self, subscription):
+        """Schema message sent once to binary memory stream clients."""
+        return json.dumps(dict(encoding="binary", **subscription["decoder"].schema())).encode()
+
+    def _subscription_vals(self, record, subscription):
+        """Select a subscription's variables from the producer's (union) read; None if it lacks them."""
+        decoder = subscription["decoder"]
+        if record["decoder"] is decoder:
+            return record["vals"]
+
+        if subscription.get("read_decoder") is not record["decoder"]:
+            positions = record["decoder"].positions
+            if not all(name in positions for name in decoder.names):
+                return None  # read before this subscription was added
+            subscription["read_decoder"] = record["decoder"]
+            subscription["index"] = [positions[name] for name in decoder.names]
+        return record["vals"][subscription["index"]]
+
+    def _encode_record(self, record, subscription):
+        """Encode one published snapshot for a subscription (None if it lacks the subscribed variables)."""
+        key = (subscription["encoding"], subscription["variables"])
+        msg = record["encoded"].get(key)
+        if msg is None:
+            decoder = subscription["decoder"]
+            vals = self._subscription_vals(record, subscription)
+            if vals is None:
+                return None
+
+            if subscription["encoding"] == "binary":
+                msg = decoder.pack(vals)
+            else:
+                msg = decoder.to_json(vals)
+            record["encoded"][key] = msg
+        return msg
+
+    def _encode_batch(self, records, subscription):
+        """Encode records into one batch message: concatenated binary records or a JSON list."""
+        msgs = [msg for msg in (self._encode_record(record, subscription) for record in records)
+                if msg is not None]
+        if subscription["encoding"] == "binary":
+            return b"".join(msgs), len(msgs)
+        return b"[" + b",".join(msgs) + b"]", len(msgs)
+
+    def _mem_producer(self):
+        """Single register poll loop feeding every memory stream subscriber.
+
+        In poll mode every subscriber gets a snapshot each 5 ms. While a subscriber needs every droplet
+        (the histograms), droplets are also read event-style in between and published to those subscribers only.
+        """
+        last_id = None
+        next_poll = 0.0
+        while self.mem_hub.should_run():
+            # Only the registers some subscriber asked for are read
+            decoder = self.mem_read_decoder
+            event = self.mem_stream_mode == "event"
+            if event or self.mem_every_droplet:
+                timeout = 0.5 if event else max(next_poll - time.time(), 0)
+                snapshot = self._next_droplet_snapshot(last_id, timeout=timeout, decoder=decoder)
+                if snapshot is not None:
+                    # Droplets the FPGA published between two of our reads are never streamed
+                    droplet_id, vals = snapshot
+                    if last_id is not None and (droplet_id - last_id) & 0xFFFFFFFF > 1:
+                        self.telemetry.count("mem_droplets_missed", ((droplet_id - last_id) & 0xFFFFFFFF) - 1)
+                    last_id = droplet_id
+                    self.telemetry.count("mem_records")
+                    record = {"droplet_id": last_id, "decoder": decoder, "vals": vals, "encoded": {}}
+                    self.mem_hub.publish(record, only=None if event else self._wants_every_droplet)
+                    if self.verbose and event:
+                        print(f"Cur Droplet ID:{last_id}")
+                if event or time.time() < next_poll:
+                    continue
+            else:
+                time.sleep(max(next_poll - time.time(), 0))
+
+            with self.telemetry.timed("mem_read"):
+                vals = decoder.read(self.mmap)
+            last_id = int(vals[decoder.positions["droplet_id"]])
+            self.telemetry.count("mem_records")
+            self.mem_hub.publish({"droplet_id": last_id, "decoder": decoder, "vals": vals, "encoded": {}})
+            if self.verbose:
+                print(f"Cur Droplet ID:{last_id}")
+            next_poll = time.time() + 0.005  # or trigger-based
+
+    @staticmethod
+    def _wants_every_droplet(subscriber):
+        """Whether a memory stream subscriber takes the droplets read between poll-mode snapshots."""
+        subscription = getattr(subscriber, "subscription", None)
+        return subscription is not None and subscription.get("every_droplet", False)
+
+    def _update_mem_read_decoder(self):
+        """Recompile the producer's decoder for the union of the subscribed variables."""
+        # Gather and assign under one lock, so a concurrent (un)subscribe can't install a stale read set
+        with self.mem_decoder_lock:
+            with self.mem_hub.lock:
+                subscriptions = [sub.subscription for sub in self.mem_hub.subscribers
+                                 if hasattr(sub, "subscription")]
+
+            wanted = set()
+            for subscription in subscriptions:
+                wanted.update(subscription["variables"])
+            names = [name for name in self.decoder.names if name in wanted]
+            if not names or len(names) == len(self.decoder.names):
+                self.mem_read_decoder = self.decoder
+            else:
+                self.mem_read_decoder = self.compile_decoder(names)
+            self.mem_every_droplet = any(subscription.get("every_droplet", False) for subscription in subscriptions)
+
+    def _subscribe_mem(self, subscription, on_put=None):
+        """Subscribe to the shared memory stream producer with the client's queue and variable options."""
+        # Event streams start with the current state, as a dedicated poll loop would
+        subscriber = self.mem_hub.subscribe(subscription["queue_size"], subscription["slow_consumer"],
+                                            on_put=on_put, replay_latest=True)
+        subscriber.subscription = subscription
+        self._update_mem_read_decoder()
+        return subscriber
+
+    def _unsubscribe_mem(self, subscriber):
+        """Remove a memory stream subscriber and shrink the producer's read set."""
+        self.mem_hub.unsubscribe(subscriber)
+        self._update_mem_read_decoder()
+
     def _getmem_server(self, client):
         """ TCP server that streams fpga outputs """
+        subscriber = None
         
         # Continuously stream FPGA outputs to the client
         try:
+            subscription = self._recv_mem_subscription(client)
+
+            # Binary clients get the record schema once, before any records
+            if subscription["encoding"] == "binary":
+                send_message(client, self._mem_schema_message(subscription))
+
+            subscriber = self._subscribe_mem(subscription)
+            max_rate_hz = subscription["max_rate_hz"]
+            max_latency = subscription["max_latency_ms"] / 1000.0
             while True:
-                self.get_all()
-                msg = json.dumps(self.fpga_vars).encode()
-                length = struct.pack("I", len(msg)).ljust(16, b'\x00')
-                client.sendall(length + msg)
-                time.sleep(0.005)  # or trigger-based
-                val = self.fpga_vars['droplet_id']
-                if self.verbose:
-                    print(f"Cur Droplet ID:{val}")
+                if subscription["batch"]:
+                    # One message per burst of records, one record right away when idle
+                    records = subscriber.get_batch(subscription["max_batch"], max_latency)
+                    if not records:
+                        print("[MemStream] Slow client disconnected.")
+                        break
+                    msg, count = self._encode_batch(records, subscription)
+                    if count:
+                        t0 = time.perf_counter()
+                        send_message(client, msg, count)
+                        self.telemetry.observe("mem_send", time.perf_counter() - t0)
+                        self.telemetry.count("mem_records_sent", count)
+                else:
+                    record = subscriber.get()
+                    if record is None:
+                        print("[MemStream] Slow client disconnected.")
+                        break
+                    msg = self._encode_record(record, subscription)
+                    if msg is None:
+                        continue
+                    t0 = time.perf_counter()
+                    send_message(client, msg)
+                    self.telemetry.observe("mem_send", time.perf_counter() - t0)
+                    self.telemetry.count("mem_records_sent")
+
+                # Newer records collapse into the one-slot queue meanwhile
+                if max_rate_hz:
+                    time.sleep(1.0 / max_rate_hz)
         except Exception as e:
             print(f"[MemStream] Error: {e}")
         finally:
+            if subscriber is not None:
+                self._unsubscribe_mem(subscriber)
             client.close()
             print("Memory stream server closed.")
         
         return None
 
+    def _handle_setmem_message(self, data):
+        """Apply one set message; batches return an ack, single writes return None."""
+        # Batches are applied atomically and acknowledged with read-back values
+        if "values" in data:
+            self.telemetry.count("setmem_batches")
+            try:
+                with self.telemetry.timed("setmem_batch"):
+                    return {"id": data.get("id"), "ok": True, "values": self.set_vars(data["values"])}
+            except (ValueError, TypeError, struct.error) as e:
+                self.telemetry.count("setmem_rejected")
+                return {"id": data.get("id"), "ok": False, "error": str(e)}
+
+        # Single writes are not acknowledged, so a bad one is reported here and the connection kept
+        self.telemetry.count("setmem_writes")
+        try:
+            with self.mmap_lock:
+                self.set_var(var_name=data["name"], value=data["value"])
+        except (ValueError, TypeError, struct.error) as e:
+            self.telemetry.count("setmem_rejected")
+            print(f"[MemSet] Rejected write {data}: {e}")
+
+        return None
+
     def _setmem_server(self, client):
         """ TCP server that gets/sets fpga inputs """
         try:
             while True:
-                header = client.recv(16)
-                if not header:
+                msg = recv_message(client)
+                if not msg:
                     break
 
-                msg_len = struct.unpack("I", header[:4])[0]
-                msg = client.recv(msg_len)
-                data = json.loads(msg.decode())
-                var_name = data["name"]
-                value = data["value"]
-                
-                self.set_var(var_name=var_name, value=value)  
+                reply = self._handle_setmem_message(json.loads(msg.decode()))
+                if reply is not None:
+                    send_message(client, json.dumps(reply).encode())
         except Exception as e:
             print(f"[MemSet] Error: {e}")
         finally:
@@ -592,7 +1814,7 @@ class PiccoloRP:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.bind(('', port))
-        sock.listen(1)
+        sock.listen(8)
 
         while True:
             client, addr = sock.accept()
@@ -606,6 +1828,8 @@ class PiccoloRP:
             5001: self._getadc_server,
             5002: self._getmem_server,
             5003: self._setmem_server,
+            5004: self._getsnippet_server,
+            5005: self._gethist_server,
         }
 
         for port, handler in servers.items():
@@ -617,13 +1841,223 @@ class PiccoloRP:
         while True:
             time.sleep(0.001)  # keep main thread alive
 
+    ################ Asyncio server methods ################
+
+    async def _async_control_server(self, reader, writer):
+        """ Asyncio server that manages shutdown and acquisition commands from client """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                data = await reader.readexactly(16)
+                opcode, payload_len = struct.unpack("II", data[:8])
+                payload = json.loads((await reader.readexactly(payload_len)).decode()) if payload_len else {}
+                if opcode == OP_SHUTDOWN:
+                    print("Shutdown signal received. Stopping servers.")
+                    self.shutdown_event.set()
+                    break
+                # Commands may wait on other threads (e.g. the UDP sender stopping), so they run off the loop
+                reply = await loop.run_in_executor(self.executor, self._handle_control_command, opcode, payload)
+                writer.write(frame_message(json.dumps(reply).encode()))
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass  # Client disconnected
+        finally:
+            writer.close()
+            print("Control command server closed.")
+
+    async def _async_stream(self, writer, subscriber, encode, max_rate_hz=None, max_batch=None, name="stream",
+                            counted=False):
+        """Drain a hub subscriber to an asyncio stream, woken through the event loop.
+
+        With max_batch, encode receives lists of up to max_batch queued items instead of single items.
+        With counted, encode returns (chunks, records) and the records sent are counted as {name}_records_sent.
+        """
+        loop = asyncio.get_running_loop()
+        new_item = asyncio.Event()
+        subscriber.on_put = lambda: loop.call_soon_threadsafe(new_item.set)
+        new_item.set()  # items may have been queued before the hook was installed
+        if max_batch:
+            get = lambda: subscriber.get_batch(max_batch, 0, timeout=0)
+        else:
+            get = lambda: subscriber.get(timeout=0)
+
+        while True:
+            await new_item.wait()
+            new_item.clear()
+            item = get()
+            while item:
+                t0 = time.perf_counter()
+                chunks, n_records = encode(item) if counted else (encode(item), None)
+                for chunk in chunks:
+                    writer.write(chunk)
+                await writer.drain()
+                if n_records != 0:  # nothing was sent for records the subscription lacks
+                    self.telemetry.observe(f"{name}_send", time.perf_counter() - t0)
+                if n_records:
+                    self.telemetry.count(f"{name}_records_sent", n_records)
+                if max_rate_hz:
+                    await asyncio.sleep(1.0 / max_rate_hz)
+                item = get()
+            if subscriber.closed:
+                print("Slow client disconnected.")
+                break
+
+    async def _async_getadc_server(self, reader, writer):
+        """ Asyncio server that streams CH1 and CH2 data from ADCs """
+        self._start_acquisition()
+
+        subscriber = self.adc_hub.subscribe(self._adc_queue_size(), self.slow_consumer_policy)
+        try:
+            await self._async_stream(
+                writer, subscriber, lambda item: (item[1], memoryview(item[2]).cast("B")), name="adc")
+        except Exception as e:
+            print(f"[ADCStream] Error: {e}")
+        finally:
+            self.adc_hub.unsubscribe(subscriber)
+            writer.close()
+            print("ADC stream server closed.")
+
+    async def _async_getsnippet_server(self, reader, writer):
+        """ Asyncio server that streams droplet-tagged waveform snippets """
+        subscriber = self.snippet_hub.subscribe(self.snippet_queue_size, self.slow_consumer_policy)
+        try:
+            await self._async_stream(
+                writer, subscriber, lambda item: (item[1], memoryview(item[2]).cast("B")), name="snippet")
+        except Exception as e:
+            print(f"[SnippetStream] Error: {e}")
+        finally:
+            self.snippet_hub.unsubscribe(subscriber)
+            writer.close()
+            print("Snippet stream server closed.")
+
+    async def _async_gethist_server(self, reader, writer):
+        """ Asyncio server that streams droplet histogram deltas """
+        subscriber = self.hist_hub.subscribe(self.mem_queue_size, self.slow_consumer_policy)
+        try:
+            await self._async_stream(
+                writer, subscriber, lambda item: (frame_message(item[0]), frame_message(item[1])), name="hist")
+        except Exception as e:
+            print(f"[HistStream] Error: {e}")
+        finally:
+            self.hist_hub.unsubscribe(subscriber)
+            writer.close()
+            print("Histogram stream server closed.")
+
+    async def _async_getmem_server(self, reader, writer):
+        """ Asyncio server that streams fpga outputs """
+        subscriber = None
+        try:
+            try:
+                msg = await asyncio.wait_for(recv_message_async(reader), timeout=1.0)
+            except asyncio.TimeoutError:
+                msg = None  # Older clients do not subscribe; keep the JSON defaults
+            subscription = self._parse_mem_subscription(msg)
+
+            # Binary clients get the record schema once, before any records
+            if subscription["encoding"] == "binary":
+                writer.write(frame_message(self._mem_schema_message(subscription)))
+
+            def encode(record):
+                msg = self._encode_record(record, subscription)
+                return ((), 0) if msg is None else ((frame_message(msg),), 1)
+
+            def encode_batch(records):
+                msg, count = self._encode_batch(records, subscription)
+                return ((frame_message(msg, count),), count) if count else ((), 0)
+
+            # The shared producer thread does the register reads; batches are whatever
+            # piled up while the previous send drained
+            subscriber = self._subscribe_mem(subscription)
+            if subscription["batch"]:
+                await self._async_stream(writer, subscriber, encode_batch, subscription["max_rate_hz"],
+                                         subscription["max_batch"], name="mem", counted=True)
+            else:
+                await self._async_stream(writer, subscriber, encode, subscription["max_rate_hz"], name="mem",
+                                         counted=True)
+        except Exception as e:
+            print(f"[MemStream] Error: {e}")
+        finally:
+            if subscriber is not None:
+                self._unsubscribe_mem(subscriber)
+            writer.close()
+            print("Memory stream server closed.")
+
+    async def _async_setmem_server(self, reader, writer):
+        """ Asyncio server that gets/sets fpga inputs """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                msg = await recv_message_async(reader)
+                if not msg:
+                    break
+                data = json.loads(msg.decode())
+                reply = await loop.run_in_executor(self.executor, self._handle_setmem_message, data)
+                if reply is not None:
+                    writer.write(frame_message(json.dumps(reply).encode()))
+                    await writer.drain()
+        except Exception as e:
+            print(f"[MemSet] Error: {e}")
+        finally:
+            writer.close()
+            print("Memory set server closed.")
+
+    def _async_connection(self, handler):
+        """Wrap a connection handler so shutdown can cancel it cleanly."""
+        async def run(reader, writer):
+            task = asyncio.current_task()
+            self.connection_tasks.add(task)
+            try:
+                await handler(reader, writer)
+            except asyncio.CancelledError:
+                pass  # Server shutting down; the handler already closed its writer
+            finally:
+                self.connection_tasks.discard(task)
+
+        return run
+
+    async def _serve_async(self, ports=None):
+        """Run all servers on one event loop until a shutdown command arrives."""
+        self.shutdown_event = asyncio.Event()
+        self.connection_tasks = set()
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="piccolo_io")
+        handlers = {
+            5000: self._async_control_server,
+            5001: self._async_getadc_server,
+            5002: self._async_getmem_server,
+            5003: self._async_setmem_server,
+            5004: self._async_getsnippet_server,
+            5005: self._async_gethist_server,
+        }
+
+        servers = []
+        for default_port, handler in handlers.items():
+            port = (ports or {}).get(default_port, default_port)
+            servers.append(await asyncio.start_server(
+                self._async_connection(handler), host='', port=port, reuse_address=True))
+            print(f"[Port {port}] Server started.")
+
+        print("All servers running.")
+        await self.shutdown_event.wait()
+
+        for server in servers:
+            server.close()
+        for task in list(self.connection_tasks):
+            task.cancel()
+        await asyncio.gather(*self.connection_tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+        print("All servers stopped.")
+
+    def start_servers_async(self, ports=None):
+        """Serve ports 5000-5005 from a single asyncio event loop."""
+        asyncio.run(self._serve_async(ports))
+
     def test(self):
         print("\n////////// Starting Red Pitaya Piccolo Testing ///////////")
         
         # Test the logging
         print("--------Testing logging--------")
-        self._initialize_csv()
-        self.start_logging()
+        self._initialize_binary_log()
+        self.start_logging(duration=3)
         print("Logging test completed.")
         
         # Test the memory mapping and reading/writing
@@ -665,10 +2099,41 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--verbose", action="store_true", help="Enable verbose mode")
     parser.add_argument("--very_verbose", action="store_true", help="Enable very verbose mode")
+    parser.add_argument("--mem_stream_mode", choices=["poll", "event"], default="poll",
+                        help="Stream memory on a fixed period (poll) or once per new droplet (event)")
+    parser.add_argument("--adc_format", choices=["float", "raw"], default="float",
+                        help="Stream ADC frames as float32 volts or raw 14-bit int16 counts")
+    parser.add_argument("--slow_consumer", choices=list(SLOW_CONSUMER_POLICIES), default="drop_oldest",
+                        help="What to do when a stream client's queue is full")
+    parser.add_argument("--log_dir", default=None,
+                        help="Log one binary record per droplet to rotating files in this directory")
+    parser.add_argument("--emulate", action="store_true",
+                        help="Run against the register/ADC emulator instead of the FPGA")
+    parser.add_argument("--emu_droplet_rate", type=float, default=1000.0,
+                        help="Emulated droplets per second")
+    parser.add_argument("--emu_mmap_file", default=None,
+                        help="Back the emulated register window with this file instead of anonymous memory")
+    parser.add_argument("--server_mode", choices=["threads", "asyncio"], default="threads",
+                        help="Serve with one thread per port/connection or a single asyncio event loop")
     args = parser.parse_args()
+
+    emulator = None
+    if args.emulate:
+        from piccolo_emu import PiccoloEmulator
+        emulator = PiccoloEmulator(droplet_rate_hz=args.emu_droplet_rate, mmap_path=args.emu_mmap_file,
+                                   verbose=args.verbose)
     
-    piccolo = PiccoloRP(verbose=args.verbose, very_verbose=args.very_verbose)
-    piccolo.start_servers()
+    piccolo = PiccoloRP(verbose=args.verbose, very_verbose=args.very_verbose,
+                        mem_stream_mode=args.mem_stream_mode, adc_format=args.adc_format,
+                        slow_consumer_policy=args.slow_consumer, emulator=emulator)
+    if args.log_dir:
+        piccolo._initialize_binary_log(args.log_dir)
+        threading.Thread(target=piccolo.start_logging, daemon=True).start()
+
+    if args.server_mode == "asyncio":
+        piccolo.start_servers_async()
+    else:
+        piccolo.start_servers()
 
     
     
\ No newline at end of file
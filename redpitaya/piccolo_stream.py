@@ -0,0 +1,167 @@
+# Imports from the python standard library:
+import time
+import threading
+import collections
+
+# Policies for a subscriber whose queue is full when a new item is published
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "disconnect")
+
+
+class Subscriber:
+    """Bounded per-client queue fed by a StreamHub producer."""
+    def __init__(self, maxlen=64, policy="drop_oldest", on_put=None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unsupported slow consumer policy: {policy}")
+        if maxlen < 1:
+            raise ValueError(f"Subscriber queue size must be at least 1, got {maxlen}")
+        self.maxlen = maxlen
+        self.policy = policy
+        self.on_put = on_put  # optional wake-up hook, e.g. for an asyncio handler
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        """Queue an item, applying the slow consumer policy when the queue is full."""
+        with self.cond:
+            if self.closed:
+                return
+            if len(self.queue) >= self.maxlen:
+                if self.policy == "disconnect":
+                    self.closed = True
+                    self.cond.notify_all()
+                    return
+                while len(self.queue) >= self.maxlen:
+                    self.queue.popleft()
+                    self.dropped += 1
+            self.queue.append(item)
+            self.cond.notify()
+
+        if self.on_put:
+            self.on_put()
+
+    def get(self, timeout=None):
+        """Pop the oldest item, waiting up to timeout; None on timeout or once closed."""
+        with self.cond:
+            if not self.queue and not self.closed:
+                self.cond.wait(timeout)
+            if self.queue:
+                return self.queue.popleft()
+            return None
+
+    def get_batch(self, max_items, max_latency, timeout=None):
+        """Pop up to max_items, waiting up to timeout for the first one.
+
+        Only when a backlog is already queued does it wait (up to max_latency) to fill
+        the batch, so a lone item at low rates is returned immediately. [] on timeout or once closed.
+        """
+        with self.cond:
+            if not self.queue and not self.closed:
+                self.cond.wait(timeout)
+            if not self.queue:
+                return []
+
+            batch = [self.queue.popleft()]
+            loaded = bool(self.queue)
+            deadline = time.monotonic() + max_latency
+            while len(batch) < max_items:
+                if self.queue:
+                    batch.append(self.queue.popleft())
+                    continue
+                remaining = deadline - time.monotonic()
+                if not loaded or remaining <= 0 or self.closed:
+                    break
+                self.cond.wait(remaining)
+            return batch
+
+    def close(self):
+        """Stop accepting items and wake any waiting consumer."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+        if self.on_put:
+            self.on_put()
+
+
+class StreamHub:
+    """Fan one producer out to any number of subscribers with bounded queues.
+
+    The optional producer callable runs in its own thread while there are subscribers,
+    so adding a client costs a queue and a send rather than another hardware poll loop.
+    """
+    def __init__(self, name, producer=None):
+        self.name = name
+        self.producer = producer
+        self.subscribers = set()
+        self.latest = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def should_run(self):
+        """Checked by the producer each iteration; releases the producer slot once idle."""
+        with self.lock:
+            if self.subscribers:
+                return True
+            self.thread = None
+            return False
+
+    def subscribe(self, maxlen=64, policy="drop_oldest", on_put=None, replay_latest=False):
+        """Add a subscriber (starting the producer if needed) and return it."""
+        subscriber = Subscriber(maxlen, policy, on_put)
+        with self.lock:
+            if replay_latest and self.latest is not None:
+                subscriber.put(self.latest)
+            self.subscribers.add(subscriber)
+
+            if self.producer and (self.thread is None or not self.thread.is_alive()):
+                self.thread = threading.Thread(target=self._run_producer, daemon=True,
+                                               name=f"{self.name}_producer")
+                self.thread.start()
+
+        return subscriber
+
+    def _run_producer(self):
+        """Run the producer, always releasing its slot so the next subscribe can start a new one."""
+        try:
+            self.producer()
+        except Exception as e:
+            print(f"[StreamHub] {self.name} producer error: {e}")
+        finally:
+            # A producer that ended with subscribers left (it failed) disconnects them, so they resubscribe
+            orphans = []
+            with self.lock:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+                    orphans = list(self.subscribers)
+                    self.subscribers.clear()
+            for subscriber in orphans:
+                subscriber.close()
+
+    def unsubscribe(self, subscriber):
+        """Remove and close a subscriber; the producer exits once none are left."""
+        with self.lock:
+            self.subscribers.discard(subscriber)
+        subscriber.close()
+
+    def set_maxlen(self, maxlen):
+        """Resize the queues of the current subscribers (excess items are dropped on the next put)."""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            with subscriber.cond:
+                subscriber.maxlen = maxlen
+
+    def publish(self, item, only=None):
+        """Push an item to every subscriber (or those only() accepts), dropping those the policy disconnected."""
+        with self.lock:
+            self.latest = item
+            subscribers = list(self.subscribers)
+        if only is not None:
+            subscribers = [subscriber for subscriber in subscribers if only(subscriber)]
+
+        for subscriber in subscribers:
+            subscriber.put(item)
+            if subscriber.closed:
+                self.unsubscribe(subscriber)
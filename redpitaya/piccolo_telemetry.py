@@ -0,0 +1,115 @@
+# Imports from the python standard library:
+import os
+import time
+import resource
+import threading
+import contextlib
+
+# Latency buckets are powers of two in microseconds: bucket k counts durations below 2**k us
+N_LATENCY_BUCKETS = 32
+
+
+class LatencyHistogram:
+    """Log2-bucketed latency histogram; observe() is a handful of integer operations."""
+    def __init__(self):
+        self.buckets = [0] * N_LATENCY_BUCKETS
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def observe(self, seconds):
+        """Record one duration in seconds."""
+        self.buckets[min(int(seconds * 1e6).bit_length(), N_LATENCY_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_s += seconds
+        if seconds > self.max_s:
+            self.max_s = seconds
+
+    def snapshot(self):
+        """Summary with the non-empty buckets keyed by their upper bound in microseconds."""
+        return {
+            "count": self.count,
+            "mean_us": self.total_s / self.count * 1e6 if self.count else 0.0,
+            "max_us": self.max_s * 1e6,
+            "buckets_us": {f"<{2**k}": n for k, n in enumerate(self.buckets) if n},
+            }
+
+
+class Telemetry:
+    """Counters and latency histograms kept by the server loops, plus process CPU and memory."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}  # callables evaluated at snapshot time
+        self.t_start = time.time()
+        self.last_cpu = (time.time(), self._cpu_seconds())
+
+    def count(self, name, n=1):
+        """Add n to a counter."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        """Record a duration in the named latency histogram."""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        """Time the enclosed block into the named histogram."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0)
+
+    def gauge(self, name, func):
+        """Register a callable whose value is sampled into every snapshot."""
+        self.gauges[name] = func
+
+    def _cpu_seconds(self):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def process_stats(self):
+        """CPU (total and since the previous snapshot), memory and thread count of this process."""
+        now, cpu = time.time(), self._cpu_seconds()
+        last_time, last_cpu = self.last_cpu
+        self.last_cpu = (now, cpu)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+
+        stats = {
+            "cpu_s": cpu,
+            "cpu_percent": 100.0 * (cpu - last_cpu) / (now - last_time) if now > last_time else 0.0,
+            "max_rss_kb": usage.ru_maxrss,
+            "threads": threading.active_count(),
+            "load_avg": os.getloadavg(),
+            }
+
+        # Current resident memory is only available from /proc (Linux, as on the Red Pitaya)
+        try:
+            with open("/proc/self/statm") as f:
+                stats["rss_kb"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+        except OSError:
+            pass
+
+        return stats
+
+    def snapshot(self):
+        """JSON-serializable view of all counters, histograms, gauges and process stats."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: h.snapshot() for name, h in self.histograms.items()}
+
+        return {
+            "timestamp": time.time(),
+            "uptime_s": time.time() - self.t_start,
+            "counters": counters,
+            "latency": histograms,
+            "gauges": {name: func() for name, func in self.gauges.items()},
+            "process": self.process_stats(),
+            }
@@ -0,0 +1,68 @@
+# Imports from the python standard library:
+import socket
+import struct
+import ipaddress
+
+# Datagram header: frame sequence number, frame size in bytes, byte offset of this fragment in the
+# frame, fragment index and fragment count. The frame is the ADC_HEADER followed by the samples,
+# exactly as sent on the TCP stream.
+ADC_DATAGRAM_HEADER = struct.Struct("<QIIHH")
+
+# Fragment payload that keeps every datagram within a 1500 byte Ethernet MTU (IP and UDP headers included)
+DEFAULT_DATAGRAM_PAYLOAD = 1400
+MAX_DATAGRAM_PAYLOAD = 65507 - ADC_DATAGRAM_HEADER.size
+
+
+def fragment(buffers, payload_size):
+    """Split the concatenation of buffers into lists of memoryview slices of at most payload_size bytes."""
+    chunk, room = [], payload_size
+    for buffer in buffers:
+        view = memoryview(buffer).cast("B")
+        while view:
+            piece, view = view[:room], view[room:]
+            chunk.append(piece)
+            room -= len(piece)
+            if not room:
+                yield chunk
+                chunk, room = [], payload_size
+    if chunk:
+        yield chunk
+
+
+class DatagramSender:
+    """Send sequence-numbered frames as fragmented UDP datagrams to a unicast address or multicast group.
+
+    Datagrams are gathered straight from the frame buffers with sendmsg, so a frame is never copied.
+    A datagram the kernel cannot queue is dropped with the rest of its frame rather than retried.
+    """
+    def __init__(self, address, port, payload_size=DEFAULT_DATAGRAM_PAYLOAD, ttl=1, interface=None):
+        self.destination = (address, port)
+        self.payload_size = payload_size
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if ipaddress.ip_address(address).is_multicast:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            if interface:
+                self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+
+    def send_frame(self, seq, buffers):
+        """Send one frame; returns (datagrams sent, datagrams in the frame), which differ if a send failed."""
+        frame_size = sum(memoryview(buffer).nbytes for buffer in buffers)
+        n_fragments = max(-(-frame_size // self.payload_size), 1)
+        if n_fragments > 0xFFFF:
+            raise ValueError(f"Frame of {frame_size} bytes needs more than 65535 datagrams")
+
+        offset = 0
+        for index, chunk in enumerate(fragment(buffers, self.payload_size)):
+            header = ADC_DATAGRAM_HEADER.pack(seq, frame_size, offset, index, n_fragments)
+            try:
+                self.sock.sendmsg([header, *chunk], [], 0, self.destination)
+            except OSError:
+                return index, n_fragments
+            offset += sum(len(piece) for piece in chunk)
+
+        return n_fragments, n_fragments
+
+    def close(self):
+        """Close the socket."""
+        self.sock.close()
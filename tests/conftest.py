@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The host modules live at the repository root and the Red Pitaya modules under redpitaya/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "redpitaya"))
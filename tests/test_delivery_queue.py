@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from piccolo_clients import BatchPieces, DeliveryQueue
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        DeliveryQueue(4, policy="newest")
+
+
+def test_drop_oldest():
+    queue = DeliveryQueue(3, policy="drop_oldest")
+    for item in range(5):
+        queue.put(item)
+    assert queue.get_batch() == [2, 3, 4]
+    assert queue.stats()["dropped"] == 2
+
+
+def test_coalesce_merges_into_newest():
+    queue = DeliveryQueue(2, policy="coalesce", coalesce=lambda older, newer: older + newer)
+    for item in ([1], [2], [3], [4]):
+        queue.put(item)
+    assert queue.get_batch() == [[1], [2, 3, 4]]
+    stats = queue.stats()
+    assert (stats["coalesced"], stats["dropped"]) == (2, 0)
+
+
+def test_block_waits_for_consumer():
+    queue = DeliveryQueue(1, policy="block")
+    queue.put(1)
+    producer = threading.Thread(target=queue.put, args=(2,))
+    producer.start()
+    time.sleep(0.05)
+    assert producer.is_alive()
+    assert queue.get_batch() == [1]
+    producer.join(1)
+    assert not producer.is_alive()
+    assert queue.get_batch() == [2]
+    assert queue.stats()["dropped"] == 0
+
+
+def test_close_releases_blocked_producer():
+    queue = DeliveryQueue(1, policy="block")
+    queue.put(1)
+    producer = threading.Thread(target=queue.put, args=(2,))
+    producer.start()
+    queue.close()
+    producer.join(1)
+    assert not producer.is_alive()
+    assert queue.get_batch() == [1]
+
+    # Closed queues take nothing until reopened
+    queue.put(3)
+    assert queue.get_batch(timeout=0) == []
+    queue.open()
+    queue.put(4)
+    assert queue.get_batch() == [4]
+
+
+def test_get_batch_limits_and_timeout():
+    queue = DeliveryQueue(8)
+    for item in range(5):
+        queue.put(item)
+    assert queue.get_batch(max_items=2) == [0, 1]
+    assert queue.get_batch() == [2, 3, 4]
+    t_start = time.perf_counter()
+    assert queue.get_batch(timeout=0.05) == []
+    assert time.perf_counter() - t_start >= 0.04
+
+
+def test_batch_pieces_counts_records():
+    pieces = BatchPieces([[1, 2], [3]])
+    assert (len(pieces), pieces.n_records) == (2, 3)
+    assert BatchPieces().n_records == 0
@@ -0,0 +1,56 @@
+from piccolo_clients import DropletCounter
+
+
+def test_consecutive_ids():
+    counter = DropletCounter()
+    counter.add([5, 6, 7])
+    counter.add(8)
+    assert (counter.received, counter.missed, counter.duplicates) == (4, 0, 0)
+    assert counter.last_id == 8
+
+
+def test_gaps_and_duplicates():
+    counter = DropletCounter()
+    counter.add([1, 2, 2, 5, 5, 5, 6])
+    assert (counter.received, counter.missed, counter.duplicates) == (4, 2, 3)
+    assert counter.loss_rate() == 2 / 6
+
+
+def test_gap_between_batches():
+    counter = DropletCounter()
+    counter.add([1, 2])
+    counter.add([10, 11])
+    assert (counter.received, counter.missed) == (4, 7)
+
+
+def test_wrap_around():
+    counter = DropletCounter(id_bits=8)
+    counter.add([254, 255, 0, 2])
+    assert (counter.received, counter.missed, counter.wraps, counter.resets) == (4, 1, 1, 0)
+
+
+def test_backward_jump_is_a_reset():
+    counter = DropletCounter()
+    counter.add([1000, 1001])
+    counter.add([3, 4])
+    assert (counter.received, counter.missed, counter.resets) == (4, 0, 1)
+    assert counter.last_id == 4
+
+
+def test_loss_series_and_reset():
+    counter = DropletCounter(interval_s=0)
+    counter.add([1, 2, 4])
+    now, received, missed, loss_rate = counter.loss_series[-1]
+    assert (received, missed, loss_rate) == (3, 1, 0.25)
+    assert counter.snapshot()["recent_loss_rate"] == 0.25
+
+    counter.reset()
+    snapshot = counter.snapshot()
+    assert (snapshot["received"], snapshot["missed"], snapshot["last_id"]) == (0, 0, None)
+    assert snapshot["recent_loss_rate"] is None
+
+
+def test_empty_batch():
+    counter = DropletCounter()
+    counter.add([])
+    assert counter.snapshot()["last_id"] is None
@@ -0,0 +1,125 @@
+import time
+
+import pytest
+
+from piccolo_clients import ADC_DATAGRAM_HEADER, FrameReassembler
+from piccolo_udp import fragment
+
+FRAME_SIZE = 350
+PAYLOAD_SIZE = 100  # four datagrams per frame
+
+
+def datagrams(seq, frame=None):
+    """The datagrams DatagramSender sends for one frame."""
+    frame = bytes([seq % 256]) * FRAME_SIZE if frame is None else frame
+    chunks = [b"".join(bytes(piece) for piece in chunk) for chunk in fragment([frame], PAYLOAD_SIZE)]
+    out, offset = [], 0
+    for index, chunk in enumerate(chunks):
+        out.append(ADC_DATAGRAM_HEADER.pack(seq, len(frame), offset, index, len(chunks)) + chunk)
+        offset += len(chunk)
+    return out
+
+
+def feed(reassembler, packets):
+    """Add datagrams in the given order; returns the sequence numbers of the frames completed."""
+    return [result[0] for result in map(reassembler.add, packets) if result]
+
+
+def test_complete_frame():
+    reassembler = FrameReassembler()
+    frame = bytes(range(256)) + bytes(FRAME_SIZE - 256)
+    packets = datagrams(1, frame)
+    results = [reassembler.add(packet) for packet in packets]
+    assert results[:-1] == [None] * (len(packets) - 1)
+    seq, buffer, n_fragments, t_first = results[-1]
+    assert (seq, bytes(buffer), n_fragments) == (1, frame, len(packets))
+    assert reassembler.stats()["frames"] == 1
+
+
+def test_fragments_out_of_order():
+    reassembler = FrameReassembler()
+    assert feed(reassembler, datagrams(1)[::-1]) == [1]
+
+
+def test_interleaved_frames_complete_in_order():
+    reassembler = FrameReassembler()
+    d6, d7 = datagrams(6), datagrams(7)
+    assert feed(reassembler, [d6[0], d7[0], d6[1], d7[1], d6[2], d6[3], d7[2], d7[3]]) == [6, 7]
+    assert reassembler.incomplete == 0
+
+
+def test_newer_frame_completing_drops_older():
+    reassembler = FrameReassembler()
+    d6, d7 = datagrams(6), datagrams(7)
+    assert feed(reassembler, d6[:3] + d7) == [7]
+    assert reassembler.incomplete == 1
+
+    # The rest of frame 6 arrives too late to be shown in order
+    assert feed(reassembler, d6[3:]) == []
+    assert reassembler.late == 1
+
+
+def test_max_pending():
+    reassembler = FrameReassembler(max_pending=2)
+    assert feed(reassembler, [datagrams(seq)[0] for seq in (1, 2, 3)]) == []
+    assert sorted(reassembler.pending) == [2, 3]
+    assert reassembler.incomplete == 1
+
+
+def test_duplicate_and_late_datagrams():
+    reassembler = FrameReassembler()
+    d1 = datagrams(1)
+    assert feed(reassembler, d1[:2] + d1[1:2] + d1[2:]) == [1]
+    assert reassembler.duplicates == 1
+    assert feed(reassembler, d1[:1]) == []
+    assert reassembler.late == 1
+    assert reassembler.resyncs == 0
+
+
+def test_invalid_datagrams():
+    reassembler = FrameReassembler()
+    assert reassembler.add(b"short") is None
+    assert reassembler.add(ADC_DATAGRAM_HEADER.pack(1, FRAME_SIZE, 0, 0, 0)) is None
+    assert reassembler.add(ADC_DATAGRAM_HEADER.pack(1, FRAME_SIZE, FRAME_SIZE - 1, 0, 4) + b"xx") is None
+    assert reassembler.invalid == 3
+
+
+def test_resync_on_large_sequence_reset():
+    reassembler = FrameReassembler(resync_frames=16, resync_idle_s=60)
+    for seq in range(1, 101):
+        feed(reassembler, datagrams(seq))
+    assert feed(reassembler, datagrams(1)) == [1]
+    assert reassembler.resyncs == 1
+    assert feed(reassembler, datagrams(2)) == [2]
+
+
+def test_small_step_back_is_late_within_idle_window():
+    reassembler = FrameReassembler(resync_frames=16, resync_idle_s=60)
+    for seq in range(1, 11):
+        feed(reassembler, datagrams(seq))
+    assert feed(reassembler, datagrams(1)) == []
+    assert reassembler.late == len(datagrams(1))
+    assert reassembler.resyncs == 0
+
+
+def test_resync_on_small_sequence_reset_after_idle():
+    reassembler = FrameReassembler(resync_frames=16, resync_idle_s=0.05)
+    for seq in range(1, 4):
+        feed(reassembler, datagrams(seq))
+    time.sleep(0.1)
+    assert feed(reassembler, datagrams(1)) == [1]
+    assert reassembler.resyncs == 1
+    assert reassembler.late == 0
+
+
+def test_reset_clears_counts():
+    reassembler = FrameReassembler()
+    feed(reassembler, datagrams(1))
+    reassembler.reset()
+    assert reassembler.stats()["frames"] == 0
+    assert feed(reassembler, datagrams(1)) == [1]
+
+
+def test_resync_frames_must_exceed_max_pending():
+    with pytest.raises(ValueError):
+        FrameReassembler(max_pending=4, resync_frames=4)
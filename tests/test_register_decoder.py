@@ -0,0 +1,119 @@
+import json
+import mmap
+
+import numpy as np
+import pytest
+
+from piccolo_rp import RegisterDecoder
+
+
+def var(name, offset, bits, signed=False, is_bool=False, fmt="<I"):
+    return {"name": name, "offset": offset, "bits": bits, "signed": signed, "bool": is_bool, "fmt": fmt}
+
+
+VARS = [
+    var("count", 0x00, 32),
+    var("adc", 0x04, 14, signed=True, fmt="<h"),
+    var("flags", 0x08, 3, is_bool=True, fmt="<B"),
+    var("offset", 0x0C, 32, signed=True, fmt="<i"),
+    var("mask", 0x10, 16, is_bool=True, fmt="<H"),
+]
+
+
+@pytest.fixture
+def decoder():
+    return RegisterDecoder(VARS)
+
+
+def test_mask_and_sign_tables(decoder):
+    assert decoder.index.tolist() == [0, 1, 2, 3, 4]
+    assert decoder.mask.tolist() == [2**32 - 1, 2**14 - 1, 0b111, 2**32 - 1, 2**16 - 1]
+    assert decoder.sign.tolist() == [0, 2**13, 0, 2**31, 0]
+    assert decoder.bool_idx == [2, 4]
+    assert decoder.sign_extend
+
+
+def test_unsigned_decoder_skips_sign_extension():
+    decoder = RegisterDecoder([var("count", 0, 32), var("flags", 4, 1, is_bool=True, fmt="<B")])
+    assert not decoder.sign_extend
+    words = np.array([0xFFFFFFFF, 0xFFFFFFFF], dtype="<u4")
+    assert decoder.decode(words).tolist() == [2**32 - 1, 1]
+
+
+@pytest.mark.parametrize("word, value", [
+    (0x00000000, 0),
+    (0x00001FFF, 8191),
+    (0x00002000, -8192),
+    (0x00003FFF, -1),
+    (0xFFFF1FFF, 8191),  # bits above the register width are ignored
+    (0xABCD2001, -8191),
+])
+def test_decode_14_bit_signed(decoder, word, value):
+    words = np.array([0, word, 0, 0, 0], dtype="<u4")
+    assert decoder.decode(words)[1] == value
+
+
+def test_decode_32_bit_values(decoder):
+    words = np.array([0xFFFFFFFF, 0, 0, 0xFFFFFFFF, 0], dtype="<u4")
+    vals = decoder.decode(words)
+    assert vals[0] == 2**32 - 1
+    assert vals[3] == -1
+    words = np.array([0x80000000, 0, 0, 0x80000000, 0], dtype="<u4")
+    vals = decoder.decode(words)
+    assert vals[0] == 2**31
+    assert vals[3] == -2**31
+
+
+def test_read_gathers_registers_from_mmap(decoder):
+    mm = mmap.mmap(-1, 0x2000)
+    try:
+        words = np.frombuffer(mm, dtype="<u4")
+        words[:5] = [7, 0x3FFE, 0b1101, 0xFFFFFFFE, 0xF0A5]
+        del words
+        assert decoder.read(mm).tolist() == [7, -2, 0b101, -2, 0xF0A5]
+    finally:
+        mm.close()
+
+
+def test_to_dict_matches_get_var_formatting(decoder):
+    vals = decoder.decode(np.array([7, 0x3FFE, 0b101, 3, 0], dtype="<u4"))
+    assert decoder.to_dict(vals) == {"count": 7, "adc": -2, "flags": "101", "offset": 3, "mask": "0"}
+    assert all(type(value) is int for name, value in decoder.to_dict(vals).items() if name not in ("flags", "mask"))
+
+
+def test_to_json_matches_json_dumps(decoder):
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        vals = decoder.decode(rng.integers(0, 2**32, size=len(VARS), dtype=np.uint64).astype("<u4"))
+        assert decoder.to_json(vals) == json.dumps(decoder.to_dict(vals)).encode()
+
+
+def test_pack_matches_schema(decoder):
+    vals = decoder.decode(np.array([7, 0x3FFE, 0b101, 0xFFFFFFFE, 0xF0A5], dtype="<u4"))
+    record = decoder.pack(vals)
+    schema = decoder.schema()
+    assert len(record) == schema["itemsize"]
+    decoded = np.frombuffer(record, dtype=[tuple(field) for field in schema["fields"]])[0]
+    assert list(decoded.tolist()) == [7, -2, 0b101, -2, 0xF0A5]
+
+
+def test_decoder_matches_get_var_on_the_memory_map():
+    from piccolo_emu import PiccoloEmulator
+    from piccolo_rp import PiccoloRP
+
+    emulator = PiccoloEmulator()
+    try:
+        piccolo = PiccoloRP(emulator=emulator)
+        # Freeze the droplet model so the registers hold still, then fill them with arbitrary words
+        emulator.stop_event.set()
+        if emulator.thread:
+            emulator.thread.join()
+            emulator.thread = None
+        words = np.frombuffer(piccolo.mmap, dtype="<u4")
+        words[:] = np.random.default_rng(1).integers(0, 2**32, size=len(words), dtype=np.uint64)
+        del words
+
+        values = piccolo.decoder.to_dict(piccolo.decoder.read(piccolo.mmap))
+        assert values == {name: piccolo.get_var(name) for name in piccolo.decoder.names}
+    finally:
+        emulator.stop()
@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+from piccolo_stream import StreamHub, Subscriber
+
+
+def test_subscriber_drop_oldest():
+    subscriber = Subscriber(maxlen=2)
+    for item in range(4):
+        subscriber.put(item)
+    assert subscriber.dropped == 2
+    assert subscriber.get_batch(max_items=4, max_latency=0) == [2, 3]
+
+
+def test_subscriber_disconnect():
+    subscriber = Subscriber(maxlen=1, policy="disconnect")
+    subscriber.put(1)
+    subscriber.put(2)
+    assert subscriber.closed
+    assert subscriber.get(timeout=0) == 1
+    assert subscriber.get(timeout=0) is None
+
+
+@pytest.mark.parametrize("kwargs", [{"policy": "block"}, {"maxlen": 0}])
+def test_subscriber_rejects_bad_settings(kwargs):
+    with pytest.raises(ValueError):
+        Subscriber(**kwargs)
+
+
+def test_publish_fans_out():
+    hub = StreamHub("test")
+    first, second = hub.subscribe(), hub.subscribe(maxlen=1, policy="disconnect")
+    hub.publish(1)
+    hub.publish(2, only=lambda subscriber: subscriber is first)
+    hub.publish(3)
+    assert list(first.queue) == [1, 2, 3]
+    assert list(second.queue) == [1]
+    assert second.closed and second not in hub.subscribers
+
+    late = hub.subscribe(replay_latest=True)
+    assert list(late.queue) == [3]
+
+
+def test_producer_stops_once_idle():
+    hub = StreamHub("test")
+    published = threading.Event()
+
+    def producer():
+        while hub.should_run():
+            hub.publish("item")
+            published.set()
+
+    hub.producer = producer
+    subscriber = hub.subscribe()
+    assert published.wait(1)
+    thread = hub.thread
+    hub.unsubscribe(subscriber)
+    thread.join(1)
+    assert not thread.is_alive()
+    assert hub.thread is None
+
+
+def test_failed_producer_releases_slot():
+    hub = StreamHub("test")
+    calls = []
+    failed = threading.Event()
+
+    def producer():
+        calls.append(1)
+        if len(calls) == 1:
+            failed.set()
+            raise RuntimeError("hardware read failed")
+        while hub.should_run():
+            hub.publish("item")
+
+    hub.producer = producer
+    first = hub.subscribe()
+    assert failed.wait(1)
+    assert first.get(timeout=1) is None  # disconnected so its client resubscribes
+    assert first.closed
+
+    second = hub.subscribe()
+    assert second.get(timeout=1) == "item"
+    assert len(calls) == 2
+    hub.unsubscribe(second)